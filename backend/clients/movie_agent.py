@@ -2,8 +2,10 @@ import json
 import logging
 import asyncio
 import re
+import time
 import traceback
 
+from contextlib import nullcontext
 from pydantic import BaseModel
 from openai import AsyncOpenAI
 from openai.types.chat import (
@@ -11,10 +13,12 @@ from openai.types.chat import (
     ChatCompletionUserMessageParam,
     ChatCompletionToolParam,
 )
-from typing import AsyncGenerator, List, Set, Optional, Union
+from typing import AsyncGenerator, List, Set, Optional, Tuple, Union
 
 from db_managers import AsyncSessionFactory, MovieManager
 from clients.kp_client import KinopoiskClient
+from clients.rerank import LocalReranker, RerankCache, RerankLoad, RerankPromptBuilder
+from clients.rerank.prompt import format_movies
 from clients.weaviate_client import MovieWeaviateRecommender
 from models import MovieObject, MovieResponseLocalized
 from models.movies import to_name_dicts
@@ -31,6 +35,10 @@ from settings import (
     RERANK_PROMPT_TEMPLATE_RU,
     RERANK_PROMPT_TEMPLATE_EN,
     DEFAULT_LOCALE,
+    FAST_START_CARDS,
+    FAST_START_RERANK_BUDGET,
+    LOCAL_RERANK_PREFILTER_SIZE,
+    RERANK_PROMPT_MAX_CANDIDATES,
 )
 
 logger = logging.getLogger(__name__)
@@ -54,7 +62,11 @@ class MovieAgent:
                  recommender: MovieWeaviateRecommender,
                  system_prompt: str = SYSTEM_PROMPT_AGENT,
                  tools: List[ChatCompletionToolParam] = TOOLS_AGENT,
-                 model: str = MODEL_QA
+                 model: str = MODEL_QA,
+                 rerank_cache: Optional[RerankCache] = None,
+                 local_reranker: Optional[LocalReranker] = None,
+                 rerank_load: Optional[RerankLoad] = None,
+                 rerank_prompts: Optional[RerankPromptBuilder] = None,
                  ):
         self.openai_client = openai_client
         self.kp_client = kp_client
@@ -62,6 +74,10 @@ class MovieAgent:
         self.system_prompt = system_prompt
         self.tools = tools
         self.model = model
+        self.rerank_cache = rerank_cache
+        self.local_reranker = local_reranker
+        self.rerank_load = rerank_load
+        self.rerank_prompts = rerank_prompts or RerankPromptBuilder()
         self.messages: List[dict] = [
             {"role": "system", "content": self.system_prompt}
         ]
@@ -157,11 +173,7 @@ class MovieAgent:
 
     @staticmethod
     def _format_movies_for_rerank(movies: List[MovieObject], locale: str = "ru") -> str:
-        lines = []
-        for i, m in enumerate(movies):
-            name = MovieAgent._get_movie_name(m, locale)
-            lines.append(f"{i + 1}. [{name}] {m['page_content'][:200]}")
-        return "\n".join(lines)
+        return format_movies(movies, locale, snippet_length=200)
 
     @staticmethod
     def _normalize_title(title: str) -> str:
@@ -232,73 +244,237 @@ class MovieAgent:
             criteria_parts.append(f"{genre_label}: {', '.join(genres)}")
         criteria_context = "\n".join(criteria_parts)
 
-        # Выбрать промпт в зависимости от локализации
+        # Выбрать промпт в зависимости от локализации; кандидаты, не поместившиеся в бюджет
+        # токенов, в промпт не идут и уходят в хвост выдачи
         rerank_template = RERANK_PROMPT_TEMPLATE_EN if locale == "en" else RERANK_PROMPT_TEMPLATE_RU
-        rerank_prompt = rerank_template.format(
+        rerank_prompt = self.rerank_prompts.build(
+            rerank_template,
+            movies,
+            locale=locale,
             query=query,
-            movies_list=self._format_movies_for_rerank(movies, locale),
-            movies_count=len(movies),
             exclude_instruction=exclude_instruction,
             criteria_context=criteria_context,
         )
+        movies = rerank_prompt.movies
+
+        kp_ids = [m.get("kp_id") for m in movies]
+        cache_key = None
+        if self.rerank_cache is not None:
+            cache_key = RerankCache.key(MODEL_RERANK, locale, query, f"{exclude_instruction}\n{criteria_context}")
+            cached_order = self.rerank_cache.lookup(cache_key, kp_ids)
+            if cached_order is not None:
+                logger.info(f"[MovieAgent] Rerank из кэша: {len(cached_order)} фильмов, без запроса к модели")
+                by_kp_id = {m.get("kp_id"): m for m in movies}
+                for kp_id in cached_order:
+                    yield by_kp_id[kp_id]
+                return
 
         # Выбрать системный промпт в зависимости от локализации
         system_content = "You are a movie recommendation assistant." if locale == "en" else "Ты помощник по подбору фильмов."
 
+        started_at = time.monotonic()
         response = await asyncio.wait_for(
             self.openai_client.chat.completions.create(
                 model=MODEL_RERANK,
                 messages=[
                     ChatCompletionSystemMessageParam(role="system", content=system_content),
-                    ChatCompletionUserMessageParam(role="user", content=rerank_prompt)
+                    ChatCompletionUserMessageParam(role="user", content=rerank_prompt.prompt)
                 ],
                 stream=True,
+                stream_options={"include_usage": True},
             ),
             timeout=30,
         )
 
         buffer = ""
+        prompt_tokens = None
         rerank_yielded = []
         seen_kp_ids = set()  # Отслеживаем уже выданные фильмы для дедупликации
         rerank_duplicates_count = 0  # Счетчик дубликатов в rerank
+
+        def parse_line(line: str) -> Optional[MovieObject]:
+            nonlocal rerank_duplicates_count
+            try:
+                idx = int(line.strip()) - 1
+            except ValueError:
+                return None
+            if not 0 <= idx < len(movies):
+                return None
+            movie = movies[idx]
+            kp_id = movie.get("kp_id")
+
+            # Дедупликация: пропускаем фильмы, которые уже были выданы
+            if kp_id in seen_kp_ids:
+                rerank_duplicates_count += 1
+                logger.warning(
+                    f"[MovieAgent] Rerank пытается выдать дубликат: kp_id={kp_id}, "
+                    f"позиция в исходном списке={idx+1}, пропускаем"
+                )
+                return None
+
+            seen_kp_ids.add(kp_id)
+            rerank_yielded.append(kp_id)
+            logger.debug(
+                f"[MovieAgent] Rerank выдал фильм: kp_id={kp_id}, "
+                f"позиция в исходном списке={idx+1}"
+            )
+            return movie
+
         async for chunk in response:
+            if not chunk.choices and getattr(chunk, "usage", None):
+                # Последний чанк потока (include_usage) — без choices, с расходом токенов
+                prompt_tokens = chunk.usage.prompt_tokens
             if chunk.choices and chunk.choices[0].delta.content:
                 buffer += chunk.choices[0].delta.content
                 lines = buffer.split("\n")
                 buffer = lines.pop()
 
                 for line in lines:
-                    try:
-                        idx = int(line.strip()) - 1
-                        if 0 <= idx < len(movies):
-                            movie = movies[idx]
-                            kp_id = movie.get("kp_id")
-                            
-                            # Дедупликация: пропускаем фильмы, которые уже были выданы
-                            if kp_id in seen_kp_ids:
-                                rerank_duplicates_count += 1
-                                logger.warning(
-                                    f"[MovieAgent] Rerank пытается выдать дубликат: kp_id={kp_id}, "
-                                    f"позиция в исходном списке={idx+1}, пропускаем"
-                                )
-                                continue
-                            
-                            seen_kp_ids.add(kp_id)
-                            rerank_yielded.append(kp_id)
-                            logger.debug(
-                                f"[MovieAgent] Rerank выдал фильм: kp_id={kp_id}, "
-                                f"позиция в исходном списке={idx+1}"
-                            )
-                            yield movie
-                    except ValueError:
-                        continue
-        
+                    movie = parse_line(line)
+                    if movie is not None:
+                        yield movie
+
+        # Последняя строка ответа может прийти без перевода строки
+        movie = parse_line(buffer)
+        if movie is not None:
+            yield movie
+
+        # Сюда доходим, только если поток прочитан до конца
+        self.rerank_prompts.observe(
+            rerank_prompt, time.monotonic() - started_at, prompt_tokens=prompt_tokens, source="MovieAgent"
+        )
+        if cache_key is not None:
+            self.rerank_cache.store(cache_key, kp_ids, rerank_yielded)
+
         logger.info(
             f"[MovieAgent] Завершен rerank: выдано {len(rerank_yielded)} уникальных фильмов, "
             f"отфильтровано дубликатов в rerank: {rerank_duplicates_count}. "
             f"KP IDs: {rerank_yielded[:20]}{'...' if len(rerank_yielded) > 20 else ''}"
         )
 
+    async def _local_order(self, query: str, movies: List[MovieObject]) -> List[MovieObject]:
+        """Кандидаты в порядке локального реранка; без него или при ошибке — как есть."""
+        if self.local_reranker is None:
+            return movies
+        try:
+            return await self.local_reranker.rank(query, movies)
+        except Exception as e:
+            logger.warning(f"[MovieAgent] Ошибка локального rerank: {e}, исходный порядок")
+            return movies
+
+    async def _movies_in_rerank_order(
+            self,
+            movies: List[MovieObject],
+            query: str,
+            locale: str,
+            movie_name: Optional[str],
+            genres: Optional[list],
+            skip_rerank: bool,
+            fast_start: int = 0,
+            latency_budget: Optional[float] = None,
+    ) -> AsyncGenerator[Tuple[MovieObject, bool], None]:
+        """
+        Фильмы в порядке выдачи: (фильм, provisional). Без реранка — все фильмы recommend как есть.
+        С реранком — первые RERANK_PROMPT_MAX_CANDIDATES фильмов: каждый фильм отдаётся сразу, как только его номер
+        разобран из потока модели, а затем — не названные моделью в локальном порядке
+        (и при ошибке реранка, с места обрыва).
+
+        Локальный порядок (local_reranker: векторы + слова запроса, без LLM) считается только
+        по необходимости: если LLM-реранков в работе больше лимита rerank_load — для всех
+        кандидатов вместо модели; при LOCAL_RERANK_PREFILTER_SIZE > 0 — чтобы модель ранжировала
+        только его верхние N; при ошибке или таймауте реранка — для ещё не отданных фильмов.
+        Если модель ответила, не названные ею фильмы идут в исходном порядке.
+
+        fast_start > 0: пока реранк идёт в фоне, первые fast_start фильмов по векторному порядку
+        отдаются сразу с provisional=True, реранк их пропускает. Если первый номер от модели
+        не пришёл за latency_budget секунд, реранк отменяется и остаток идёт в локальном порядке.
+        """
+        if skip_rerank:
+            for movie in movies:
+                yield movie, False
+            return
+
+        rerank_input = movies[:RERANK_PROMPT_MAX_CANDIDATES]
+
+        if self.rerank_load is not None and self.rerank_load.overloaded():
+            for movie in await self._local_order(query, rerank_input):
+                yield movie, False
+            return
+
+        llm_input = rerank_input
+        local_order: Optional[List[MovieObject]] = None
+        if LOCAL_RERANK_PREFILTER_SIZE and self.local_reranker is not None \
+                and len(rerank_input) > LOCAL_RERANK_PREFILTER_SIZE:
+            local_order = await self._local_order(query, rerank_input)
+            llm_input = local_order[:LOCAL_RERANK_PREFILTER_SIZE]
+            logger.info(
+                f"[MovieAgent] Pre-filter локальным rerank: в модель {len(llm_input)} из {len(rerank_input)}"
+            )
+
+        queue: asyncio.Queue = asyncio.Queue()
+        rerank_failed = False
+
+        async def pump_rerank():
+            nonlocal rerank_failed
+            try:
+                with self.rerank_load.track() if self.rerank_load is not None else nullcontext():
+                    async for reranked in self._rerank_movies_streaming(
+                        query, llm_input, locale=locale,
+                        source_movie_name=movie_name,
+                        genres=genres,
+                    ):
+                        queue.put_nowait(reranked)
+            except Exception as e:
+                rerank_failed = True
+                logger.error(f"[MovieAgent] Ошибка rerank: {e}, fallback на оставшиеся фильмы")
+            finally:
+                queue.put_nowait(None)
+
+        rerank_task = asyncio.create_task(pump_rerank())
+        sent_kp_ids = set()
+        reranked_count = 0
+        try:
+            for movie in rerank_input[:fast_start]:
+                sent_kp_ids.add(movie.get("kp_id"))
+                yield movie, True
+
+            deadline = time.monotonic() + latency_budget if fast_start and latency_budget is not None else None
+            while True:
+                timeout = None
+                if deadline is not None and reranked_count == 0:
+                    timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    movie = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    logger.warning(
+                        f"[MovieAgent] Rerank не уложился в {latency_budget}с до первого фильма, "
+                        f"остаток в локальном порядке"
+                    )
+                    rerank_failed = True
+                    break
+                if movie is None:
+                    break
+                reranked_count += 1
+                if movie.get("kp_id") in sent_kp_ids:
+                    continue
+                sent_kp_ids.add(movie.get("kp_id"))
+                yield movie, False
+        finally:
+            rerank_task.cancel()
+
+        # Дополнить фильмами, которые реранк не вернул (модель может вернуть не все)
+        remaining = [m for m in local_order or rerank_input if m.get("kp_id") not in sent_kp_ids]
+        if rerank_failed and local_order is None:
+            remaining = await self._local_order(query, remaining)
+        if remaining:
+            logger.info(
+                f"[MovieAgent] Rerank вернул {reranked_count}/{len(llm_input)}, "
+                f"дополняем {len(remaining)} фильмами в "
+                f"{'локальном' if rerank_failed or local_order is not None else 'исходном'} порядке"
+            )
+        for movie in remaining:
+            yield movie, False
+
     @staticmethod
     async def _get_user_excluded_kp_ids(
             user_id,
@@ -625,6 +801,7 @@ class MovieAgent:
             rating_kp: float = 0.0,
             rating_imdb: float = 0.0,
             skip_rerank: bool = False,
+            fast_start: bool = False,
     ) -> AsyncGenerator[dict, None]:
         """
         Поиск фильмов на основе финального запроса
@@ -633,6 +810,8 @@ class MovieAgent:
             user_id: ID пользователя (int для Telegram) или device_id (str для iOS)
             platform: 'telegram' or 'ios'
             locale: 'ru' or 'en' - локализация клиента
+            fast_start: первые FAST_START_CARDS карточек отдаются до реранка с "provisional": true,
+                при реранке дольше FAST_START_RERANK_BUDGET — векторный порядок
         """
         # Инициализируем query пустой строкой, если он None
         if query is None:
@@ -701,40 +880,23 @@ class MovieAgent:
             if auto_skip_rerank and not skip_rerank:
                 skip_reason = "прямой поиск фильма" if is_direct_search else "поиск по актёру/режиссёру"
                 logger.info(f"[MovieAgent] Авто-пропуск реранка: {skip_reason}")
+            if skip_rerank:
+                logger.info("[MovieAgent] skip_rerank=true, пропускаем реранк")
 
-            # Реранк с fallback на прямую итерацию при ошибке
-            reranked_movies = []
-            if skip_rerank or auto_skip_rerank:
-                if skip_rerank:
-                    logger.info("[MovieAgent] skip_rerank=true, пропускаем реранк")
-                reranked_movies = list(movies)
-            else:
-                rerank_input = movies[:40]
-                try:
-                    async for movie in self._rerank_movies_streaming(
-                        query, rerank_input, locale=locale,
-                        source_movie_name=movie_name,
-                        genres=genres,
-                    ):
-                        reranked_movies.append(movie)
-                except Exception as e:
-                    logger.error(
-                        f"[MovieAgent] Ошибка rerank (выдано {len(reranked_movies)} фильмов): {e}, "
-                        f"fallback на оставшиеся фильмы"
-                    )
-
-                # Дополнить фильмами, которые реранк не вернул (модель может вернуть не все)
-                if len(reranked_movies) < len(rerank_input):
-                    reranked_kp_ids = {m.get("kp_id") for m in reranked_movies}
-                    remaining = [m for m in rerank_input if m.get("kp_id") not in reranked_kp_ids]
-                    if remaining:
-                        logger.info(
-                            f"[MovieAgent] Rerank вернул {len(reranked_movies)}/{len(rerank_input)}, "
-                            f"дополняем {len(remaining)} фильмами в исходном порядке"
-                        )
-                        reranked_movies.extend(remaining)
+            # Фильмы идут в обработку по мере разбора потока реранка, а не после его завершения
+            ordered_movies = self._movies_in_rerank_order(
+                movies,
+                query=query,
+                locale=locale,
+                movie_name=movie_name,
+                genres=genres,
+                skip_rerank=skip_rerank or auto_skip_rerank,
+                fast_start=FAST_START_CARDS if fast_start else 0,
+                latency_budget=FAST_START_RERANK_BUDGET,
+            )
+            started_at = time.monotonic()
 
-            for movie in reranked_movies:
+            async for movie, provisional in ordered_movies:
                 rerank_count += 1
                 kp_id = movie.get("kp_id")
                 logger.debug(
@@ -780,12 +942,20 @@ class MovieAgent:
                         continue
                     
                     yielded_kp_ids.add(enriched_kp_id)
+                    if enriched_count == 1:
+                        logger.info(
+                            f"[MovieAgent] Первая карточка для user_id={user_id} через "
+                            f"{time.monotonic() - started_at:.2f}с после recommend"
+                        )
                     logger.info(
                         f"[MovieAgent] Выдаем фильм #{enriched_count} пользователю user_id={user_id}: "
                         f"kp_id={enriched_kp_id}, "
                         f"title={getattr(enriched, 'title_ru', None) or getattr(enriched, 'name', None) or 'N/A'}"
                     )
-                    yield {"type": "movie", **enriched.model_dump()}
+                    if provisional:
+                        yield {"type": "movie", "provisional": True, **enriched.model_dump()}
+                    else:
+                        yield {"type": "movie", **enriched.model_dump()}
                 else:
                     logger.warning(
                         f"[MovieAgent] Не удалось обогатить фильм kp_id={kp_id} для user_id={user_id}"
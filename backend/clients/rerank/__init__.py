@@ -0,0 +1,12 @@
+from .cache import RerankCache
+from .load import RerankLoad
+from .local import LocalReranker
+from .prompt import RerankPrompt, RerankPromptBuilder
+
+__all__ = [
+    "RerankCache",
+    "RerankLoad",
+    "LocalReranker",
+    "RerankPrompt",
+    "RerankPromptBuilder",
+]
@@ -0,0 +1,102 @@
+"""
+Кэш ответов LLM-реранка: перестановка кандидатов по (модель, локаль, запрос, инструкции).
+
+Запрос лендинга "фильмы похожие на X" и популярные атмосферные запросы повторяются с тем же
+списком кандидатов, и модель каждый раз заново возвращает почти ту же перестановку.
+Перестановка хранится как порядок kp_id, поэтому её можно переиспользовать и частично:
+если исключения пользователя убрали часть кандидатов (а снизу подтянулись новые),
+порядок известных кандидатов берётся из кэша, новые уходят в хвост, как и фильмы,
+которые модель не назвала.
+"""
+import logging
+
+from typing import Hashable, List, Optional, Sequence, Tuple
+
+from clients.search.caching import LRUCache
+from settings import (
+    RERANK_CACHE_MAX_ENTRIES,
+    RERANK_CACHE_MAX_BYTES,
+    RERANK_CACHE_TTL,
+    RERANK_CACHE_MIN_COVERAGE,
+    RERANK_CACHE_VARIANTS,
+)
+
+logger = logging.getLogger(__name__)
+
+# (кандидаты в порядке промпта, перестановка модели) — оба как kp_id
+RerankVariant = Tuple[Tuple[int, ...], Tuple[int, ...]]
+
+
+def _sizeof_variants(variants: List[RerankVariant]) -> int:
+    return 64 + sum(32 * (len(candidates) + len(order)) for candidates, order in variants)
+
+
+class RerankCache:
+    """
+    LRU с TTL и лимитом памяти. Ключ — (model, locale, нормализованный запрос, instructions),
+    значение — до `variants` последних наборов кандидатов с их перестановками.
+
+    lookup() возвращает порядок kp_id для текущих кандидатов:
+    - точное совпадение набора — сохранённая перестановка целиком;
+    - частичное — если известных кандидатов не меньше min_coverage от текущего набора,
+      перестановка, ограниченная текущими кандидатами (неизвестные вызывающий допишет в хвост).
+    """
+
+    def __init__(
+            self,
+            max_entries: int = RERANK_CACHE_MAX_ENTRIES,
+            max_bytes: int = RERANK_CACHE_MAX_BYTES,
+            ttl: float = RERANK_CACHE_TTL,
+            min_coverage: float = RERANK_CACHE_MIN_COVERAGE,
+            variants: int = RERANK_CACHE_VARIANTS,
+    ):
+        self.cache = LRUCache(
+            name="rerank_results",
+            max_entries=max_entries,
+            ttl=ttl,
+            max_bytes=max_bytes,
+            sizeof=_sizeof_variants,
+        )
+        self.min_coverage = min_coverage
+        self.variants = variants
+        self.exact_hits = 0
+        self.partial_hits = 0
+
+    @staticmethod
+    def key(model: str, locale: str, query: str, instructions: str = "") -> Tuple[Hashable, ...]:
+        return model, locale, " ".join((query or "").lower().split()), " ".join((instructions or "").split())
+
+    def lookup(self, key: Tuple[Hashable, ...], kp_ids: Sequence[int]) -> Optional[List[int]]:
+        variants = self.cache.get(key)
+        if not variants or not kp_ids:
+            return None
+        candidates = tuple(kp_ids)
+        for cached_candidates, order in variants:
+            if cached_candidates == candidates:
+                self.exact_hits += 1
+                return list(order)
+
+        wanted = set(candidates)
+        best: Optional[Tuple[float, Tuple[int, ...]]] = None
+        for cached_candidates, order in variants:
+            coverage = len(wanted.intersection(cached_candidates)) / len(wanted)
+            if coverage >= self.min_coverage and (best is None or coverage > best[0]):
+                best = (coverage, order)
+        if best is None:
+            return None
+        self.partial_hits += 1
+        logger.info(
+            f"[RerankCache] Частичное совпадение кандидатов ({best[0]:.0%}), порядок берём из кэша"
+        )
+        return [kp_id for kp_id in best[1] if kp_id in wanted]
+
+    def store(self, key: Tuple[Hashable, ...], kp_ids: Sequence[int], order: Sequence[int]) -> None:
+        if not kp_ids or not order:
+            return
+        candidates = tuple(kp_ids)
+        variants = [v for v in self.cache.peek(key, []) if v[0] != candidates]
+        variants.insert(0, (candidates, tuple(order)))
+        self.cache.set(key, variants[:self.variants])
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "exact_hits": self.exact_hits, "partial_hits": self.partial_hits}
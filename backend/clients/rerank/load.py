@@ -0,0 +1,50 @@
+"""
+Учёт одновременных LLM-реранков процесса.
+
+Когда модель перегружена, запросы копятся и каждый следующий ждёт дольше; сверх
+max_in_flight новые реранки не запускаются, а кандидаты отдаются в локальном порядке.
+"""
+import logging
+
+from contextlib import contextmanager
+
+from settings import RERANK_LLM_MAX_IN_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+
+class RerankLoad:
+    """in_flight — идущие LLM-реранки, shed — реранки, отданные локальному порядку из-за перегрузки."""
+
+    def __init__(self, max_in_flight: int = RERANK_LLM_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.started = 0
+        self.shed = 0
+
+    def overloaded(self) -> bool:
+        if self.in_flight >= self.max_in_flight:
+            self.shed += 1
+            logger.warning(
+                f"[RerankLoad] {self.in_flight} LLM-реранков в работе (лимит {self.max_in_flight}), "
+                f"используем локальный порядок"
+            )
+            return True
+        return False
+
+    @contextmanager
+    def track(self):
+        self.in_flight += 1
+        self.started += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "started": self.started,
+            "shed": self.shed,
+        }
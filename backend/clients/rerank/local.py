@@ -0,0 +1,139 @@
+"""
+Локальный реранк кандидатов без LLM: близость вектора фильма к эмбеддингу запроса
+плюс пересечение слов запроса с keywords/page_content фильма.
+
+Эмбеддинг запроса почти всегда уже лежит в кэше эмбеддингов (его посчитал recommend),
+векторы фильмов — в зеркале векторов или кэше векторов рекомендателя, так что реранк
+40 кандидатов — это одна матричная операция в процессе. Используется, когда LLM-реранк
+не успевает, перегружен или упал, и для отбора кандидатов в промпт LLM.
+"""
+import re
+import asyncio
+import logging
+import numpy as np
+
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from clients.search.scoring import top_k
+from settings import LOCAL_RERANK_KEYWORD_WEIGHT, LOCAL_RERANK_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+# Грубая замена стемминга: слова сравниваются по первым символам ("космос" / "космосе")
+_STEM_LENGTH = 6
+_MIN_WORD_LENGTH = 4  # отсекает предлоги и союзы ("про", "для", "the")
+
+
+def _stems(text: str) -> set:
+    return {
+        word[:_STEM_LENGTH]
+        for word in _WORD.findall(text.lower())
+        if len(word) >= _MIN_WORD_LENGTH
+    }
+
+
+def keyword_overlap(query: str, movies: List[dict]) -> np.ndarray:
+    """Доля слов запроса, найденных в keywords и page_content фильма, для каждого кандидата."""
+    query_stems = _stems(query or "")
+    overlap = np.zeros(len(movies), dtype=np.float32)
+    if not query_stems:
+        return overlap
+    for i, movie in enumerate(movies):
+        text = " ".join(movie.get("keywords") or []) + " " + (movie.get("page_content") or "")
+        overlap[i] = len(query_stems & _stems(text)) / len(query_stems)
+    return overlap
+
+
+def local_scores(
+        query_vector: Optional[np.ndarray],
+        movie_vectors: np.ndarray,
+        overlap: np.ndarray,
+        keyword_weight: float = LOCAL_RERANK_KEYWORD_WEIGHT,
+) -> np.ndarray:
+    """
+    (1 - keyword_weight) * косинусная близость (min-max по кандидатам) + keyword_weight * overlap.
+    Строки movie_vectors из NaN — вектор фильма неизвестен, близость считается минимальной.
+    Без вектора запроса остаётся только overlap.
+    """
+    if query_vector is None or len(movie_vectors) == 0:
+        return overlap.astype(np.float32)
+
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+    norms = np.linalg.norm(movie_vectors, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        similarity = (movie_vectors @ query) / norms
+    known = np.isfinite(similarity)
+    if not known.any():
+        return overlap.astype(np.float32)
+
+    low, high = similarity[known].min(), similarity[known].max()
+    scaled = np.zeros(len(similarity), dtype=np.float32)
+    if high > low:
+        scaled[known] = (similarity[known] - low) / (high - low)
+    else:
+        scaled[known] = 1.0
+    return (1.0 - keyword_weight) * scaled + keyword_weight * overlap
+
+
+class LocalReranker:
+    """
+    rank(query, movies) -> movies в порядке локального скора (стабильно: при равенстве —
+    исходный порядок). embed и vectors — источники рекомендателя
+    (embedding_cache.embed и get_movie_vectors). Если они не ответили за timeout
+    (эмбеддинг запроса не в кэше и OpenAI тормозит), ранжирование идёт только по словам.
+    """
+
+    def __init__(
+            self,
+            embed: Callable[[str], Awaitable[List[float]]],
+            vectors: Callable[[List[int]], Awaitable[Dict[int, np.ndarray]]],
+            keyword_weight: float = LOCAL_RERANK_KEYWORD_WEIGHT,
+            timeout: float = LOCAL_RERANK_TIMEOUT,
+    ):
+        self.embed = embed
+        self.vectors = vectors
+        self.keyword_weight = keyword_weight
+        self.timeout = timeout
+        self.calls = 0
+        self.failures = 0
+
+    async def rank(self, query: str, movies: List[dict]) -> List[dict]:
+        if len(movies) < 2:
+            return list(movies)
+        self.calls += 1
+        overlap = keyword_overlap(query, movies)
+        try:
+            query_vector, vectors_by_kp_id = await asyncio.wait_for(self._vectors(query, movies), self.timeout)
+        except Exception as e:
+            # Без векторов остаётся ранжирование по словам
+            self.failures += 1
+            logger.warning(f"[LocalReranker] Векторы недоступны, ранжируем по словам: {e!r}")
+            query_vector, vectors_by_kp_id = None, {}
+
+        dim = len(query_vector) if query_vector is not None else 0
+        movie_vectors = np.full((len(movies), dim), np.nan, dtype=np.float32)
+        for i, movie in enumerate(movies):
+            vector = vectors_by_kp_id.get(movie.get("kp_id"))
+            if vector is not None and len(vector) == dim:
+                movie_vectors[i] = vector
+
+        scores = local_scores(
+            np.asarray(query_vector, dtype=np.float32) if query_vector is not None else None,
+            movie_vectors,
+            overlap,
+            self.keyword_weight,
+        )
+        order = top_k(scores, len(movies), descending=True)
+        return [movies[i] for i in order]
+
+    async def _vectors(self, query: str, movies: List[dict]):
+        kp_ids = [m.get("kp_id") for m in movies if m.get("kp_id") is not None]
+        if not query:
+            return None, {}
+        query_vector, vectors_by_kp_id = await asyncio.gather(self.embed(query), self.vectors(kp_ids))
+        return query_vector, vectors_by_kp_id
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "failures": self.failures}
@@ -0,0 +1,177 @@
+"""
+Сборка промпта LLM-реранка в пределах бюджета токенов.
+
+Задержка и стоимость реранка растут с длиной промпта, а больше всего в нём — описания
+кандидатов. Builder подбирает длину описания и число кандидатов так, чтобы промпт
+уложился в token_budget: сначала сокращает описания (200 -> 120 -> 60 символов),
+и только если даже короткие не помещаются — отбрасывает кандидатов с конца списка
+(они уходят в хвост выдачи, как фильмы, которые модель не назвала).
+
+Строка кандидата ("[название] описание") и её длина в токенах кэшируются по
+(kp_id, локаль, длина описания): одни и те же фильмы попадают в промпты постоянно.
+"""
+import logging
+
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from clients.search.caching import LRUCache
+from settings import (
+    RERANK_PROMPT_TOKEN_BUDGET,
+    RERANK_PROMPT_MAX_CANDIDATES,
+    RERANK_PROMPT_MIN_CANDIDATES,
+    RERANK_PROMPT_SNIPPET_LENGTHS,
+    RERANK_SUMMARY_CACHE_MAX_ENTRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+# Номер кандидата ("12. ") и перевод строки
+_LINE_OVERHEAD_TOKENS = 3
+
+
+def movie_name(movie: dict, locale: str = "ru") -> str:
+    """Название фильма с учётом локали (с fallback на другое)."""
+    name = movie.get("name", "") if locale == "ru" else movie.get("title", "")
+    if not name:
+        name = movie.get("title", "") or movie.get("name", "")
+    return name
+
+
+def candidate_line(movie: dict, locale: str, snippet_length: int) -> str:
+    """Строка кандидата без номера: "[название] описание" (описание обрезано до snippet_length)."""
+    snippet = " ".join((movie.get("page_content") or "").split())[:snippet_length].rstrip()
+    return f"[{movie_name(movie, locale)}] {snippet}" if snippet else f"[{movie_name(movie, locale)}]"
+
+
+def format_movies(movies: Sequence[dict], locale: str = "ru", snippet_length: int = 200) -> str:
+    return "\n".join(
+        f"{i + 1}. {candidate_line(movie, locale, snippet_length)}" for i, movie in enumerate(movies)
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценка сверху: ~3 символа на токен (кириллица дороже латиницы). Бюджет — ориентир,
+    точное число токенов промпта модель возвращает в usage, его и пишет observe().
+    """
+    return (len(text) + 2) // 3
+
+
+@dataclass
+class RerankPrompt:
+    prompt: str
+    movies: List[dict]  # кандидаты в промпте, номер в промпте = индекс + 1
+    tokens: int
+    snippet_length: int
+    dropped: int  # кандидатов не поместилось в бюджет
+
+
+class RerankPromptBuilder:
+    """
+    build(template, movies, **fields) -> RerankPrompt. Шаблон — RERANK_PROMPT_TEMPLATE_*,
+    fields — остальные его поля (query, exclude_instruction, criteria_context).
+    observe(prompt, latency, prompt_tokens) — метрики вызова модели: токены промпта и задержка.
+    """
+
+    def __init__(
+            self,
+            token_budget: int = RERANK_PROMPT_TOKEN_BUDGET,
+            max_candidates: int = RERANK_PROMPT_MAX_CANDIDATES,
+            min_candidates: int = RERANK_PROMPT_MIN_CANDIDATES,
+            snippet_lengths: Tuple[int, ...] = RERANK_PROMPT_SNIPPET_LENGTHS,
+            count_tokens: Callable[[str], int] = estimate_tokens,
+    ):
+        self.token_budget = token_budget
+        self.max_candidates = max_candidates
+        self.min_candidates = min_candidates
+        self.snippet_lengths = tuple(sorted(snippet_lengths, reverse=True))
+        self.count_tokens = count_tokens
+        self.summaries = LRUCache(name="rerank_summaries", max_entries=RERANK_SUMMARY_CACHE_MAX_ENTRIES)
+        self.builds = 0
+        self.truncated = 0
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.latency = 0.0
+
+    def _summary(self, movie: dict, locale: str, snippet_length: int) -> Tuple[str, int]:
+        kp_id = movie.get("kp_id")
+        key = (kp_id, locale, snippet_length)
+        cached = self.summaries.get(key) if kp_id is not None else None
+        if cached is None:
+            line = candidate_line(movie, locale, snippet_length)
+            cached = (line, self.count_tokens(line) + _LINE_OVERHEAD_TOKENS)
+            if kp_id is not None:
+                self.summaries.set(key, cached)
+        return cached
+
+    def build(
+            self,
+            template: str,
+            movies: Sequence[dict],
+            locale: str = "ru",
+            max_candidates: Optional[int] = None,
+            **fields,
+    ) -> RerankPrompt:
+        self.builds += 1
+        limit = min(len(movies), max_candidates or self.max_candidates)
+        fixed = self.count_tokens(template.format(movies_list="", movies_count=limit, **fields))
+        available = self.token_budget - fixed
+
+        count, snippet_length, summaries = 0, self.snippet_lengths[-1], []
+        for length in self.snippet_lengths:
+            summaries = [self._summary(movie, locale, length) for movie in movies[:limit]]
+            used, count = 0, 0
+            for _, tokens in summaries:
+                if used + tokens > available:
+                    break
+                used += tokens
+                count += 1
+            snippet_length = length
+            if count == limit:
+                break
+        # Бюджет мягкий: меньше min_candidates кандидатов не отдаём даже при переполнении
+        count = max(count, min(limit, self.min_candidates))
+
+        candidates = list(movies[:count])
+        movies_list = "\n".join(f"{i + 1}. {line}" for i, (line, _) in enumerate(summaries[:count]))
+        prompt = template.format(movies_list=movies_list, movies_count=count, **fields)
+        tokens = fixed + sum(tokens for _, tokens in summaries[:count])
+        dropped = len(movies) - count
+        if count < limit:
+            self.truncated += 1
+            logger.info(
+                f"[RerankPromptBuilder] Бюджет {self.token_budget} токенов: {count}/{limit} кандидатов, "
+                f"описания по {snippet_length} символов"
+            )
+        return RerankPrompt(
+            prompt=prompt, movies=candidates, tokens=tokens, snippet_length=snippet_length, dropped=dropped
+        )
+
+    def observe(
+            self,
+            prompt: RerankPrompt,
+            latency: float,
+            prompt_tokens: Optional[int] = None,
+            source: str = "rerank",
+    ) -> None:
+        """Метрики вызова модели; prompt_tokens — usage из ответа, без него — оценка builder."""
+        tokens = prompt_tokens if prompt_tokens is not None else prompt.tokens
+        self.calls += 1
+        self.prompt_tokens += tokens
+        self.latency += latency
+        logger.info(
+            f"[RerankPromptBuilder] {source}: {tokens} токенов промпта (оценка {prompt.tokens}), "
+            f"{len(prompt.movies)} кандидатов, описания {prompt.snippet_length} симв., "
+            f"отброшено {prompt.dropped}, {latency:.2f}с"
+        )
+
+    def stats(self) -> dict:
+        return {
+            "builds": self.builds,
+            "truncated": self.truncated,
+            "calls": self.calls,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.calls, 1) if self.calls else 0.0,
+            "avg_latency": round(self.latency / self.calls, 3) if self.calls else 0.0,
+            "summaries": self.summaries.stats(),
+        }
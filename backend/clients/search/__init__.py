@@ -0,0 +1,35 @@
+from .caching import LRUCache
+from .embeddings import EmbeddingCache, AtmosphereEmbeddingTable
+from .vector_mirror import VectorMirror, build_vector_mirror
+from .neighbours import NeighbourTable, build_neighbour_table
+from .candidates import CandidateBatch
+from .catalog import CatalogIndex, KpIdIndex, TitleIndex, scan_catalog
+from .filters import FilterSpec
+from .facets import FacetIndex
+from .popular import PopularEntry, PopularMoviesSnapshot
+from .result_cache import CachedResult, RecommendResultCache, recommend_cache_key
+from .singleflight import SingleFlight, copy_movies
+
+__all__ = [
+    "LRUCache",
+    "EmbeddingCache",
+    "AtmosphereEmbeddingTable",
+    "VectorMirror",
+    "build_vector_mirror",
+    "NeighbourTable",
+    "build_neighbour_table",
+    "CandidateBatch",
+    "CatalogIndex",
+    "KpIdIndex",
+    "TitleIndex",
+    "scan_catalog",
+    "FilterSpec",
+    "FacetIndex",
+    "PopularEntry",
+    "PopularMoviesSnapshot",
+    "CachedResult",
+    "RecommendResultCache",
+    "recommend_cache_key",
+    "SingleFlight",
+    "copy_movies",
+]
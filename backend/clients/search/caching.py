@@ -0,0 +1,170 @@
+import sys
+import time
+import logging
+
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def approx_sizeof(value: Any) -> int:
+    """
+    Грубая оценка занимаемой памяти (байты) для значений кэшей рекомендателя.
+    Учитывает numpy-массивы (nbytes), списки/кортежи, словари и строки на один уровень вглубь.
+    """
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is not None:
+        return int(nbytes)
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(sys.getsizeof(v) for v in value)
+    return size
+
+
+class LRUCache:
+    """
+    In-process LRU-кэш с TTL, ограничением по количеству записей и (опционально) по памяти.
+
+    - Вытеснение: least recently used, пока не выполнены оба лимита (max_entries и max_bytes).
+    - TTL проверяется лениво при чтении.
+    - version: метка версии данных (например, версия коллекции Weaviate). При смене версии кэш очищается.
+    - Счётчики hits/misses/evictions/expirations доступны через stats().
+
+    Кэш не потокобезопасен: рассчитан на использование внутри одного event loop.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            max_entries: int,
+            ttl: Optional[float] = None,
+            max_bytes: Optional[int] = None,
+            sizeof: Optional[Callable[[Any], int]] = None,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or approx_sizeof
+        self._data: "OrderedDict[Hashable, Tuple[Any, Optional[float], int]]" = OrderedDict()
+        self._bytes = 0
+        self.version: Optional[Hashable] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and not self._is_expired(entry)
+
+    @staticmethod
+    def _is_expired(entry: Tuple[Any, Optional[float], int]) -> bool:
+        expires_at = entry[1]
+        return expires_at is not None and expires_at <= time.time()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if self._is_expired(entry):
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Значение без учёта в hits/misses и без изменения порядка вытеснения."""
+        entry = self._data.get(key)
+        if entry is None or self._is_expired(entry):
+            return default
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any, created_at: Optional[float] = None) -> None:
+        """
+        Сохраняет значение. created_at позволяет восстановить исходный возраст записи
+        (например, при загрузке снапшота с диска), чтобы TTL отсчитывался от момента создания.
+        """
+        if key in self._data:
+            self._remove(key)
+        expires_at = None
+        if self.ttl is not None:
+            expires_at = (created_at if created_at is not None else time.time()) + self.ttl
+            if expires_at <= time.time():
+                return
+        size = self._sizeof(value)
+        self._data[key] = (value, expires_at, size)
+        self._bytes += size
+        self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._data:
+            return default
+        value = self._data[key][0]
+        self._remove(key)
+        return value
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._bytes = 0
+
+    def set_version(self, version: Hashable) -> bool:
+        """Устанавливает версию данных. Возвращает True, если версия сменилась и кэш был очищен."""
+        if version == self.version:
+            return False
+        if self.version is not None and self._data:
+            logger.info(
+                f"[LRUCache:{self.name}] Версия данных сменилась ({self.version} -> {version}), "
+                f"очищаем {len(self._data)} записей"
+            )
+        self.clear()
+        self.version = version
+        return True
+
+    def items(self) -> Iterator[Tuple[Hashable, Any, Optional[float]]]:
+        """Итерирует по актуальным записям: (key, value, created_at)."""
+        for key, (value, expires_at, _) in list(self._data.items()):
+            if expires_at is not None and expires_at <= time.time():
+                continue
+            created_at = expires_at - self.ttl if expires_at is not None else None
+            yield key, value, created_at
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def _evict(self) -> None:
+        while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            oldest_key = next(iter(self._data))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,74 @@
+"""
+Колоночное представление кандидатов поиска.
+
+Между ответом Weaviate и итоговым списком фильмов рекомендатель держит не dict на каждый хит,
+а четыре массива (kp_id, popularity_score, distance, жанровые флаги). Скоринг работает прямо
+по ним (см. scoring.py), полные документы собираются только для отобранных фильмов.
+"""
+import numpy as np
+
+from typing import Iterable, List, Optional, Set, Tuple
+
+from clients.search.scoring import genre_conflict_mask, genre_flags
+
+
+class CandidateBatch:
+    """Пачка кандидатов: kp_ids int64, popularity float64, distances float64 (NaN — нет), flags uint8."""
+
+    __slots__ = ("kp_ids", "popularity", "distances", "flags")
+
+    def __init__(self, kp_ids: np.ndarray, popularity: np.ndarray, distances: np.ndarray, flags: np.ndarray):
+        self.kp_ids = kp_ids
+        self.popularity = popularity
+        self.distances = distances
+        self.flags = flags
+
+    def __len__(self) -> int:
+        return len(self.kp_ids)
+
+    @classmethod
+    def from_objects(
+            cls,
+            objects: Iterable,
+            exclude_kp_ids: Optional[Set[int]] = None,
+    ) -> Tuple["CandidateBatch", int]:
+        """
+        Собирает пачку из объектов ответа Weaviate, пропуская исключённые kp_id.
+        Возвращает (пачка, число исключённых).
+        """
+        exclude = exclude_kp_ids or set()
+        kp_ids, popularity, distances, flags = [], [], [], []
+        excluded = 0
+        for obj in objects:
+            props = obj.properties
+            kp_id = props.get("kp_id")
+            if kp_id is None:
+                continue
+            if kp_id in exclude:
+                excluded += 1
+                continue
+            distance = getattr(obj.metadata, "distance", None)
+            kp_ids.append(kp_id)
+            popularity.append(props.get("popularity_score") or 0.0)
+            distances.append(np.nan if distance is None else distance)
+            flags.append(genre_flags(props.get("genres")))
+
+        batch = cls(
+            np.asarray(kp_ids, dtype=np.int64),
+            np.asarray(popularity, dtype=np.float64),
+            np.asarray(distances, dtype=np.float64),
+            np.asarray(flags, dtype=np.uint8),
+        )
+        return batch, excluded
+
+    def take(self, indices: np.ndarray) -> "CandidateBatch":
+        return CandidateBatch(
+            self.kp_ids[indices], self.popularity[indices], self.distances[indices], self.flags[indices]
+        )
+
+    def genre_conflicts(self, selected_genres: Optional[List[str]]) -> np.ndarray:
+        """Маска кандидатов, которых отбросил бы _skip_due_to_genre_conflict."""
+        return genre_conflict_mask(self.flags, genre_flags(selected_genres))
+
+    def kp_id_list(self) -> List[int]:
+        return [int(kp_id) for kp_id in self.kp_ids]
@@ -0,0 +1,323 @@
+"""
+In-process индексы по всему каталогу Movie, которые строятся одним проходом по коллекции.
+
+Каждый индекс объявляет нужные ему свойства (`properties`) и принимает объекты через
+`add(uuid, props)` в новую (staging) версию, которая подменяет текущую в `finalize()` —
+во время пересканирования индекс продолжает отвечать по старым данным.
+
+`scan_catalog` делает один проход итератором Weaviate с объединением свойств всех индексов,
+так что добавление нового индекса не добавляет ещё один скан.
+"""
+import re
+import time
+import logging
+
+from abc import ABC, abstractmethod
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from clients.search.scoring import FLAG_ANIME, genre_flags
+from settings import (
+    TITLE_INDEX_FUZZY_MIN_RATIO,
+    TITLE_INDEX_FUZZY_MARGIN,
+    TITLE_INDEX_FUZZY_CANDIDATES,
+    TITLE_INDEX_FUZZY_MAX_POSTINGS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogIndex(ABC):
+    """Базовый класс индекса каталога: без reset/add/finalize подкласс не создаётся."""
+
+    name: str = "catalog"
+    properties: List[str] = []
+
+    @abstractmethod
+    def reset(self) -> None:
+        """Начинает новую версию индекса."""
+
+    @abstractmethod
+    def add(self, uuid, props: dict) -> None:
+        """Добавляет объект в строящуюся версию."""
+
+    @abstractmethod
+    def finalize(self) -> None:
+        """Публикует построенную версию (и перестраивает производные структуры)."""
+
+    def stats(self) -> dict:
+        return {}
+
+
+class KpIdIndex(CatalogIndex):
+    """
+    kp_id -> (UUID объекта, жанровые флаги).
+
+    Позволяет сразу выполнять near_object / fetch_object_by_id без предварительного
+    fetch_objects(kp_id == X). Флаги нужны recommend_similar для проверки конфликта жанров
+    исходного фильма без загрузки его документа. Промахи (фильмы, добавленные после скана)
+    дописываются через `remember`.
+    """
+
+    name = "kp_id_index"
+    properties = ["kp_id", "genres"]
+
+    def __init__(self):
+        self._entries: Dict[int, Tuple[object, int]] = {}
+        self._pending: Dict[int, Tuple[object, int]] = {}
+        self.loaded_at: Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def reset(self) -> None:
+        self._pending = {}
+
+    def add(self, uuid, props: dict) -> None:
+        kp_id = props.get("kp_id")
+        if kp_id is not None:
+            self._pending[kp_id] = (uuid, genre_flags(props.get("genres")))
+
+    def finalize(self) -> None:
+        self._entries, self._pending = self._pending, {}
+        self.loaded_at = time.time()
+
+    def remember(self, kp_id: int, uuid, genres: Optional[List[str]] = None) -> None:
+        if kp_id is not None and uuid is not None:
+            self._entries[kp_id] = (uuid, genre_flags(genres))
+
+    def discard(self, kp_id: int) -> None:
+        self._entries.pop(kp_id, None)
+
+    def get_uuid(self, kp_id: int):
+        entry = self._entries.get(kp_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def has_anime(self, kp_id: int) -> Optional[bool]:
+        entry = self._entries.get(kp_id)
+        return None if entry is None else bool(entry[1] & FLAG_ANIME)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "loaded_at": self.loaded_at,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_NON_ALNUM = re.compile(r"[^0-9a-zа-я]+")
+
+_TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p",
+    "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "c", "ч": "ch",
+    "ш": "sh", "щ": "sch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+}
+
+
+def normalize_title(title: str) -> str:
+    """'Матрица: Перезагрузка' -> 'матрица перезагрузка' (регистр, ё, пунктуация, пробелы)."""
+    return " ".join(_NON_ALNUM.split(title.lower().replace("ё", "е"))).strip()
+
+
+def compact_title(title: str) -> str:
+    """
+    Транслитерированная форма без разделителей: 'Матрица' -> 'matrica', 'the-matrix' -> 'thematrix'.
+    Совпадает для названия и его slug'а на лендинге.
+    """
+    return "".join(_TRANSLIT.get(ch, ch) for ch in normalize_title(title).replace(" ", ""))
+
+
+def _trigrams(key: str) -> set:
+    padded = f"#{key}#"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex(CatalogIndex):
+    """
+    Локальное разрешение названий фильмов без BM25.
+
+    - точное совпадение нормализованного name (ru) / title (en);
+    - совпадение транслитерированной формы без пробелов (slug'и лендинга, 'Matrica' vs 'Матрица');
+    - опечатки: кандидаты по общим триграммам, проверка SequenceMatcher. Если лучший кандидат
+      не отрывается от второго на TITLE_INDEX_FUZZY_MARGIN, запрос считается неоднозначным.
+      Частые триграммы (больше max_postings названий) не считаются: они почти не отличают
+      кандидатов, а их списки длиной в тысячи id сделали бы промах индекса дорогим.
+
+    `lookup` возвращает kp_id по убыванию popularity_score или None — тогда нужен BM25.
+    """
+
+    name = "title_index"
+    properties = ["kp_id", "name", "title", "popularity_score"]
+
+    def __init__(
+            self,
+            min_ratio: float = TITLE_INDEX_FUZZY_MIN_RATIO,
+            margin: float = TITLE_INDEX_FUZZY_MARGIN,
+            candidates: int = TITLE_INDEX_FUZZY_CANDIDATES,
+            max_postings: int = TITLE_INDEX_FUZZY_MAX_POSTINGS,
+    ):
+        self.min_ratio = min_ratio
+        self.margin = margin
+        self.candidates = candidates
+        self.max_postings = max_postings
+        self._rows: List[Tuple[int, str, str, float]] = []
+        self._exact: Dict[str, Dict[str, List[int]]] = {"ru": {}, "en": {}}
+        self._keys: List[str] = []
+        self._key_kp_ids: List[List[int]] = []
+        self._key_ids: Dict[str, int] = {}
+        self._grams: Dict[str, List[int]] = {}
+        self.loaded_at: Optional[float] = None
+        self.hits = {"exact": 0, "compact": 0, "fuzzy": 0}
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def reset(self) -> None:
+        self._rows = []
+
+    def add(self, uuid, props: dict) -> None:
+        kp_id = props.get("kp_id")
+        if kp_id is not None and (props.get("name") or props.get("title")):
+            self._rows.append((
+                kp_id, props.get("name") or "", props.get("title") or "", props.get("popularity_score") or 0.0
+            ))
+
+    def finalize(self) -> None:
+        rows = sorted(self._rows, key=lambda row: row[3], reverse=True)
+        exact: Dict[str, Dict[str, List[int]]] = {"ru": {}, "en": {}}
+        key_ids: Dict[str, int] = {}
+        keys: List[str] = []
+        key_kp_ids: List[List[int]] = []
+
+        for kp_id, name, title, _ in rows:
+            for locale, value in (("ru", name), ("en", title)):
+                if not value:
+                    continue
+                normalized = normalize_title(value)
+                if normalized:
+                    exact[locale].setdefault(normalized, [])
+                    if kp_id not in exact[locale][normalized]:
+                        exact[locale][normalized].append(kp_id)
+                key = compact_title(value)
+                if not key:
+                    continue
+                key_id = key_ids.get(key)
+                if key_id is None:
+                    key_id = key_ids[key] = len(keys)
+                    keys.append(key)
+                    key_kp_ids.append([])
+                if kp_id not in key_kp_ids[key_id]:
+                    key_kp_ids[key_id].append(kp_id)
+
+        grams: Dict[str, List[int]] = {}
+        for key_id, key in enumerate(keys):
+            for gram in _trigrams(key):
+                grams.setdefault(gram, []).append(key_id)
+
+        self._exact, self._keys, self._key_kp_ids, self._key_ids, self._grams = (
+            exact, keys, key_kp_ids, key_ids, grams
+        )
+        self._rows = []
+        self.loaded_at = time.time()
+
+    def _fuzzy(self, key: str) -> Optional[List[int]]:
+        if len(key) < 4:
+            return None
+        postings = [self._grams.get(gram, ()) for gram in _trigrams(key)]
+        postings = [key_ids for key_ids in postings if len(key_ids) <= self.max_postings]
+        shared = Counter()
+        for key_ids in postings:
+            shared.update(key_ids)
+        min_shared = max(1, len(postings) // 3)
+
+        scored = []
+        for key_id, count in shared.most_common(self.candidates):
+            if count < min_shared:
+                break
+            scored.append((SequenceMatcher(None, key, self._keys[key_id]).ratio(), key_id))
+        if not scored:
+            return None
+
+        scored.sort(reverse=True)
+        best_ratio, best_id = scored[0]
+        if best_ratio < self.min_ratio:
+            return None
+        if len(scored) > 1 and best_ratio - scored[1][0] < self.margin:
+            return None
+        return list(self._key_kp_ids[best_id])
+
+    def lookup(self, title: str, locale: str = "ru") -> Optional[List[int]]:
+        """kp_id фильмов с этим названием (сначала из поля своей локали) или None."""
+        if not self._keys or not title:
+            return None
+
+        normalized = normalize_title(title)
+        other = "en" if locale == "ru" else "ru"
+        kp_ids = self._exact.get(locale, {}).get(normalized) or self._exact.get(other, {}).get(normalized)
+        if kp_ids:
+            self.hits["exact"] += 1
+            return list(kp_ids)
+
+        key = compact_title(title)
+        key_id = self._key_ids.get(key)
+        if key_id is not None:
+            self.hits["compact"] += 1
+            return list(self._key_kp_ids[key_id])
+
+        kp_ids = self._fuzzy(key)
+        if kp_ids:
+            self.hits["fuzzy"] += 1
+            return kp_ids
+
+        self.misses += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "titles": sum(len(v) for v in self._exact.values()),
+            "keys": len(self._keys),
+            "grams": len(self._grams),
+            "loaded_at": self.loaded_at,
+            "hits": dict(self.hits),
+            "misses": self.misses,
+        }
+
+
+async def scan_catalog(collection, indexes: Iterable[CatalogIndex]) -> int:
+    """
+    Заполняет индексы одним проходом по коллекции. Возвращает число просмотренных объектов.
+
+    При ошибке скана исключение пробрасывается, индексы продолжают отвечать по прежней версии.
+    """
+    indexes = list(indexes)
+    properties = sorted({prop for index in indexes for prop in index.properties})
+    for index in indexes:
+        index.reset()
+
+    started = time.time()
+    count = 0
+    async for obj in collection.iterator(return_properties=properties):
+        for index in indexes:
+            index.add(obj.uuid, obj.properties)
+        count += 1
+
+    for index in indexes:
+        index.finalize()
+
+    logger.info(
+        f"[Catalog] Скан коллекции: {count} объектов за {time.time() - started:.1f}с, "
+        f"индексы: {[index.name for index in indexes]}, свойства: {properties}"
+    )
+    return count
@@ -0,0 +1,230 @@
+import os
+import time
+import logging
+import numpy as np
+
+from typing import Dict, List, Optional
+from openai import AsyncOpenAI
+
+from clients.search.caching import LRUCache
+from settings import (
+    MODEL_EMBS,
+    ATMOSPHERE_MAPPING,
+    ATMOSPHERE_EMBEDDINGS_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_CACHE_TTL,
+)
+
+logger = logging.getLogger(__name__)
+
+_KEY_SEP = "\x1f"
+
+
+class EmbeddingCache:
+    """
+    Кэш эмбеддингов запросов, ключ — (model, нормализованный текст).
+
+    Векторы хранятся как float32 (≈12 КБ на text-embedding-3-large), вытеснение — LRU с TTL.
+    Опционально сохраняется на диск (npz) при остановке и загружается при старте,
+    чтобы шаблонные запросы (атмосферы, популярные описания) не шли в OpenAI после рестарта.
+    """
+
+    def __init__(
+            self,
+            openai_client: AsyncOpenAI,
+            model_name: str = MODEL_EMBS,
+            max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+            ttl: Optional[float] = EMBEDDING_CACHE_TTL,
+            snapshot_path: Optional[str] = None,
+    ):
+        self.openai_client = openai_client
+        self.model_name = model_name
+        self.snapshot_path = snapshot_path
+        self._cache = LRUCache(name="embeddings", max_entries=max_entries, ttl=ttl)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    def _key(self, text: str) -> str:
+        return f"{self.model_name}{_KEY_SEP}{self.normalize(text)}"
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        return self._cache.get(self._key(text))
+
+    def put(self, text: str, vector) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        self._cache.set(self._key(text), array)
+        return array
+
+    async def embed(self, text: str) -> List[float]:
+        """Возвращает эмбеддинг текста: из кэша или через OpenAI (с сохранением в кэш)."""
+        cached = self.get(text)
+        if cached is not None:
+            return cached.tolist()
+
+        response = await self.openai_client.embeddings.create(
+            input=text,
+            model=self.model_name
+        )
+        embedding = response.data[0].embedding
+        self.put(text, embedding)
+        return embedding
+
+    def load_snapshot(self) -> int:
+        """Загружает снапшот с диска. Возвращает количество восстановленных записей."""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return 0
+        try:
+            with np.load(self.snapshot_path) as data:
+                keys = data["keys"]
+                created_at = data["created_at"]
+                vectors = data["vectors"]
+            for key, ts, vector in zip(keys, created_at, vectors):
+                key = str(key)
+                if not key.startswith(f"{self.model_name}{_KEY_SEP}"):
+                    continue
+                self._cache.set(key, np.array(vector, dtype=np.float32), created_at=float(ts))
+            logger.info(
+                f"[EmbeddingCache] Загружено {len(self._cache)} эмбеддингов из {self.snapshot_path}"
+            )
+            return len(self._cache)
+        except Exception as e:
+            logger.warning(f"[EmbeddingCache] Не удалось загрузить снапшот {self.snapshot_path}: {e}")
+            return 0
+
+    def save_snapshot(self) -> int:
+        """Атомарно сохраняет актуальные записи на диск. Возвращает количество сохранённых записей."""
+        if not self.snapshot_path:
+            return 0
+        entries = list(self._cache.items())
+        if not entries:
+            return 0
+        try:
+            keys = np.array([key for key, _, _ in entries])
+            created_at = np.array(
+                [ts if ts is not None else time.time() for _, _, ts in entries],
+                dtype=np.float64,
+            )
+            vectors = np.stack([vector for _, vector, _ in entries])
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, keys=keys, created_at=created_at, vectors=vectors)
+            os.replace(tmp_path, self.snapshot_path)
+            logger.info(f"[EmbeddingCache] Сохранено {len(entries)} эмбеддингов в {self.snapshot_path}")
+            return len(entries)
+        except Exception as e:
+            logger.warning(f"[EmbeddingCache] Не удалось сохранить снапшот {self.snapshot_path}: {e}")
+            return 0
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+class AtmosphereEmbeddingTable:
+    """
+    Таблица эмбеддингов фраз из ATMOSPHERE_MAPPING (закрытый словарь swipe-режима).
+
+    Загружается при старте из локального файла (npz), недостающие фразы считаются одним
+    батч-запросом к OpenAI и дописываются в файл. Комбинации атмосфер собираются локально
+    усреднением нормированных векторов — на горячем пути эмбеддинги не запрашиваются.
+    """
+
+    def __init__(
+            self,
+            embedding_cache: EmbeddingCache,
+            mapping: Dict[str, str] = ATMOSPHERE_MAPPING,
+            path: Optional[str] = ATMOSPHERE_EMBEDDINGS_PATH,
+    ):
+        self.embedding_cache = embedding_cache
+        self.mapping = mapping
+        self.path = path
+        self._vectors: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def _load_file(self) -> Dict[str, np.ndarray]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with np.load(self.path) as data:
+                if str(data["model"]) != self.embedding_cache.model_name:
+                    logger.info(
+                        f"[AtmosphereEmbeddingTable] Файл {self.path} посчитан для другой модели "
+                        f"({data['model']}), пересчитываем"
+                    )
+                    return {}
+                names = [str(n) for n in data["names"]]
+                texts = [str(t) for t in data["texts"]]
+                vectors = data["vectors"]
+            # Фраза в файле актуальна, только если её текст не менялся в ATMOSPHERE_MAPPING
+            return {
+                name: np.array(vector, dtype=np.float32)
+                for name, text, vector in zip(names, texts, vectors)
+                if self.mapping.get(name) == text
+            }
+        except Exception as e:
+            logger.warning(f"[AtmosphereEmbeddingTable] Не удалось прочитать {self.path}: {e}")
+            return {}
+
+    def _save_file(self) -> None:
+        if not self.path:
+            return
+        try:
+            names = list(self._vectors.keys())
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    model=np.array(self.embedding_cache.model_name),
+                    names=np.array(names),
+                    texts=np.array([self.mapping[n] for n in names]),
+                    vectors=np.stack([self._vectors[n] for n in names]),
+                )
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"[AtmosphereEmbeddingTable] Не удалось сохранить {self.path}: {e}")
+
+    async def load_or_build(self) -> int:
+        """Загружает таблицу с диска и досчитывает недостающие фразы. Возвращает размер таблицы."""
+        self._vectors = self._load_file()
+        missing = [name for name in self.mapping if name not in self._vectors]
+
+        if missing:
+            response = await self.embedding_cache.openai_client.embeddings.create(
+                input=[self.mapping[name] for name in missing],
+                model=self.embedding_cache.model_name,
+            )
+            for item in sorted(response.data, key=lambda d: d.index):
+                self._vectors[missing[item.index]] = np.asarray(item.embedding, dtype=np.float32)
+            self._save_file()
+
+        # Одиночная атмосфера — это обычный запрос, пусть он тоже попадает в кэш эмбеддингов
+        for name, vector in self._vectors.items():
+            self.embedding_cache.put(self.mapping[name], vector)
+
+        logger.info(
+            f"[AtmosphereEmbeddingTable] Готово {len(self._vectors)} эмбеддингов атмосфер "
+            f"(посчитано заново: {len(missing)})"
+        )
+        return len(self._vectors)
+
+    def compose(self, atmospheres: Optional[List[str]]) -> Optional[List[float]]:
+        """
+        Собирает вектор запроса для набора атмосфер (среднее нормированных векторов, затем нормировка).
+        Возвращает None, если хотя бы одной атмосферы нет в таблице — тогда вызывающий код
+        считает эмбеддинг по тексту запроса как обычно.
+        """
+        if not atmospheres:
+            return None
+        if any(a not in self._vectors for a in atmospheres):
+            return None
+
+        vectors = np.stack([self._vectors[a] for a in atmospheres])
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        composed = vectors.mean(axis=0)
+        norm = np.linalg.norm(composed)
+        if norm == 0:
+            return None
+        return (composed / norm).tolist()
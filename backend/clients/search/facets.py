@@ -0,0 +1,176 @@
+"""
+Колоночный каталог фильмов: оценка селективности фильтров recommend и локальный ответ
+на запросы без текста.
+
+FacetIndex строится тем же проходом scan_catalog, что и остальные индексы каталога:
+- kp_id / year / rating_kp / rating_imdb / popularity_score / жанровые флаги — колонки по всем
+  фильмам, так что диапазон годов и порог рейтинга считаются точно, без заранее заданных корзин;
+- genres / genres_tmdb — posting-списки строк, пересечение даёт точный счёт contains_all
+  (в том числе для пар жанров) с учётом годов и рейтингов;
+- cast / directors — только размеры posting-списков, для них оценка — верхняя граница,
+  а `select` с такими фильтрами не отвечает (нужен Weaviate).
+"""
+import time
+import logging
+import numpy as np
+
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from clients.search.catalog import CatalogIndex
+from clients.search.filters import FilterSpec
+from clients.search.scoring import genre_conflict_mask, genre_flags, top_k
+
+logger = logging.getLogger(__name__)
+
+_GENRE_PROPS = ("genres", "genres_tmdb")
+
+
+class FacetIndex(CatalogIndex):
+    """
+    `count(spec)` -> (число фильмов под фильтром, точное ли оно);
+    `select(spec, limit, ...)` -> kp_id самых популярных фильмов под фильтром.
+    """
+
+    name = "facet_index"
+    properties = [
+        "kp_id", "popularity_score", "year", "rating_kp", "rating_imdb",
+        "genres", "genres_tmdb", "cast", "directors",
+    ]
+
+    def __init__(self):
+        self._rows: List[tuple] = []
+        self.kp_ids = np.empty(0, dtype=np.int64)
+        self.popularity = np.empty(0, dtype=np.float32)
+        self.flags = np.empty(0, dtype=np.uint8)
+        self.year = np.empty(0, dtype=np.int32)
+        self.rating_kp = np.empty(0, dtype=np.float32)
+        self.rating_imdb = np.empty(0, dtype=np.float32)
+        self._genres: Dict[str, Dict[str, np.ndarray]] = {prop: {} for prop in _GENRE_PROPS}
+        self._cast: Counter = Counter()
+        self._directors: Counter = Counter()
+        self.loaded_at: Optional[float] = None
+        self.lookups = 0
+        self.selects = 0
+
+    def __len__(self) -> int:
+        return len(self.year)
+
+    def reset(self) -> None:
+        self._rows = []
+
+    def add(self, uuid, props: dict) -> None:
+        self._rows.append((
+            props.get("year"),
+            props.get("rating_kp"),
+            props.get("rating_imdb"),
+            props.get("genres") or [],
+            props.get("genres_tmdb") or [],
+            props.get("cast") or [],
+            props.get("directors") or [],
+            props.get("kp_id"),
+            props.get("popularity_score"),
+        ))
+
+    def finalize(self) -> None:
+        rows, self._rows = self._rows, []
+        n = len(rows)
+        # Пустые значения не проходят ни один фильтр Weaviate: год -1, рейтинг NaN
+        year = np.fromiter((-1 if r[0] is None else r[0] for r in rows), dtype=np.int32, count=n)
+        rating_kp = np.fromiter((np.nan if r[1] is None else r[1] for r in rows), dtype=np.float32, count=n)
+        rating_imdb = np.fromiter((np.nan if r[2] is None else r[2] for r in rows), dtype=np.float32, count=n)
+        kp_ids = np.fromiter((-1 if r[7] is None else r[7] for r in rows), dtype=np.int64, count=n)
+        popularity = np.fromiter((r[8] or 0.0 for r in rows), dtype=np.float32, count=n)
+        flags = np.fromiter((genre_flags(r[3]) for r in rows), dtype=np.uint8, count=n)
+
+        postings: Dict[str, Dict[str, List[int]]] = {prop: {} for prop in _GENRE_PROPS}
+        cast, directors = Counter(), Counter()
+        for row, r in enumerate(rows):
+            for prop, values in zip(_GENRE_PROPS, (r[3], r[4])):
+                for genre in set(values):
+                    postings[prop].setdefault(genre, []).append(row)
+            cast.update(set(r[5]))
+            directors.update(set(r[6]))
+
+        self.kp_ids, self.popularity, self.flags = kp_ids, popularity, flags
+        self.year, self.rating_kp, self.rating_imdb = year, rating_kp, rating_imdb
+        self._genres = {
+            prop: {genre: np.asarray(genre_rows, dtype=np.int32) for genre, genre_rows in by_genre.items()}
+            for prop, by_genre in postings.items()
+        }
+        self._cast, self._directors = cast, directors
+        self.loaded_at = time.time()
+
+    def genre_count(self, genre: str, genre_prop: str = "genres") -> int:
+        return len(self._genres.get(genre_prop, {}).get(genre, ()))
+
+    def _rows_for(self, spec: FilterSpec) -> np.ndarray:
+        """Строки, проходящие годы, рейтинги и жанры spec (cast/directors не учитываются)."""
+        with np.errstate(invalid="ignore"):
+            mask = (self.year >= spec.start_year) & (self.year <= spec.end_year) & \
+                   (self.rating_kp > spec.rating_kp) & (self.rating_imdb > spec.rating_imdb)
+        if not spec.genres:
+            return np.flatnonzero(mask)
+
+        by_genre = self._genres.get(spec.genre_prop, {})
+        empty = np.empty(0, dtype=np.int32)
+        rows = by_genre.get(spec.genres[0], empty)
+        for genre in spec.genres[1:]:
+            rows = np.intersect1d(rows, by_genre.get(genre, empty), assume_unique=True)
+        return rows[mask[rows]]
+
+    def count(self, spec: FilterSpec) -> Optional[Tuple[int, bool]]:
+        """
+        Сколько фильмов пройдёт фильтр spec: (счёт, exact). Без cast/directors счёт точный,
+        с ними — верхняя граница. None, если индекс ещё не построен.
+        """
+        if self.loaded_at is None:
+            return None
+        self.lookups += 1
+
+        count = len(self._rows_for(spec))
+        exact = True
+        if spec.cast:
+            count = min(count, sum(self._cast.get(name, 0) for name in spec.cast))
+            exact = False
+        if spec.directors:
+            count = min(count, sum(self._directors.get(name, 0) for name in spec.directors))
+            exact = False
+        return count, exact
+
+    def select(
+            self,
+            spec: FilterSpec,
+            limit: int,
+            exclude_kp_ids: Optional[Set[int]] = None,
+            selected_genres: Optional[List[str]] = None,
+    ) -> Optional[List[int]]:
+        """
+        Локальный аналог _search_movies без текста запроса: фильмы под фильтром spec без
+        исключённых и (если заданы selected_genres) без конфликта 'аниме' + 'мультфильм',
+        `limit` лучших по popularity_score.
+        None — ответить локально нельзя (индекс не построен или в spec есть cast/directors).
+        """
+        if self.loaded_at is None or spec.cast or spec.directors:
+            return None
+        self.selects += 1
+
+        rows = self._rows_for(spec)
+        rows = rows[self.kp_ids[rows] >= 0]
+        if exclude_kp_ids:
+            rows = rows[~np.isin(self.kp_ids[rows], np.fromiter(exclude_kp_ids, dtype=np.int64))]
+        if selected_genres:
+            rows = rows[~genre_conflict_mask(self.flags[rows], genre_flags(selected_genres))]
+        top = rows[top_k(self.popularity[rows], limit, descending=True)]
+        return [int(kp_id) for kp_id in self.kp_ids[top]]
+
+    def stats(self) -> dict:
+        return {
+            "movies": len(self.year),
+            "genres": {prop: len(by_genre) for prop, by_genre in self._genres.items()},
+            "cast": len(self._cast),
+            "directors": len(self._directors),
+            "loaded_at": self.loaded_at,
+            "lookups": self.lookups,
+            "selects": self.selects,
+        }
@@ -0,0 +1,77 @@
+"""
+Описание фильтров recommend в виде значения, а не готового объекта Weaviate Filter.
+
+FilterSpec хешируется и сравнивается, так что его можно передавать в локальные индексы
+(оценка селективности в FacetIndex) и из него же строить `Filter` для запроса в Weaviate.
+"""
+from dataclasses import dataclass, replace
+from typing import Optional, Tuple
+
+from weaviate.classes.query import Filter
+
+from settings import CURRENT_YEAR
+
+
+@dataclass(frozen=True)
+class FilterSpec:
+    """
+    Годы (включительно), рейтинги (строго больше), жанры и актёры/режиссёры.
+    Несколько жанров — фильм должен содержать ВСЕ (contains_all), один — contains_any.
+    cast и directors хранятся на английском языке и проверяются через contains_any.
+    """
+
+    start_year: int = 1900
+    end_year: int = CURRENT_YEAR
+    rating_kp: float = 0.0
+    rating_imdb: float = 0.0
+    genres: Tuple[str, ...] = ()
+    genre_prop: str = "genres"
+    cast: Tuple[str, ...] = ()
+    directors: Tuple[str, ...] = ()
+
+    @classmethod
+    def create(
+            cls,
+            start_year: int = 1900,
+            end_year: int = CURRENT_YEAR,
+            rating_kp: float = 0.0,
+            rating_imdb: float = 0.0,
+            genres=None,
+            locale: str = "ru",
+            cast=None,
+            directors=None,
+    ) -> "FilterSpec":
+        return cls(
+            start_year=start_year,
+            end_year=end_year,
+            rating_kp=rating_kp,
+            rating_imdb=rating_imdb,
+            genres=tuple(genres or ()),
+            genre_prop="genres_tmdb" if locale == "en" else "genres",
+            cast=tuple(cast or ()),
+            directors=tuple(directors or ()),
+        )
+
+    def with_genres(self, genres) -> "FilterSpec":
+        return replace(self, genres=tuple(genres))
+
+    def genre_filter(self) -> Optional[Filter]:
+        if not self.genres:
+            return None
+        if len(self.genres) > 1:
+            return Filter.by_property(self.genre_prop).contains_all(list(self.genres))
+        return Filter.by_property(self.genre_prop).contains_any(list(self.genres))
+
+    def to_filter(self) -> Filter:
+        filters = Filter.by_property("year").greater_or_equal(self.start_year) & \
+                  Filter.by_property("year").less_or_equal(self.end_year) & \
+                  Filter.by_property("rating_kp").greater_than(self.rating_kp) & \
+                  Filter.by_property("rating_imdb").greater_than(self.rating_imdb)
+        genre_filter = self.genre_filter()
+        if genre_filter is not None:
+            filters = filters & genre_filter
+        if self.cast:
+            filters = filters & Filter.by_property("cast").contains_any(list(self.cast))
+        if self.directors:
+            filters = filters & Filter.by_property("directors").contains_any(list(self.directors))
+        return filters
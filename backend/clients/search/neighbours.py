@@ -0,0 +1,390 @@
+"""
+Предрасчитанная таблица ближайших соседей для recommend_similar (лендинг, «похожие фильмы»).
+
+Для каждого kp_id хранятся top-N соседей уже после переранжировки recommend_similar:
+из TOP_K_SIMILAR ближайших по косинусной дистанции отбрасываются фильмы с конфликтом жанров
+и нулевой популярностью, остальные сортируются по adjusted_distance. Онлайн остаётся только
+выкинуть исключения пользователя и догрузить документы.
+
+Раскладка на диске (NEIGHBOUR_TABLE_DIR):
+    CURRENT                  — имя актуальной сборки
+    <build>/kp_ids.npy       — int64 [n], исходные фильмы (в порядке строк зеркала)
+    <build>/neighbours.npy   — int32 [n, N], kp_id соседей (-1 — пустая ячейка)
+    <build>/scores.npy       — float32 [n, N], adjusted_distance
+    <build>/radius.npy       — float32 [n], дистанция до TOP_K_SIMILAR-го кандидата
+    <build>/meta.json        — built_at, mirror_build, size, candidates, penalty_weight, recomputed
+
+Таблица строится по локальному зеркалу векторов (clients.search.vector_mirror). Пересборка
+инкрементальная: пересчитываются только строки, на которые могли повлиять изменившиеся фильмы —
+сами изменённые/новые фильмы и те, в чей радиус кандидатов попал старый или новый вектор
+изменённого/удалённого фильма. Остальные строки копируются из предыдущей сборки без изменений.
+
+Пересборка (после python -m clients.search.vector_mirror):
+    python -m clients.search.neighbours [--full]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import numpy as np
+
+from typing import List, Optional, Set, Tuple
+
+from clients.search.scoring import adjusted_distances, genre_conflict_mask, top_k
+from clients.search.vector_mirror import VectorMirror, publish_build, read_current
+from settings import (
+    TOP_K_SIMILAR,
+    VECTOR_MIRROR_DIR,
+    VECTOR_MIRROR_MAX_AGE,
+    NEIGHBOUR_TABLE_DIR,
+    NEIGHBOUR_TABLE_SIZE,
+    SIMILAR_PENALTY_WEIGHT,
+)
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = -1
+_CHUNK_ROWS = 256
+
+
+class NeighbourTable:
+    """
+    Read-only таблица соседей: kp_id -> [(kp_id соседа, adjusted_distance), ...].
+
+    После load() объект не меняется; новая сборка подхватывается через reloaded().
+    """
+
+    def __init__(
+            self,
+            directory: str = NEIGHBOUR_TABLE_DIR,
+            max_age: float = VECTOR_MIRROR_MAX_AGE,
+    ):
+        self.directory = directory
+        self.max_age = max_age
+
+        self.build_name: Optional[str] = None
+        self.meta: dict = {}
+        self.kp_ids: Optional[np.ndarray] = None
+        self.neighbours: Optional[np.ndarray] = None
+        self.scores: Optional[np.ndarray] = None
+        self.radius: Optional[np.ndarray] = None
+        self._order: Optional[np.ndarray] = None
+        self._sorted_kp_ids: Optional[np.ndarray] = None
+        self.hits = 0
+        self.fallbacks = 0
+
+    def __len__(self) -> int:
+        return 0 if self.kp_ids is None else len(self.kp_ids)
+
+    @property
+    def size(self) -> int:
+        return self.meta.get("size", 0)
+
+    @property
+    def penalty_weight(self) -> Optional[float]:
+        return self.meta.get("penalty_weight")
+
+    def load(self, build_name: Optional[str] = None) -> bool:
+        build_name = build_name or read_current(self.directory)
+        if not build_name:
+            logger.info(f"[NeighbourTable] Таблица не найдена в {self.directory}, используем онлайн-поиск")
+            return False
+
+        build_dir = os.path.join(self.directory, build_name)
+        try:
+            with open(os.path.join(build_dir, "meta.json")) as f:
+                meta = json.load(f)
+            kp_ids = np.load(os.path.join(build_dir, "kp_ids.npy"))
+            neighbours = np.load(os.path.join(build_dir, "neighbours.npy"), mmap_mode="r")
+            scores = np.load(os.path.join(build_dir, "scores.npy"), mmap_mode="r")
+            radius = np.load(os.path.join(build_dir, "radius.npy"))
+        except Exception as e:
+            logger.warning(f"[NeighbourTable] Не удалось загрузить сборку {build_dir}: {e}")
+            return False
+
+        order = np.argsort(kp_ids, kind="stable")
+        self.build_name = build_name
+        self.meta = meta
+        self.kp_ids = kp_ids
+        self.neighbours = neighbours
+        self.scores = scores
+        self.radius = radius
+        self._order = order
+        self._sorted_kp_ids = kp_ids[order]
+
+        logger.info(
+            f"[NeighbourTable] Загружена сборка {build_name}: {len(kp_ids)} фильмов x {meta.get('size')} соседей, "
+            f"зеркало {meta.get('mirror_build')}"
+        )
+        return True
+
+    def reloaded(self) -> Optional["NeighbourTable"]:
+        """
+        Новая таблица с актуальной сборкой, если CURRENT сменился после пересборки; иначе None.
+        Текущий объект не меняется, вызывающий код (периодическая задача) подменяет ссылку.
+        """
+        build_name = read_current(self.directory)
+        if not build_name or build_name == self.build_name:
+            return None
+        table = NeighbourTable(directory=self.directory, max_age=self.max_age)
+        return table if table.load(build_name) else None
+
+    def is_fresh(self) -> bool:
+        if self.kp_ids is None or not len(self.kp_ids):
+            return False
+        return time.time() - self.meta.get("built_at", 0) <= self.max_age
+
+    def row_of(self, kp_id: int) -> Optional[int]:
+        if self.kp_ids is None:
+            return None
+        pos = int(np.searchsorted(self._sorted_kp_ids, kp_id))
+        if pos < len(self._sorted_kp_ids) and self._sorted_kp_ids[pos] == kp_id:
+            return int(self._order[pos])
+        return None
+
+    def rows_of(self, kp_ids) -> np.ndarray:
+        """Номера строк для kp_ids, -1 для отсутствующих в таблице."""
+        wanted = np.asarray(kp_ids, dtype=np.int64)
+        rows = np.full(len(wanted), -1, dtype=np.int64)
+        if self.kp_ids is None or not len(wanted):
+            return rows
+        pos = np.searchsorted(self._sorted_kp_ids, wanted)
+        pos[pos >= len(self._sorted_kp_ids)] = 0
+        found = self._sorted_kp_ids[pos] == wanted
+        rows[found] = self._order[pos[found]]
+        return rows
+
+    def lookup(
+            self,
+            kp_id: int,
+            limit: int,
+            exclude_kp_ids: Optional[Set[int]] = None,
+    ) -> Optional[Tuple[List[int], List[float]]]:
+        """
+        Соседи фильма без исключённых, по возрастанию adjusted_distance.
+
+        Возвращает None (нужен онлайн-поиск), если фильма нет в таблице или после исключений
+        осталось меньше `limit` соседей, а строка таблицы заполнена целиком — то есть за её
+        пределами могли быть ещё подходящие кандидаты.
+        """
+        row = self.row_of(kp_id)
+        if row is None:
+            self.fallbacks += 1
+            return None
+
+        neighbours = np.asarray(self.neighbours[row])
+        scores = np.asarray(self.scores[row])
+        filled = neighbours != _EMPTY
+        keep = filled.copy()
+        if exclude_kp_ids:
+            keep &= ~np.isin(neighbours, np.fromiter(exclude_kp_ids, dtype=np.int64))
+
+        if keep.sum() < limit and filled.all():
+            self.fallbacks += 1
+            return None
+
+        idx = np.flatnonzero(keep)[:limit]
+        self.hits += 1
+        return [int(k) for k in neighbours[idx]], [float(s) for s in scores[idx]]
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.kp_ids is not None,
+            "build": self.build_name,
+            "count": len(self),
+            "size": self.size,
+            "mirror_build": self.meta.get("mirror_build"),
+            "built_at": self.meta.get("built_at"),
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+        }
+
+
+def _compute_rows(
+        mirror: VectorMirror,
+        rows: np.ndarray,
+        size: int,
+        candidates: int,
+        penalty_weight: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Считает соседей для строк зеркала так же, как онлайн recommend_similar."""
+    n = len(mirror)
+    neighbours = np.full((len(rows), size), _EMPTY, dtype=np.int32)
+    scores = np.full((len(rows), size), np.inf, dtype=np.float32)
+    radius = np.full(len(rows), np.inf, dtype=np.float32)
+    k = min(candidates, n - 1)
+    if k <= 0:
+        return neighbours, scores, radius
+
+    # Если в кандидаты попадает вся коллекция, любой новый фильм может стать кандидатом
+    unbounded = k < candidates
+    low_score = mirror.popularity <= 0
+    for start in range(0, len(rows), _CHUNK_ROWS):
+        chunk = rows[start:start + _CHUNK_ROWS]
+        distances = 1.0 - np.asarray(mirror.vectors[chunk]) @ np.asarray(mirror.vectors).T
+        distances[np.arange(len(chunk)), chunk] = np.inf  # сам фильм
+
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        for i, row in enumerate(chunk):
+            cand = nearest[i]
+            cand_distances = distances[i, cand]
+            radius[start + i] = np.inf if unbounded else cand_distances.max()
+
+            keep = ~low_score[cand] & ~genre_conflict_mask(mirror.flags[cand], int(mirror.flags[row]))
+            cand, cand_distances = cand[keep], cand_distances[keep]
+            adjusted = adjusted_distances(cand_distances, mirror.popularity[cand], penalty_weight)
+            top = top_k(adjusted, size)
+
+            neighbours[start + i, :len(top)] = mirror.kp_ids[cand[top]]
+            scores[start + i, :len(top)] = adjusted[top]
+    return neighbours, scores, radius
+
+
+def _changed_rows(mirror: VectorMirror, previous: VectorMirror) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Строки нового зеркала, которые появились или изменились (вектор/популярность/жанры),
+    и строки старого зеркала, которые удалены или изменились.
+    """
+    prev_rows = previous.rows_of(mirror.kp_ids)
+    prev_kp_ids = set(previous.kp_ids.tolist())
+    present = np.fromiter((k in prev_kp_ids for k in mirror.kp_ids.tolist()), dtype=bool, count=len(mirror))
+
+    changed_new = ~present
+    common_new = np.flatnonzero(present)
+    if len(common_new):
+        same = (
+            np.all(np.isclose(mirror.vectors[common_new], previous.vectors[prev_rows], atol=1e-6), axis=1)
+            & (mirror.popularity[common_new] == previous.popularity[prev_rows])
+            & (mirror.flags[common_new] == previous.flags[prev_rows])
+        )
+        changed_new[common_new[~same]] = True
+
+    new_kp_ids = set(mirror.kp_ids.tolist())
+    changed_kp_ids = set(mirror.kp_ids[changed_new].tolist())
+    changed_old = np.fromiter(
+        (k not in new_kp_ids or k in changed_kp_ids for k in previous.kp_ids.tolist()),
+        dtype=bool,
+        count=len(previous),
+    )
+    return np.flatnonzero(changed_new), np.flatnonzero(changed_old)
+
+
+def build_neighbour_table(
+        mirror: VectorMirror,
+        directory: str = NEIGHBOUR_TABLE_DIR,
+        size: int = NEIGHBOUR_TABLE_SIZE,
+        candidates: int = TOP_K_SIMILAR,
+        penalty_weight: float = SIMILAR_PENALTY_WEIGHT,
+        previous: Optional[NeighbourTable] = None,
+        previous_mirror: Optional[VectorMirror] = None,
+        keep_builds: int = 2,
+) -> dict:
+    """
+    Строит таблицу соседей по загруженному зеркалу и атомарно переключает CURRENT.
+
+    Если переданы предыдущая таблица и зеркало, по которому она строилась (с теми же
+    параметрами size/candidates/penalty_weight), пересчитываются только затронутые строки.
+
+    Returns:
+        dict: meta.json новой сборки
+    """
+    n = len(mirror)
+    incremental = (
+        previous is not None and previous.kp_ids is not None
+        and previous_mirror is not None and previous_mirror.kp_ids is not None
+        and previous.meta.get("size") == size
+        and previous.meta.get("candidates") == candidates
+        and previous.meta.get("penalty_weight") == penalty_weight
+    )
+
+    neighbours = np.full((n, size), _EMPTY, dtype=np.int32)
+    scores = np.full((n, size), np.inf, dtype=np.float32)
+    radius = np.full(n, np.inf, dtype=np.float32)
+
+    if incremental:
+        changed_new, changed_old = _changed_rows(mirror, previous_mirror)
+        affected = np.zeros(n, dtype=bool)
+        affected[changed_new] = True
+
+        probes = np.concatenate([
+            np.asarray(mirror.vectors[changed_new]),
+            np.asarray(previous_mirror.vectors[changed_old]),
+        ]) if len(changed_new) or len(changed_old) else None
+
+        prev_rows = previous.rows_of(mirror.kp_ids)
+        affected[prev_rows < 0] = True
+
+        reusable = np.flatnonzero(~affected)
+        if probes is not None and len(reusable):
+            # Строку нужно пересчитать, если изменённый фильм (старый или новый вектор)
+            # ближе, чем её TOP_K_SIMILAR-й кандидат
+            for start in range(0, len(reusable), _CHUNK_ROWS):
+                chunk = reusable[start:start + _CHUNK_ROWS]
+                closest = (1.0 - np.asarray(mirror.vectors[chunk]) @ probes.T).min(axis=1)
+                affected[chunk[closest <= previous.radius[prev_rows[chunk]] + 1e-6]] = True
+
+        reused = np.flatnonzero(~affected)
+        neighbours[reused] = previous.neighbours[prev_rows[reused]]
+        scores[reused] = previous.scores[prev_rows[reused]]
+        radius[reused] = previous.radius[prev_rows[reused]]
+        to_compute = np.flatnonzero(affected)
+        logger.info(
+            f"[NeighbourTable] Инкрементальная сборка: изменено {len(changed_new)} фильмов, "
+            f"удалено/изменено в старом зеркале {len(changed_old)}, пересчитывается {len(to_compute)} из {n} строк"
+        )
+    else:
+        to_compute = np.arange(n)
+        logger.info(f"[NeighbourTable] Полная сборка: {n} строк")
+
+    if len(to_compute):
+        neighbours[to_compute], scores[to_compute], radius[to_compute] = _compute_rows(
+            mirror, to_compute, size, candidates, penalty_weight
+        )
+
+    build_name = f"build-{int(time.time())}"
+    build_dir = os.path.join(directory, build_name)
+    os.makedirs(build_dir, exist_ok=True)
+    np.save(os.path.join(build_dir, "kp_ids.npy"), np.asarray(mirror.kp_ids, dtype=np.int64))
+    np.save(os.path.join(build_dir, "neighbours.npy"), neighbours)
+    np.save(os.path.join(build_dir, "scores.npy"), scores)
+    np.save(os.path.join(build_dir, "radius.npy"), radius)
+
+    meta = {
+        "built_at": mirror.meta.get("built_at", time.time()),
+        "mirror_build": mirror.build_name,
+        "size": size,
+        "candidates": candidates,
+        "penalty_weight": penalty_weight,
+        "recomputed": int(len(to_compute)),
+    }
+    with open(os.path.join(build_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    publish_build(directory, build_name, keep_builds)
+    logger.info(f"[NeighbourTable] Сборка {build_name} готова: пересчитано {len(to_compute)} из {n} строк")
+    return meta
+
+
+def _main(full: bool = False) -> None:
+    mirror = VectorMirror(directory=VECTOR_MIRROR_DIR, quantized=False)
+    if not mirror.load():
+        raise RuntimeError("Зеркало векторов не найдено — сначала python -m clients.search.vector_mirror")
+
+    previous = previous_mirror = None
+    if not full:
+        previous = NeighbourTable()
+        if previous.load():
+            if previous.meta.get("mirror_build") == mirror.build_name:
+                previous_mirror = mirror
+            else:
+                previous_mirror = VectorMirror(directory=VECTOR_MIRROR_DIR, quantized=False)
+                if not previous_mirror.load(previous.meta["mirror_build"]):
+                    previous_mirror = None
+
+    build_neighbour_table(mirror, previous=previous, previous_mirror=previous_mirror)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    _main(full="--full" in sys.argv)
@@ -0,0 +1,152 @@
+"""
+Материализованный список популярных фильмов по ключу (locale, min_year, min_rating_kp).
+
+Список одинаков для всех пользователей, поэтому он считается один раз и периодически
+обновляется в фоне; на запрос остаётся только выкинуть исключения пользователя и взять limit.
+Рядом с документами хранится готовый JSON каждого фильма (serializer), чтобы роут не собирал
+и не валидировал pydantic-модели на каждый вызов.
+"""
+import time
+import asyncio
+import logging
+
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from clients.search.singleflight import SingleFlight
+from settings import POPULAR_SNAPSHOT_MAX_AGE, POPULAR_SNAPSHOT_IDLE_TTL, POPULAR_SNAPSHOT_FETCH_LIMIT
+
+logger = logging.getLogger(__name__)
+
+PopularKey = Tuple[str, int, float]
+
+
+@dataclass
+class PopularEntry:
+    movies: List[dict]
+    payloads: List[Optional[bytes]]  # None — фильм ещё не сериализован (direct-ключи)
+    serializer: Callable[[dict], bytes]
+    built_at: float = field(default_factory=time.time)
+    last_access: float = field(default_factory=time.time)
+
+    def select(self, limit: int, exclude_kp_ids: Optional[Set[int]] = None) -> List[int]:
+        """Индексы первых `limit` фильмов без исключённых."""
+        exclude = exclude_kp_ids or set()
+        selected = []
+        for i, movie in enumerate(self.movies):
+            if movie.get("kp_id") in exclude:
+                continue
+            selected.append(i)
+            if len(selected) >= limit:
+                break
+        return selected
+
+    def payload(self, i: int) -> bytes:
+        if self.payloads[i] is None:
+            self.payloads[i] = self.serializer(self.movies[i])
+        return self.payloads[i]
+
+
+class PopularMoviesSnapshot:
+    """
+    In-memory снапшоты популярных фильмов.
+
+    - Первый запрос по ключу строит снапшот синхронно (конкурентные запросы ждут одну загрузку).
+    - refresh_all() (фоновая задача) перестраивает все ключи, к которым обращались за последние
+      idle_ttl секунд, и забывает остальные.
+    - Если фоновое обновление не успело, снапшот старше max_age перестраивается на запросе.
+    - Снапшоты хранятся только для предустановленных ключей (is_preset): ключ собирается из
+      параметров запроса, и перебор min_year/min_rating_kp иначе раздувал бы память и фоновую
+      нагрузку на Weaviate. Остальные ключи считаются на запросе и не запоминаются (direct):
+      из Weaviate читается max(limit * 10, 1000) кандидатов, сериализуются только отданные
+      фильмы, одновременные загрузки одного ключа схлопываются.
+    """
+
+    def __init__(
+            self,
+            loader: Callable[[str, int, float, int], Awaitable[List[dict]]],
+            serializer: Callable[[dict], bytes],
+            max_age: float = POPULAR_SNAPSHOT_MAX_AGE,
+            idle_ttl: float = POPULAR_SNAPSHOT_IDLE_TTL,
+            is_preset: Callable[[PopularKey], bool] = lambda key: True,
+    ):
+        self.loader = loader
+        self.is_preset = is_preset
+        self.serializer = serializer
+        self.max_age = max_age
+        self.idle_ttl = idle_ttl
+        self._entries: Dict[PopularKey, PopularEntry] = {}
+        self._locks: Dict[PopularKey, asyncio.Lock] = {}
+        self.inflight = SingleFlight(name="popular")
+        self.hits = 0
+        self.builds = 0
+        self.direct = 0
+
+    async def _load(self, key: PopularKey) -> PopularEntry:
+        movies = await self.loader(*key, POPULAR_SNAPSHOT_FETCH_LIMIT)
+        payloads = [self.serializer(movie) for movie in movies]
+        return PopularEntry(movies=movies, payloads=payloads, serializer=self.serializer)
+
+    async def _load_direct(self, key: PopularKey, fetch_limit: int) -> PopularEntry:
+        movies = await self.loader(*key, fetch_limit)
+        return PopularEntry(movies=movies, payloads=[None] * len(movies), serializer=self.serializer)
+
+    async def _build(self, key: PopularKey) -> PopularEntry:
+        entry = await self._load(key)
+        previous = self._entries.get(key)
+        if previous is not None:
+            entry.last_access = previous.last_access
+        self._entries[key] = entry
+        self.builds += 1
+        logger.info(f"[PopularMoviesSnapshot] Снапшот {key} обновлён: {len(entry.movies)} фильмов")
+        return entry
+
+    async def get(self, key: PopularKey, limit: int = 100) -> PopularEntry:
+        if not self.is_preset(key):
+            self.direct += 1
+            fetch_limit = max(limit * 10, 1000)
+            return await self.inflight.run(
+                (key, fetch_limit), lambda: self._load_direct(key, fetch_limit), copy=None
+            )
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry.built_at > self.max_age:
+            lock = self._locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                entry = self._entries.get(key)
+                if entry is None or time.time() - entry.built_at > self.max_age:
+                    entry = await self._build(key)
+                else:
+                    self.hits += 1
+        else:
+            self.hits += 1
+        entry.last_access = time.time()
+        return entry
+
+    async def refresh_all(self) -> int:
+        """Перестраивает активные снапшоты. Возвращает число обновлённых ключей."""
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if now - e.last_access > self.idle_ttl]:
+            self._entries.pop(key, None)
+            self._locks.pop(key, None)
+
+        refreshed = 0
+        for key in list(self._entries):
+            try:
+                async with self._locks.setdefault(key, asyncio.Lock()):
+                    await self._build(key)
+                refreshed += 1
+            except Exception as e:
+                # Оставляем прежний снапшот — он лучше, чем ничего
+                logger.warning(f"[PopularMoviesSnapshot] Не удалось обновить снапшот {key}: {e}")
+        return refreshed
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._entries),
+            "movies": sum(len(e.movies) for e in self._entries.values()),
+            "payload_bytes": sum(len(p) for e in self._entries.values() for p in e.payloads if p is not None),
+            "hits": self.hits,
+            "builds": self.builds,
+            "direct": self.direct,
+            "direct_inflight": self.inflight.stats(),
+        }
@@ -0,0 +1,164 @@
+"""
+Общий кэш результатов recommend по нормализованным критериям (без исключений пользователя).
+
+Одинаковые жанры/годы/рейтинги/атмосферы у разных пользователей дают один и тот же список
+кандидатов, поэтому он считается один раз, а исключения каждого пользователя вычитаются после
+чтения из кэша. Общий список длиннее выдачи на headroom фильмов, чтобы после исключений
+в нём оставалось RECOMMEND_RESULT_LIMIT. В записи хранятся только kp_id и скоры (distance, adjusted_distance,
+combined_score) — документы догружаются из кэша документов рекомендателя.
+"""
+import hashlib
+import logging
+import numpy as np
+
+from dataclasses import dataclass, replace
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from clients.search.caching import LRUCache
+from clients.search.filters import FilterSpec
+from settings import (
+    RECOMMEND_CACHE_MAX_ENTRIES,
+    RECOMMEND_CACHE_MAX_BYTES,
+    RECOMMEND_CACHE_TTL,
+    RECOMMEND_CACHE_HEADROOM,
+    RECOMMEND_RESULT_LIMIT,
+    MIN_GENRE_FALLBACK,
+)
+
+logger = logging.getLogger(__name__)
+
+SCORE_FIELDS = ("distance", "adjusted_distance", "combined_score")
+
+
+@dataclass
+class CachedResult:
+    kp_ids: np.ndarray
+    columns: Dict[str, np.ndarray]
+
+    @property
+    def nbytes(self) -> int:
+        return self.kp_ids.nbytes + sum(values.nbytes for values in self.columns.values())
+
+    @classmethod
+    def from_movies(cls, movies: List[dict]) -> "CachedResult":
+        kp_ids = np.fromiter((-1 if m.get("kp_id") is None else m["kp_id"] for m in movies), dtype=np.int64, count=len(movies))
+        columns = {}
+        for name in SCORE_FIELDS:
+            values = np.fromiter(
+                (np.nan if m.get(name) is None else m[name] for m in movies), dtype=np.float64, count=len(movies)
+            )
+            if not np.isnan(values).all():
+                columns[name] = values
+        return cls(kp_ids=kp_ids, columns=columns)
+
+    def without(self, exclude_kp_ids: Optional[Set[int]]) -> "CachedResult":
+        if not exclude_kp_ids:
+            return self
+        keep = ~np.isin(self.kp_ids, np.fromiter(exclude_kp_ids, dtype=np.int64))
+        return CachedResult(
+            kp_ids=self.kp_ids[keep],
+            columns={name: values[keep] for name, values in self.columns.items()},
+        )
+
+    def head(self, count: int) -> "CachedResult":
+        if len(self.kp_ids) <= count:
+            return self
+        return CachedResult(
+            kp_ids=self.kp_ids[:count],
+            columns={name: values[:count] for name, values in self.columns.items()},
+        )
+
+
+def _vector_digest(vector: Optional[List[float]]) -> Optional[str]:
+    if vector is None:
+        return None
+    data = np.asarray(vector, dtype=np.float32).tobytes()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def recommend_cache_key(
+        spec: FilterSpec,
+        query: Optional[str],
+        movie_name: Optional[str],
+        suggested_titles: Optional[List[str]],
+        query_vector: Optional[List[float]],
+) -> Tuple[Hashable, ...]:
+    """
+    Канонический ключ параметров recommend. Порядок жанров сохраняется (первый — главный для
+    fallback), cast/directors сортируются (contains_any), пробелы в текстах схлопываются.
+    """
+    spec = replace(spec, cast=tuple(sorted(spec.cast)), directors=tuple(sorted(spec.directors)))
+    return (
+        spec,
+        " ".join(query.split()) if query else None,
+        " ".join(movie_name.lower().split()) if movie_name else None,
+        tuple(" ".join(t.split()) for t in suggested_titles) if suggested_titles else (),
+        _vector_digest(query_vector),
+    )
+
+
+class RecommendResultCache:
+    """
+    LRU с TTL и лимитом памяти поверх LRUCache, версия — версия коллекции рекомендателя.
+
+    Общий поиск запрашивает fetch_limit = limit + headroom фильмов, personalize() вычитает
+    исключения пользователя и отдаёт первые limit. Если исключения съели запас, а общий список
+    был полным (под фильтром могут быть ещё фильмы), personalize() возвращает None —
+    нужен персональный поиск с фильтром исключений (shortfalls).
+
+    Общий список собран без исключений, поэтому решение о fallback по главному жанру
+    (MIN_GENRE_FALLBACK) в нём принято до них. Если исключения опустили список ниже min_results,
+    personalize() тоже возвращает None: персональный поиск повторит это решение с исключениями.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = RECOMMEND_CACHE_MAX_ENTRIES,
+            max_bytes: int = RECOMMEND_CACHE_MAX_BYTES,
+            ttl: float = RECOMMEND_CACHE_TTL,
+            limit: int = RECOMMEND_RESULT_LIMIT,
+            headroom: int = RECOMMEND_CACHE_HEADROOM,
+            min_results: int = MIN_GENRE_FALLBACK,
+    ):
+        self.cache = LRUCache(name="recommend_results", max_entries=max_entries, ttl=ttl, max_bytes=max_bytes)
+        self.limit = limit
+        self.headroom = headroom
+        self.min_results = min_results
+        self.shortfalls = 0
+
+    @property
+    def fetch_limit(self) -> int:
+        return self.limit + self.headroom
+
+    def get(self, key: Hashable) -> Optional[CachedResult]:
+        return self.cache.get(key)
+
+    def personalize(self, cached: CachedResult, exclude_kp_ids: Optional[Set[int]]) -> Optional[CachedResult]:
+        """Первые limit фильмов общего списка без исключений пользователя; None, если их не набрать."""
+        result = cached.without(exclude_kp_ids)
+        needed = None
+        if len(result.kp_ids) < self.limit and len(cached.kp_ids) >= self.fetch_limit:
+            needed = self.limit
+        elif len(result.kp_ids) < self.min_results <= len(cached.kp_ids):
+            needed = self.min_results
+        if needed is not None:
+            self.shortfalls += 1
+            logger.info(
+                f"[RecommendResultCache] Исключения оставили {len(result.kp_ids)} из {len(cached.kp_ids)} "
+                f"фильмов (< {needed}), нужен персональный поиск"
+            )
+            return None
+        return result.head(self.limit)
+
+    def store(self, key: Hashable, movies: List[dict]) -> CachedResult:
+        result = CachedResult.from_movies(movies)
+        if movies:
+            # Пустой список может быть следствием ошибки Weaviate — его не запоминаем
+            self.cache.set(key, result)
+        return result
+
+    def set_version(self, version: Hashable) -> bool:
+        return self.cache.set_version(version)
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "shortfalls": self.shortfalls}
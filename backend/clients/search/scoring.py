@@ -0,0 +1,101 @@
+"""
+Векторизованный скоринг кандидатов для recommend / recommend_similar / _search_movies.
+
+Функции принимают массивы (distance, popularity, жанровые флаги) вместо списков dict'ов.
+Отбор top-k идёт через np.argpartition, а порядок совпадает со стабильной сортировкой
+sorted(): при равных score кандидаты остаются в исходном порядке.
+"""
+import numpy as np
+
+from typing import Iterable, Optional
+
+FLAG_ANIME = 1
+FLAG_CARTOON = 2
+
+
+def genre_flags(genres) -> int:
+    """Жанровые флаги, нужные для проверки конфликта 'аниме' + 'мультфильм' без документа."""
+    genres = genres or []
+    flags = 0
+    if "аниме" in genres:
+        flags |= FLAG_ANIME
+    if "мультфильм" in genres:
+        flags |= FLAG_CARTOON
+    return flags
+
+
+def genre_conflict_mask(flags: np.ndarray, source_flags: int) -> np.ndarray:
+    """
+    Векторная версия MovieWeaviateRecommender._skip_due_to_genre_conflict по жанровым флагам:
+    фильм одновременно 'аниме' и 'мультфильм', а у исходного фильма нет 'аниме'.
+    """
+    both = FLAG_ANIME | FLAG_CARTOON
+    conflict = (np.asarray(flags) & both) == both
+    if source_flags & FLAG_ANIME:
+        conflict[...] = False
+    return conflict
+
+
+def adjusted_distances(distances: np.ndarray, popularity: np.ndarray, penalty_weight: float) -> np.ndarray:
+    """distance * (1 + penalty_weight * log1p(10 - popularity)), popularity ограничена сверху 10."""
+    popularity = np.asarray(popularity, dtype=np.float64)
+    score_diff = np.maximum(0.0, 10.0 - np.minimum(popularity, 10.0))
+    return distances * (1 + penalty_weight * np.log1p(score_diff))
+
+
+def combined_scores(distances: np.ndarray, popularity: np.ndarray, distance_weight: float) -> np.ndarray:
+    """
+    distance_weight * (1 - distance/2) + (1 - distance_weight) * popularity/10 (обе части не больше 1).
+    Для кандидатов без distance (NaN) — только нормированная популярность.
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    normalized_popularity = np.minimum(np.asarray(popularity, dtype=np.float64) / 10.0, 1.0)
+    relevance = 1.0 - np.minimum(distances / 2.0, 1.0)
+    combined = distance_weight * relevance + (1 - distance_weight) * normalized_popularity
+    return np.where(np.isnan(distances), normalized_popularity, combined)
+
+
+def column(movies: Iterable[dict], key: str, default: float = 0.0) -> np.ndarray:
+    """Числовое поле кандидатов массивом; None и отсутствующие значения -> default."""
+    values = (movie.get(key) for movie in movies)
+    return np.fromiter((default if value is None else value for value in values), dtype=np.float64)
+
+
+def top_k(scores: np.ndarray, k: int, descending: bool = False) -> np.ndarray:
+    """
+    Индексы k лучших score в порядке ранжирования.
+    Эквивалентно np.argsort(scores, kind="stable")[:k] (или по убыванию), но без полной сортировки.
+    """
+    keys = np.asarray(scores, dtype=np.float64)
+    if descending:
+        keys = -keys
+    n = len(keys)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        threshold = keys[np.argpartition(keys, k - 1)[:k]].max()
+        # Все кандидаты с score на границе: при равенстве выигрывает более ранний, как в sorted()
+        candidates = np.flatnonzero(keys <= threshold)
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(keys[candidates], kind="stable")][:k]
+
+
+def rank(
+        scores: np.ndarray,
+        k: int,
+        descending: bool = False,
+        priority: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    top_k с приоритетной группой: кандидаты с priority=True идут первыми (каждая группа
+    отсортирована по score) — аналог sorted(key=lambda x: (not priority, score)).
+    """
+    if priority is None:
+        return top_k(scores, k, descending)
+    scores = np.asarray(scores, dtype=np.float64)
+    first = np.flatnonzero(priority)
+    rest = np.flatnonzero(~np.asarray(priority, dtype=bool))
+    head = first[top_k(scores[first], k, descending)]
+    tail = rest[top_k(scores[rest], k - len(head), descending)]
+    return np.concatenate([head, tail])
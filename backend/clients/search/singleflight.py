@@ -0,0 +1,65 @@
+"""
+Схлопывание одинаковых одновременных вызовов (single-flight).
+
+Пока вычисление по ключу не завершилось, повторные вызовы с тем же ключом не запускают
+своё, а ждут результат первого. Вычисление защищено от отмены ожидающих (asyncio.shield):
+если клиент, запустивший его, отключился, остальные всё равно получат ответ.
+Исключение получают все ожидающие. Результат общий, поэтому по умолчанию каждому
+вызывающему отдаётся своя копия (copy_movies для списков документов).
+"""
+import asyncio
+import logging
+
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def copy_movies(movies: List[dict]) -> List[dict]:
+    return [dict(movie) for movie in movies]
+
+
+class SingleFlight:
+    """Счётчики: leaders — реально выполненные вычисления, shared — вызовы, получившие чужой результат."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def run(
+            self,
+            key: Hashable,
+            factory: Callable[[], Awaitable[Any]],
+            copy: Optional[Callable[[Any], Any]] = copy_movies,
+    ) -> Any:
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+            self.leaders += 1
+        else:
+            self.shared += 1
+            logger.debug(f"[SingleFlight:{self.name}] Ждём уже идущее вычисление {key}")
+
+        result = await asyncio.shield(future)
+        return copy(result) if copy is not None else result
+
+    def _forget(self, key: Hashable, done: asyncio.Future) -> None:
+        if self._inflight.get(key) is done:
+            del self._inflight[key]
+        if not done.cancelled():
+            # Исключение уже получили ожидающие; без этого asyncio ругается на "never retrieved"
+            done.exception()
+
+    def stats(self) -> dict:
+        calls = self.leaders + self.shared
+        return {
+            "name": self.name,
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "shared": self.shared,
+            "dedup_rate": round(self.shared / calls, 4) if calls else 0.0,
+        }
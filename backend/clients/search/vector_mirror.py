@@ -0,0 +1,391 @@
+"""
+Локальное зеркало векторов коллекции Movie для similarity-запросов без round trip в Weaviate.
+
+Раскладка на диске (VECTOR_MIRROR_DIR):
+    CURRENT                 — имя актуальной сборки (атомарно заменяется при пересборке)
+    <build>/vectors.f32.npy — float32 [n, dim], нормированные векторы
+    <build>/vectors.i8.npy  — int8 [n, dim], квантованные векторы (опционально)
+    <build>/scales.npy      — float32 [n], масштаб строки для int8
+    <build>/kp_ids.npy      — int64 [n], kp_id строки
+    <build>/popularity.npy  — float32 [n], popularity_score
+    <build>/flags.npy       — uint8 [n], жанровые флаги (FLAG_ANIME | FLAG_CARTOON)
+    <build>/meta.json       — built_at, count, dim, collection, quantized
+
+Все воркеры gunicorn открывают одни и те же файлы через np.load(mmap_mode="r"),
+так что матрица лежит в page cache один раз.
+
+Пересборка:
+    python -m clients.search.vector_mirror
+"""
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+import numpy as np
+
+from typing import Optional, Set, Tuple
+
+from clients.search.scoring import genre_flags
+from settings import (
+    CLASS_NAME,
+    VECTOR_MIRROR_DIR,
+    VECTOR_MIRROR_MAX_AGE,
+    VECTOR_MIRROR_QUANTIZED,
+    VECTOR_MIRROR_OVERSAMPLE,
+)
+
+logger = logging.getLogger(__name__)
+
+_CURRENT_FILE = "CURRENT"
+_CHUNK_ROWS = 8192
+
+
+def read_current(directory: str) -> Optional[str]:
+    """Имя актуальной сборки из файла CURRENT (None, если сборок ещё нет)."""
+    try:
+        with open(os.path.join(directory, _CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publish_build(directory: str, build_name: str, keep_builds: int = 2) -> None:
+    """Атомарно переключает CURRENT на сборку и удаляет старые сборки сверх keep_builds."""
+    tmp_current = os.path.join(directory, f"{_CURRENT_FILE}.tmp")
+    with open(tmp_current, "w") as f:
+        f.write(build_name)
+    os.replace(tmp_current, os.path.join(directory, _CURRENT_FILE))
+
+    builds = sorted(d for d in os.listdir(directory) if d.startswith("build-"))
+    for old in builds[:-keep_builds]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class VectorMirror:
+    """
+    Read-only зеркало векторов: top-k по косинусной дистанции (1 - cos) полным перебором в NumPy.
+
+    В квантованном режиме перебор идёт по int8-матрице (в 4 раза меньше памяти/трафика),
+    а лучшие `k * oversample` кандидатов пересчитываются по float32-векторам.
+    Если зеркало не загружено или старше max_age — is_fresh() == False, и вызывающий код
+    уходит в Weaviate.
+
+    search() — полный перебор N×dim, из async-кода он вызывается через asyncio.to_thread.
+    После load() объект не меняется; новая сборка подхватывается через reloaded().
+    """
+
+    def __init__(
+            self,
+            directory: str = VECTOR_MIRROR_DIR,
+            max_age: float = VECTOR_MIRROR_MAX_AGE,
+            quantized: bool = VECTOR_MIRROR_QUANTIZED,
+            oversample: int = VECTOR_MIRROR_OVERSAMPLE,
+    ):
+        self.directory = directory
+        self.max_age = max_age
+        self.quantized = quantized
+        self.oversample = oversample
+
+        self.build_name: Optional[str] = None
+        self.meta: dict = {}
+        self.vectors: Optional[np.ndarray] = None
+        self.vectors_i8: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.kp_ids: Optional[np.ndarray] = None
+        self.popularity: Optional[np.ndarray] = None
+        self.flags: Optional[np.ndarray] = None
+        self._order: Optional[np.ndarray] = None
+        self._sorted_kp_ids: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return 0 if self.kp_ids is None else len(self.kp_ids)
+
+    # ── загрузка ─────────────────────────────────────────────────────
+
+    def load(self, build_name: Optional[str] = None) -> bool:
+        """
+        Отображает в память сборку (по умолчанию актуальную из CURRENT).
+        Возвращает True, если зеркало загружено.
+        """
+        build_name = build_name or read_current(self.directory)
+        if not build_name:
+            logger.info(f"[VectorMirror] Зеркало не найдено в {self.directory}, используем Weaviate")
+            return False
+
+        build_dir = os.path.join(self.directory, build_name)
+        try:
+            with open(os.path.join(build_dir, "meta.json")) as f:
+                meta = json.load(f)
+            count = meta["count"]
+
+            vectors = np.load(os.path.join(build_dir, "vectors.f32.npy"), mmap_mode="r")[:count]
+            kp_ids = np.load(os.path.join(build_dir, "kp_ids.npy"))[:count]
+            popularity = np.load(os.path.join(build_dir, "popularity.npy"))[:count]
+            flags = np.load(os.path.join(build_dir, "flags.npy"))[:count]
+
+            vectors_i8 = scales = None
+            if self.quantized and meta.get("quantized"):
+                vectors_i8 = np.load(os.path.join(build_dir, "vectors.i8.npy"), mmap_mode="r")[:count]
+                scales = np.load(os.path.join(build_dir, "scales.npy"))[:count]
+        except Exception as e:
+            logger.warning(f"[VectorMirror] Не удалось загрузить сборку {build_dir}: {e}")
+            return False
+
+        order = np.argsort(kp_ids, kind="stable")
+        self.build_name = build_name
+        self.meta = meta
+        self.vectors = vectors
+        self.vectors_i8 = vectors_i8
+        self.scales = scales
+        self.kp_ids = kp_ids
+        self.popularity = popularity
+        self.flags = flags
+        self._order = order
+        self._sorted_kp_ids = kp_ids[order]
+
+        logger.info(
+            f"[VectorMirror] Загружена сборка {build_name}: {count} векторов, dim={meta.get('dim')}, "
+            f"int8={'да' if vectors_i8 is not None else 'нет'}, built_at={meta.get('built_at')}"
+        )
+        return True
+
+    def reloaded(self) -> Optional["VectorMirror"]:
+        """
+        Новое зеркало с актуальной сборкой, если CURRENT сменился после пересборки; иначе None.
+        Текущий объект не меняется: поиск, идущий в потоке, дорабатывает по своей сборке,
+        а вызывающий код (периодическая задача) просто подменяет ссылку на зеркало.
+        """
+        build_name = read_current(self.directory)
+        if not build_name or build_name == self.build_name:
+            return None
+        mirror = VectorMirror(
+            directory=self.directory,
+            max_age=self.max_age,
+            quantized=self.quantized,
+            oversample=self.oversample,
+        )
+        return mirror if mirror.load(build_name) else None
+
+    def is_fresh(self) -> bool:
+        if self.kp_ids is None or not len(self.kp_ids):
+            return False
+        return time.time() - self.meta.get("built_at", 0) <= self.max_age
+
+    # ── доступ к строкам ─────────────────────────────────────────────
+
+    def rows_of(self, kp_ids) -> np.ndarray:
+        """Номера строк для kp_ids (отсутствующие в зеркале отбрасываются)."""
+        if self.kp_ids is None:
+            return np.empty(0, dtype=np.int64)
+        wanted = np.fromiter((k for k in kp_ids if k is not None), dtype=np.int64)
+        if not len(wanted):
+            return np.empty(0, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_kp_ids, wanted)
+        pos[pos >= len(self._sorted_kp_ids)] = 0
+        found = self._sorted_kp_ids[pos] == wanted
+        return self._order[pos[found]]
+
+    def row_of(self, kp_id: int) -> Optional[int]:
+        rows = self.rows_of([kp_id])
+        return int(rows[0]) if len(rows) else None
+
+    def vector(self, kp_id: int) -> Optional[np.ndarray]:
+        row = self.row_of(kp_id)
+        return None if row is None else np.array(self.vectors[row], dtype=np.float32)
+
+    # ── поиск ────────────────────────────────────────────────────────
+
+    def _scores_float(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        if rows is not None:
+            return np.asarray(self.vectors[rows], dtype=np.float32) @ query
+        scores = np.empty(len(self.kp_ids), dtype=np.float32)
+        for start in range(0, len(scores), _CHUNK_ROWS):
+            end = start + _CHUNK_ROWS
+            scores[start:end] = self.vectors[start:end] @ query
+        return scores
+
+    def _scores_int8(self, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(self.kp_ids), dtype=np.float32)
+        for start in range(0, len(scores), _CHUNK_ROWS):
+            end = start + _CHUNK_ROWS
+            scores[start:end] = self.vectors_i8[start:end].astype(np.float32) @ query
+        return scores * self.scales
+
+    def search(
+            self,
+            query_vector,
+            k: int,
+            exclude_kp_ids: Optional[Set[int]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k ближайших фильмов к вектору.
+
+        Returns:
+            (rows, distances): номера строк зеркала и косинусные дистанции, по возрастанию дистанции.
+        """
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        use_int8 = self.vectors_i8 is not None
+        scores = self._scores_int8(query) if use_int8 else self._scores_float(query)
+
+        if exclude_kp_ids:
+            scores[self.rows_of(exclude_kp_ids)] = -np.inf
+
+        n_candidates = min(len(scores), k * self.oversample if use_int8 else k)
+        if n_candidates <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if n_candidates < len(scores):
+            candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[np.isfinite(scores[candidates])]
+
+        if use_int8:
+            # Пересчёт лучших кандидатов по float32-векторам
+            candidate_scores = self._scores_float(query, rows=np.sort(candidates))
+            candidates = np.sort(candidates)
+        else:
+            candidate_scores = scores[candidates]
+
+        order = np.argsort(-candidate_scores, kind="stable")[:k]
+        rows = candidates[order]
+        distances = (1.0 - candidate_scores[order]).astype(np.float32)
+        return rows, distances
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.kp_ids is not None,
+            "build": self.build_name,
+            "count": len(self),
+            "dim": self.meta.get("dim"),
+            "built_at": self.meta.get("built_at"),
+            "quantized": self.vectors_i8 is not None,
+            "fresh": self.kp_ids is not None and time.time() - self.meta.get("built_at", 0) <= self.max_age,
+        }
+
+
+async def build_vector_mirror(
+        collection,
+        directory: str = VECTOR_MIRROR_DIR,
+        quantize: bool = True,
+        keep_builds: int = 2,
+) -> dict:
+    """
+    Выгружает векторы коллекции в новую сборку зеркала и атомарно переключает CURRENT.
+
+    Args:
+        collection: асинхронная коллекция Weaviate (CollectionAsync)
+        directory: каталог зеркала
+        quantize: дополнительно сохранить int8-матрицу для квантованного режима
+        keep_builds: сколько последних сборок оставлять на диске
+
+    Returns:
+        dict: meta.json новой сборки
+    """
+    total = (await collection.aggregate.over_all(total_count=True)).total_count
+    build_name = f"build-{int(time.time())}"
+    build_dir = os.path.join(directory, build_name)
+    os.makedirs(build_dir, exist_ok=True)
+
+    kp_ids = np.zeros(total, dtype=np.int64)
+    popularity = np.zeros(total, dtype=np.float32)
+    flags = np.zeros(total, dtype=np.uint8)
+    vectors = None
+    dim = None
+    row = 0
+
+    logger.info(f"[VectorMirror] Сборка {build_name}: ожидается {total} объектов")
+
+    async for obj in collection.iterator(
+            include_vector=True,
+            return_properties=["kp_id", "popularity_score", "genres"],
+    ):
+        if row >= total:
+            logger.warning(f"[VectorMirror] В коллекции появилось больше {total} объектов, остаток пропущен")
+            break
+        props = obj.properties
+        vector = obj.vector
+        if isinstance(vector, dict):
+            vector = vector.get("default") or next(iter(vector.values()), None)
+        if props.get("kp_id") is None or not vector:
+            continue
+        if vectors is None:
+            dim = len(vector)
+            vectors = np.lib.format.open_memmap(
+                os.path.join(build_dir, "vectors.f32.npy"), mode="w+", dtype=np.float32, shape=(total, dim)
+            )
+        vectors[row] = vector
+        kp_ids[row] = props["kp_id"]
+        popularity[row] = props.get("popularity_score") or 0.0
+        flags[row] = genre_flags(props.get("genres"))
+        row += 1
+
+    if vectors is None:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise RuntimeError("Коллекция пуста — зеркало не построено")
+
+    for start in range(0, row, _CHUNK_ROWS):
+        end = min(start + _CHUNK_ROWS, row)
+        vectors[start:end] = _normalize_rows(np.asarray(vectors[start:end]))
+
+    if quantize:
+        vectors_i8 = np.lib.format.open_memmap(
+            os.path.join(build_dir, "vectors.i8.npy"), mode="w+", dtype=np.int8, shape=(total, dim)
+        )
+        scales = np.zeros(total, dtype=np.float32)
+        for start in range(0, row, _CHUNK_ROWS):
+            end = min(start + _CHUNK_ROWS, row)
+            chunk = np.asarray(vectors[start:end])
+            chunk_scales = np.abs(chunk).max(axis=1) / 127.0
+            chunk_scales[chunk_scales == 0] = 1.0
+            vectors_i8[start:end] = np.round(chunk / chunk_scales[:, None]).astype(np.int8)
+            scales[start:end] = chunk_scales
+        vectors_i8.flush()
+        np.save(os.path.join(build_dir, "scales.npy"), scales)
+
+    vectors.flush()
+    np.save(os.path.join(build_dir, "kp_ids.npy"), kp_ids)
+    np.save(os.path.join(build_dir, "popularity.npy"), popularity)
+    np.save(os.path.join(build_dir, "flags.npy"), flags)
+
+    meta = {
+        "built_at": time.time(),
+        "count": row,
+        "dim": dim,
+        "collection": CLASS_NAME,
+        "quantized": quantize,
+    }
+    with open(os.path.join(build_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    publish_build(directory, build_name, keep_builds)
+
+    logger.info(f"[VectorMirror] Сборка {build_name} готова: {row} векторов, dim={dim}")
+    return meta
+
+
+async def _main() -> None:
+    from clients.weaviate_client import load_vectorstore_weaviate
+
+    weaviate_client = load_vectorstore_weaviate()
+    await weaviate_client.connect()
+    try:
+        await build_vector_mirror(weaviate_client.collections.get(CLASS_NAME))
+    finally:
+        await weaviate_client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    asyncio.run(_main())
@@ -1,16 +1,47 @@
-import math
+import asyncio
 import logging
 import numpy as np
 from datetime import datetime
 
-from typing import Optional, List, Set, AsyncGenerator
+from typing import Optional, List, Set, Dict, Tuple, AsyncGenerator, Awaitable, Callable
 from openai import AsyncOpenAI
 from weaviate.connect import ConnectionParams
+from weaviate.classes.init import AdditionalConfig, Timeout
 from weaviate.classes.query import Filter
-from weaviate import WeaviateClient
+from weaviate import WeaviateAsyncClient
 
 from clients.kp_client import KinopoiskClient
+from clients.search import (
+    LRUCache,
+    EmbeddingCache,
+    AtmosphereEmbeddingTable,
+    VectorMirror,
+    NeighbourTable,
+    CatalogIndex,
+    CandidateBatch,
+    FacetIndex,
+    FilterSpec,
+    KpIdIndex,
+    TitleIndex,
+    PopularEntry,
+    PopularMoviesSnapshot,
+    CachedResult,
+    RecommendResultCache,
+    SingleFlight,
+    recommend_cache_key,
+    scan_catalog,
+)
+from clients.rerank import LocalReranker, RerankCache, RerankLoad, RerankPromptBuilder
+from clients.search.scoring import (
+    adjusted_distances,
+    column,
+    combined_scores,
+    genre_conflict_mask,
+    rank,
+    top_k,
+)
 from db_managers import AsyncSessionFactory, MovieManager
+from models.movies import MovieResponseLocalized
 from settings import (
     TOP_K_HYBRID,
     TOP_K_FETCH,
@@ -20,7 +51,31 @@ from settings import (
     WEAVIATE_HOST_GRPC,
     WEAVIATE_PORT_HTTP,
     WEAVIATE_PORT_GRPC,
+    WEAVIATE_TIMEOUT_INIT,
+    WEAVIATE_TIMEOUT_QUERY,
     MODEL_EMBS,
+    EMBEDDING_CACHE_SNAPSHOT_PATH,
+    MOVIE_VECTOR_CACHE_MAX_ENTRIES,
+    VECTOR_MIRROR_CANDIDATES,
+    SIMILAR_PENALTY_WEIGHT,
+    EXCLUDE_FILTER_CHUNK,
+    EXCLUDE_FILTER_MAX_IDS,
+    TWO_PHASE_RETRIEVAL,
+    DOCUMENT_CACHE_MAX_ENTRIES,
+    DOCUMENT_CACHE_MAX_BYTES,
+    DOCUMENT_CACHE_TTL,
+    POPULAR_SNAPSHOT_FETCH_LIMIT,
+    POPULAR_SNAPSHOT_PRESET_YEARS_BACK,
+    POPULAR_SNAPSHOT_PRESET_RATINGS,
+    SUGGESTED_TITLES_CONCURRENCY,
+    MIN_GENRE_FALLBACK,
+    GENRE_FALLBACK_SPECULATIVE,
+    GENRE_FALLBACK_SPECULATE_BELOW,
+    GENRE_FALLBACK_HISTORY_MAX_ENTRIES,
+    FACET_INDEX_SLACK,
+    LOCAL_CATALOG_BROWSE,
+    RECOMMEND_RESULT_LIMIT,
+    RECOMMEND_CACHE_ENABLED,
     CLASS_NAME,
     DEFAULT_LOCALE,
     CURRENT_YEAR,
@@ -28,8 +83,21 @@ from settings import (
 
 logger = logging.getLogger(__name__)
 
-def load_vectorstore_weaviate() -> WeaviateClient:
-    weaviate_client = WeaviateClient(
+def _title_script(title: str) -> Optional[str]:
+    """'ru' для названий на кириллице, 'en' для латиницы, None если букв нет или алфавиты смешаны."""
+    cyrillic = any("а" <= ch <= "я" or ch == "ё" for ch in title.lower())
+    latin = any("a" <= ch <= "z" for ch in title.lower())
+    if cyrillic == latin:
+        return None
+    return "ru" if cyrillic else "en"
+
+def load_vectorstore_weaviate() -> WeaviateAsyncClient:
+    """
+    Создаёт асинхронный клиент Weaviate (gRPC aio), чтобы запросы не блокировали event loop.
+    Таймаут запроса задаётся на уровне клиента и действует на каждый вызов.
+    Подключение (`await client.connect()`) выполняется в main.lifespan.
+    """
+    weaviate_client = WeaviateAsyncClient(
         connection_params=ConnectionParams.from_params(
             http_host=WEAVIATE_HOST_HTTP,
             http_port=WEAVIATE_PORT_HTTP,
@@ -37,13 +105,16 @@ def load_vectorstore_weaviate() -> WeaviateClient:
             grpc_host=WEAVIATE_HOST_GRPC,
             grpc_port=WEAVIATE_PORT_GRPC,
             grpc_secure=False,
-        )
+        ),
+        additional_config=AdditionalConfig(
+            timeout=Timeout(init=WEAVIATE_TIMEOUT_INIT, query=WEAVIATE_TIMEOUT_QUERY)
+        ),
     )
     return weaviate_client
 
 class MovieWeaviateRecommender:
     def __init__(self,
-                 weaviate_client: WeaviateClient,
+                 weaviate_client: WeaviateAsyncClient,
                  kp_client: KinopoiskClient,
                  openai_client: AsyncOpenAI,
                  model_name=MODEL_EMBS,
@@ -61,7 +132,144 @@ class MovieWeaviateRecommender:
         self.top_k_similar = top_k_similar
         self.model_name = model_name
         self.collection = weaviate_client.collections.get(collection)
+        self.embedding_cache = EmbeddingCache(
+            openai_client=openai_client,
+            model_name=model_name,
+            snapshot_path=EMBEDDING_CACHE_SNAPSHOT_PATH,
+        )
+        self.atmosphere_embeddings = AtmosphereEmbeddingTable(self.embedding_cache)
+        self.vector_cache = LRUCache(name="movie_vectors", max_entries=MOVIE_VECTOR_CACHE_MAX_ENTRIES)
+        self.vector_mirror = VectorMirror()
+        self.neighbour_table = NeighbourTable()
+        self.kp_index = KpIdIndex()
+        self.title_index = TitleIndex()
+        self.facets = FacetIndex()
+        self.document_cache = LRUCache(
+            name="movie_documents",
+            max_entries=DOCUMENT_CACHE_MAX_ENTRIES,
+            ttl=DOCUMENT_CACHE_TTL,
+            max_bytes=DOCUMENT_CACHE_MAX_BYTES,
+        )
+        self.genre_fallback_history = LRUCache(
+            name="genre_fallback_history", max_entries=GENRE_FALLBACK_HISTORY_MAX_ENTRIES
+        )
+        self.genre_fallback_stats = {"predicted": 0, "speculative": 0, "cancelled": 0, "used": 0}
+        self.recommend_cache = RecommendResultCache()
+        self.inflight = SingleFlight(name="recommender")
+        self.rerank_cache = RerankCache()
+        self.rerank_load = RerankLoad()
+        self.rerank_prompts = RerankPromptBuilder()
+        self.local_reranker = LocalReranker(embed=self.embedding_cache.embed, vectors=self.get_movie_vectors)
+        self.popular_snapshot = PopularMoviesSnapshot(
+            loader=self._load_popular_movies,
+            is_preset=self._is_popular_preset,
+            serializer=lambda movie: MovieResponseLocalized.from_weaviate(movie).model_dump_json().encode(),
+        )
 
+    def get_stats(self) -> dict:
+        """Метрики in-process кэшей рекомендателя (для /health/caches)."""
+        return {
+            "embedding_cache": self.embedding_cache.stats(),
+            "vector_cache": self.vector_cache.stats(),
+            "document_cache": self.document_cache.stats(),
+            "vector_mirror": self.vector_mirror.stats(),
+            "neighbour_table": self.neighbour_table.stats(),
+            "kp_id_index": self.kp_index.stats(),
+            "title_index": self.title_index.stats(),
+            "facet_index": self.facets.stats(),
+            "popular_snapshot": self.popular_snapshot.stats(),
+            "genre_fallback": dict(self.genre_fallback_stats),
+            "recommend_cache": self.recommend_cache.stats(),
+            "singleflight": self.inflight.stats(),
+            "rerank_cache": self.rerank_cache.stats(),
+            "rerank_load": self.rerank_load.stats(),
+            "rerank_prompts": self.rerank_prompts.stats(),
+            "local_reranker": self.local_reranker.stats(),
+        }
+
+    def _catalog_indexes(self) -> List[CatalogIndex]:
+        return [self.kp_index, self.title_index, self.facets]
+
+    async def refresh_collection_version(self) -> bool:
+        """
+        Обновляет метку версии коллекции (число объектов + сборка зеркала векторов).
+        При смене версии кэши документов, векторов и результатов recommend сбрасываются. Возвращает True, если версия сменилась.
+        """
+        total = (await self.collection.aggregate.over_all(total_count=True)).total_count
+        version = f"{total}:{self.vector_mirror.build_name or '-'}"
+        changed = self.document_cache.set_version(version)
+        self.vector_cache.set_version(version)
+        self.recommend_cache.set_version(version)
+        if changed:
+            logger.info(f"[WeaviateRecommender] Версия коллекции: {version}")
+        return changed
+
+    def _cache_document(self, props: dict) -> dict:
+        """
+        Собирает документ фильма из полного набора свойств (_return_properties), кладёт его
+        в кэш документов и возвращает копию — вызывающий код может дописывать в неё поля.
+        """
+        movie_dict = self._weaviate_to_movie_dict(props)
+        if movie_dict.get("kp_id") is not None:
+            self.document_cache.set(movie_dict["kp_id"], movie_dict)
+        return dict(movie_dict)
+
+    async def load_catalog(self) -> int:
+        """Строит in-process индексы каталога одним проходом по коллекции (при старте)."""
+        return await scan_catalog(self.collection, self._catalog_indexes())
+
+    async def reload_vector_mirror(self) -> bool:
+        """
+        Подхватывает новую сборку зеркала векторов (периодическая задача, не путь запроса).
+        Загрузка идёт в потоке, зеркало подменяется целиком. Возвращает True, если сборка сменилась.
+        """
+        mirror = await asyncio.to_thread(self.vector_mirror.reloaded)
+        if mirror is None:
+            return False
+        self.vector_mirror = mirror
+        return True
+
+    async def reload_neighbour_table(self) -> bool:
+        """
+        Подхватывает новую сборку таблицы соседей (периодическая задача, не путь запроса).
+        Загрузка идёт в потоке, таблица подменяется целиком. Возвращает True, если сборка сменилась.
+        """
+        table = await asyncio.to_thread(self.neighbour_table.reloaded)
+        if table is None:
+            return False
+        self.neighbour_table = table
+        return True
+
+    def _fresh_mirror(self) -> Optional[VectorMirror]:
+        """Локальное зеркало векторов, если оно загружено и не устарело; иначе None (идём в Weaviate)."""
+        return self.vector_mirror if self.vector_mirror.is_fresh() else None
+
+    @staticmethod
+    def _exclusion_filter(exclude_kp_ids: Optional[Set[int]]) -> Optional[Filter]:
+        """
+        Фильтр Weaviate, исключающий фильмы пользователя (`kp_id contains_none`), чтобы
+        исключённые не занимали место в limit и не передавались по сети.
+
+        Список режется на части по EXCLUDE_FILTER_CHUNK, части объединяются через AND.
+        Возвращает None, если исключать нечего или исключений больше EXCLUDE_FILTER_MAX_IDS —
+        тогда вызывающий код фильтрует на своей стороне с запасом в limit.
+        """
+        if not exclude_kp_ids or len(exclude_kp_ids) > EXCLUDE_FILTER_MAX_IDS:
+            return None
+        ids = sorted(exclude_kp_ids)
+        chunks = [
+            Filter.by_property("kp_id").contains_none(ids[i:i + EXCLUDE_FILTER_CHUNK])
+            for i in range(0, len(ids), EXCLUDE_FILTER_CHUNK)
+        ]
+        return chunks[0] if len(chunks) == 1 else Filter.all_of(chunks)
+
+    @staticmethod
+    def _combine_filters(filters: Optional[Filter], extra: Optional[Filter]) -> Optional[Filter]:
+        if filters is None:
+            return extra
+        if extra is None:
+            return filters
+        return filters & extra
 
     @staticmethod
     def _skip_due_to_genre_conflict(movie_genres: List[str], selected_genres: List[str]) -> bool:
@@ -98,6 +306,14 @@ class MovieWeaviateRecommender:
             "title", "overview", "genres_tmdb", "origin_country"
         ]
 
+    @classmethod
+    def _candidate_properties(cls) -> List[str]:
+        """
+        Свойства для первой фазы двухфазного поиска: только то, что нужно для
+        исключений, проверки конфликта жанров и ранжирования кандидатов.
+        """
+        return ["kp_id", "popularity_score", "genres"]
+
     @staticmethod
     def _weaviate_to_movie_dict(props: dict) -> dict:
         """
@@ -143,18 +359,23 @@ class MovieWeaviateRecommender:
             filters: Optional[Filter] = None,
             genres: Optional[List[str]] = None,
             exclude_kp_ids: Optional[Set] = None,
+            query_vector: Optional[List[float]] = None,
+            two_phase: bool = TWO_PHASE_RETRIEVAL,
     ) -> List[dict]:
         """
         Унифицированный метод поиска фильмов в Weaviate с гибридным (векторным + keyword) или фильтрационным запросом.
 
         Алгоритм:
-        - При наличии `query` генерирует embedding через OpenAI.
+        - При наличии `query` получает embedding (из кэша эмбеддингов или через OpenAI).
         - Выполняет либо гибридный поиск (query + embedding), либо фильтрационный fetch.
         - Применяет фильтрацию по заданным параметрам:
-            - exclude_kp_ids — исключает фильмы с указанными ID.
+            - exclude_kp_ids — исключает фильмы с указанными ID (фильтром в Weaviate, см. _exclusion_filter;
+              проверка на стороне приложения остаётся страховкой для очень больших списков).
             - genres — исключает фильмы с конфликтующими жанрами ('аниме' + 'мультфильм').
         - Вычисляет `dynamic_score` для каждого фильма.
         - Возвращает отсортированный список фильмов по `dynamic_score` (по убыванию).
+        - В двухфазном режиме кандидаты запрашиваются только с `_candidate_properties()`,
+          а полные документы догружаются одним запросом лишь для `result_limit` победителей.
 
         Параметры:
             query (Optional[str]): текстовый запрос пользователя. Если не задан — используется только фильтрация.
@@ -164,63 +385,41 @@ class MovieWeaviateRecommender:
             filters: объект фильтров Weaviate (`weaviate.classes.query.Filter`) для фильтрационного запроса.
             genres (Optional[List[str]]): список выбранных жанров пользователя (для дополнительной фильтрации конфликтов).
             exclude_kp_ids (Optional[set]): множество `kp_id`, которые нужно исключить из результатов.
+            query_vector (Optional[List[float]]): готовый вектор запроса (например, собранный из таблицы
+                атмосфер). Если задан — эмбеддинг для `query` не запрашивается.
+            two_phase (bool): двухфазный режим (по умолчанию TWO_PHASE_RETRIEVAL).
 
         Возвращает:
             List[dict]: отсортированный список фильмов, соответствующих запросу и фильтрам.
         """
         try:
+            filters = self._combine_filters(filters, self._exclusion_filter(exclude_kp_ids))
+
+            return_properties = self._candidate_properties() if two_phase else self._return_properties()
+
             if query:
-                embedding_response = await self.openai_client.embeddings.create(
-                    input=query,
-                    model=self.model_name
-                )
-                embedding = embedding_response.data[0].embedding
+                embedding = query_vector or await self.embedding_cache.embed(query)
 
-                results = self.collection.query.hybrid(
+                results = await self.collection.query.hybrid(
                     vector=embedding,
                     query=query,
                     alpha=alpha,
                     limit=fetch_limit,
                     filters=filters,
-                    return_properties=self._return_properties(),
+                    return_properties=return_properties,
                 )
             else:
-                results = self.collection.query.fetch_objects(
+                results = await self.collection.query.fetch_objects(
                     filters=filters,
                     limit=fetch_limit,
-                    return_properties=self._return_properties(),
+                    return_properties=return_properties,
                 )
 
-            exclude_set = exclude_kp_ids or set()
-            movies = []
-            excluded_count = 0
-            genre_conflict_count = 0
-
-            for obj in results.objects:
-                props = obj.properties
-                kp_id = props.get("kp_id")
-                if kp_id in exclude_set:
-                    excluded_count += 1
-                    logger.debug(
-                        f"[WeaviateRecommender] _search_movies: фильм kp_id={kp_id} исключен "
-                        f"(находится в exclude_set)"
-                    )
-                    continue
-
-                movie_dict = self._weaviate_to_movie_dict(props)
-                
-                if genres:
-                    movie_genres = movie_dict.get("genres", [])
-                    if self._skip_due_to_genre_conflict(movie_genres, genres):
-                        genre_conflict_count += 1
-                        logger.debug(
-                            f"[WeaviateRecommender] _search_movies: фильм kp_id={kp_id} исключен "
-                            f"из-за конфликта жанров: {movie_genres} vs {genres}"
-                        )
-                        continue
+            batch, excluded_count = CandidateBatch.from_objects(results.objects, exclude_kp_ids)
+            genre_conflict = batch.genre_conflicts(genres) if genres else np.zeros(len(batch), dtype=bool)
+            genre_conflict_count = int(genre_conflict.sum())
+            batch = batch.take(np.flatnonzero(~genre_conflict))
 
-                movies.append(movie_dict)
-            
             if len(results.objects) == 0:
                 logger.warning(
                     f"[WeaviateRecommender] _search_movies: Weaviate вернул 0 объектов! "
@@ -231,10 +430,13 @@ class MovieWeaviateRecommender:
             logger.info(
                 f"[WeaviateRecommender] _search_movies: обработано {len(results.objects)} объектов, "
                 f"исключено по exclude_set: {excluded_count}, исключено по жанрам: {genre_conflict_count}, "
-                f"осталось: {len(movies)}, вернется: {min(len(movies), result_limit)}"
+                f"осталось: {len(batch)}, вернется: {min(len(batch), result_limit)}"
+            )
+
+            top = top_k(batch.popularity, result_limit, descending=True)
+            return await self._materialize(
+                batch.take(top).kp_id_list(), objects=None if two_phase else results.objects
             )
-            
-            return sorted(movies, key=lambda x: x.get("popularity_score") or 0.0, reverse=True)[:result_limit]
 
         except Exception as e:
             logger.warning(f"[MovieRAG] Ошибка в _search_movies: {e}")
@@ -265,6 +467,7 @@ class MovieWeaviateRecommender:
         directors: Optional[List[str]] = None,
         suggested_titles: Optional[List[str]] = None,
         movie_name: Optional[str] = None,
+        query_vector: Optional[List[float]] = None,
     ) -> List[dict]:
         """
         Рекомендует фильмы на основе гибридного (векторного + keyword) или обычного фильтрационного поиска,
@@ -276,7 +479,95 @@ class MovieWeaviateRecommender:
         - Усредняет их векторы
         - Находит ближайшие фильмы к среднему вектору
         - Добавляет их в результаты
+
+        query_vector — готовый вектор для `query` (swipe-режим собирает его из таблицы атмосфер),
+        тогда эмбеддинг запроса не считается.
+
+        Результат без исключений пользователя (с запасом recommend_cache.headroom) кэшируется по
+        нормализованным критериям (recommend_cache), исключения вычитаются после чтения из кэша.
+        Поиск по movie_name идёт мимо общего кэша: у recommend_similar своя таблица соседей.
         """
+        spec = FilterSpec.create(
+            start_year=start_year,
+            end_year=end_year,
+            rating_kp=rating_kp,
+            rating_imdb=rating_imdb,
+            genres=genres,
+            locale=locale,
+            cast=cast,
+            directors=directors,
+        )
+        key = recommend_cache_key(spec, query, movie_name, suggested_titles, query_vector)
+        personal_search = lambda: self.inflight.run(
+            ("recommend", key, frozenset(exclude_kp_ids or ())),
+            lambda: self._recommend(
+                query, genres, start_year, end_year, rating_kp, rating_imdb, exclude_kp_ids,
+                locale, cast, directors, suggested_titles, movie_name, query_vector,
+            ),
+        )
+        if not RECOMMEND_CACHE_ENABLED or movie_name:
+            return await personal_search()
+
+        cached = self.recommend_cache.get(key)
+        if cached is not None:
+            personal = self.recommend_cache.personalize(cached, exclude_kp_ids)
+            if personal is not None:
+                logger.info(
+                    f"[WeaviateRecommender] recommend из кэша результатов: {len(personal.kp_ids)} фильмов "
+                    f"(из {len(cached.kp_ids)} до исключений)"
+                )
+                return await self._materialize(personal.kp_ids.tolist(), **personal.columns)
+            return await personal_search()
+
+        async def shared_search() -> List[dict]:
+            movies = await self._recommend(
+                query, genres, start_year, end_year, rating_kp, rating_imdb, None,
+                locale, cast, directors, suggested_titles, movie_name, query_vector,
+                self.recommend_cache.fetch_limit,
+            )
+            self.recommend_cache.store(key, movies)
+            return movies
+
+        # Исключений больше запаса — общий список может не заполнить выдачу, персональный поиск
+        # идёт параллельно и отменяется, если он не понадобился
+        personal_task = None
+        if len(exclude_kp_ids or ()) > self.recommend_cache.headroom:
+            personal_task = asyncio.create_task(personal_search())
+
+        try:
+            # Одновременные промахи по одним критериям (с любыми исключениями) ждут один поиск
+            movies = await self.inflight.run(("recommend", key), shared_search)
+        except BaseException:
+            if personal_task is not None:
+                personal_task.cancel()
+            raise
+
+        personal = self.recommend_cache.personalize(CachedResult.from_movies(movies), exclude_kp_ids)
+        if personal is not None:
+            if personal_task is not None:
+                personal_task.cancel()
+            keep = set(personal.kp_ids.tolist())
+            return [movie for movie in movies if movie.get("kp_id") in keep]
+        return await (personal_task if personal_task is not None else personal_search())
+
+    async def _recommend(
+        self,
+        query: str = None,
+        genres: List[str] = None,
+        start_year: int = 1900,
+        end_year: int = CURRENT_YEAR,
+        rating_kp: float = 0.0,
+        rating_imdb: float = 0.0,
+        exclude_kp_ids: Optional[Set[int]] = None,
+        locale: str = DEFAULT_LOCALE,
+        cast: Optional[List[str]] = None,
+        directors: Optional[List[str]] = None,
+        suggested_titles: Optional[List[str]] = None,
+        movie_name: Optional[str] = None,
+        query_vector: Optional[List[float]] = None,
+        result_limit: int = RECOMMEND_RESULT_LIMIT,
+    ) -> List[dict]:
+        """Рекомендации без общего кэша результатов (см. recommend), не больше result_limit фильмов."""
         exclude_set = exclude_kp_ids or set()
         logger.info(
             f"[WeaviateRecommender] recommend вызван: query='{query}', movie_name='{movie_name}', "
@@ -341,6 +632,7 @@ class MovieWeaviateRecommender:
                         similar_movies = await self.recommend_similar(
                             source_kp_id=source_kp_id,
                             exclude_kp_ids=exclude_set,
+                            source_movie=source_movie,
                         )
 
                         logger.info(
@@ -372,46 +664,25 @@ class MovieWeaviateRecommender:
             
             return movies_by_title
         
-        filters = Filter.by_property("year").greater_or_equal(start_year) & \
-                  Filter.by_property("year").less_or_equal(end_year) & \
-                  Filter.by_property("rating_kp").greater_than(rating_kp) & \
-                  Filter.by_property("rating_imdb").greater_than(rating_imdb)
-
-        if genres is not None and len(genres) > 0:
-            logger.info(
-                f"[WeaviateRecommender] Получены genres: {genres}, type: {type(genres)}, "
-                f"locale={locale}"
-            )
-            if locale == "en":
-                genre_prop = "genres_tmdb"
-            else:
-                genre_prop = "genres"
-
-            if len(genres) > 1:
-                # Несколько жанров — фильм должен содержать ВСЕ (AND)
-                genre_filter = Filter.by_property(genre_prop).contains_all(genres)
-                filter_desc = f"{genre_prop}.contains_all({genres})"
-            else:
-                genre_filter = Filter.by_property(genre_prop).contains_any(genres)
-                filter_desc = f"{genre_prop}.contains_any({genres})"
-
+        spec = FilterSpec.create(
+            start_year=start_year,
+            end_year=end_year,
+            rating_kp=rating_kp,
+            rating_imdb=rating_imdb,
+            genres=genres,
+            locale=locale,
+            cast=cast,
+            directors=directors,
+        )
+        if spec.genres:
             logger.info(
                 f"[WeaviateRecommender] Применяем фильтр по жанрам для locale={locale}: "
-                f"genres={genres}, фильтр: {filter_desc}"
+                f"genres={genres}, фильтр: {spec.genre_prop}."
+                f"{'contains_all' if len(spec.genres) > 1 else 'contains_any'}({genres})"
             )
-            filters = filters & genre_filter
         else:
             logger.debug(f"[WeaviateRecommender] Жанры не указаны, фильтр по жанрам не применяется")
-
-        # Фильтр по актерам (cast хранится на английском языке)
-        if cast is not None and len(cast) > 0:
-            cast_filter = Filter.by_property("cast").contains_any(cast)
-            filters = filters & cast_filter
-
-        # Фильтр по режиссерам (directors хранится на английском языке)
-        if directors is not None and len(directors) > 0:
-            directors_filter = Filter.by_property("directors").contains_any(directors)
-            filters = filters & directors_filter
+        filters = spec.to_filter()
 
         logger.debug(
             f"[WeaviateRecommender] Итоговые фильтры: year>{start_year} & year<{end_year} & "
@@ -421,6 +692,58 @@ class MovieWeaviateRecommender:
             + (f" & directors filter" if directors else "")
         )
 
+        candidates = lambda: self._recommend_candidates(
+            query=query,
+            spec=spec,
+            filters=filters,
+            genres=genres,
+            locale=locale,
+            exclude_kp_ids=exclude_kp_ids,
+            suggested_titles=suggested_titles,
+            query_vector=query_vector,
+            result_limit=result_limit,
+        )
+
+        if len(spec.genres) > 1:
+            # Fallback: если с contains_all мало результатов — повторяем с первым (главным) жанром
+            fallback_spec = spec.with_genres(spec.genres[:1])
+            fallback = lambda: self._main_search(
+                fallback_spec, fallback_spec.to_filter(), query, genres, exclude_kp_ids, query_vector, result_limit
+            )
+            # С suggested_titles в результат попадают и сами найденные фильмы, их фасеты не учитывают
+            prediction = None if suggested_titles else self._predict_genre_fallback(spec, len(exclude_set))
+            results = await self._with_genre_fallback(candidates, fallback, genres, locale, prediction)
+        else:
+            results = await candidates()
+
+        result_kp_ids = [m.get("kp_id") for m in results]
+        excluded_in_results = [kp_id for kp_id in result_kp_ids if kp_id in exclude_set]
+        if excluded_in_results:
+            logger.warning(
+                f"[WeaviateRecommender] ВНИМАНИЕ: В результатах recommend найдены исключенные фильмы! "
+                f"exclude_set содержит {len(exclude_set)} фильмов, но в результатах присутствуют: {excluded_in_results}"
+            )
+        else:
+            logger.info(
+                f"[WeaviateRecommender] recommend вернул {len(results)} фильмов, "
+                f"все исключены корректно. KP IDs результатов: {result_kp_ids[:20]}{'...' if len(result_kp_ids) > 20 else ''}"
+            )
+        
+        return results
+
+    async def _recommend_candidates(
+        self,
+        query: Optional[str],
+        spec: FilterSpec,
+        filters: Filter,
+        genres: Optional[List[str]],
+        locale: str,
+        exclude_kp_ids: Optional[Set[int]],
+        suggested_titles: Optional[List[str]],
+        query_vector: Optional[List[float]],
+        result_limit: int = RECOMMEND_RESULT_LIMIT,
+    ) -> List[dict]:
+        """Основной поиск recommend: по suggested_titles (если есть) или семантический по query."""
         # Если есть suggested_titles, используем ТОЛЬКО их для поиска, основной запрос не используем
         if suggested_titles and len(suggested_titles) > 0:
             logger.info(
@@ -436,42 +759,11 @@ class MovieWeaviateRecommender:
                     f"contains_any({genres}), locale={locale}"
                 )
 
-            found_movies = []
-            found_kp_ids = set()
-
-            for title in suggested_titles:
-                movies = await self.find_movies_by_title(
-                    title,
-                    locale=locale,
-                    min_score=5.5,
-                    filters=genre_filter_for_titles,
-                )
+            found_movies = await self._resolve_suggested_titles(
+                suggested_titles, locale=locale, filters=genre_filter_for_titles
+            )
+            found_kp_ids = {movie.get("kp_id") for movie in found_movies}
 
-                # Если не нашли в указанной локали, пробуем альтернативную
-                if not movies or len(movies) == 0:
-                    alternative_locale = "ru" if locale == "en" else "en"
-                    logger.debug(
-                        f"[WeaviateRecommender] Не найдено для '{title}' в locale={locale}, "
-                        f"пробуем locale={alternative_locale}"
-                    )
-                    movies = await self.find_movies_by_title(
-                        title,
-                        locale=alternative_locale,
-                        min_score=5.5,
-                        filters=genre_filter_for_titles,
-                    )
-                
-                if movies and len(movies) > 0:
-                    movie = movies[0]
-                    kp_id = movie.get("kp_id")
-                    if kp_id and kp_id not in found_kp_ids:
-                        found_movies.append(movie)
-                        found_kp_ids.add(kp_id)
-                        logger.debug(
-                            f"[WeaviateRecommender] Добавлен фильм для '{title}': "
-                            f"kp_id={kp_id}, name={movie.get('name', movie.get('title', 'N/A'))}"
-                        )
-            
             logger.info(
                 f"[WeaviateRecommender] Найдено {len(found_movies)} уникальных фильмов "
                 f"по suggested_titles (contains_any): {list(found_kp_ids)[:10]}{'...' if len(found_kp_ids) > 10 else ''}"
@@ -489,8 +781,12 @@ class MovieWeaviateRecommender:
                     avg_vector = self.average_vectors(vectors)
                     
                     if avg_vector:
-                        # Динамический limit: чем больше exclude_set, тем шире ищем (кап 300)
-                        vector_limit = min(100 + len(exclude_kp_ids or set()), 300)
+                        # Исключения применяются фильтром, limit не зависит от истории пользователя.
+                        # Для огромных exclude_set (без фильтра) — расширяем поиск (кап 300)
+                        if len(exclude_kp_ids or ()) <= EXCLUDE_FILTER_MAX_IDS:
+                            vector_limit = 2 * result_limit
+                        else:
+                            vector_limit = min(2 * result_limit + len(exclude_kp_ids), 300)
 
                         # Находим ближайшие фильмы к среднему вектору
                         similar_movies = await self.find_similar_by_vector(
@@ -529,10 +825,11 @@ class MovieWeaviateRecommender:
                                 query=query,
                                 alpha=0.95,
                                 fetch_limit=self.top_k_hybrid,
-                                result_limit=50,
+                                result_limit=result_limit,
                                 filters=filters,
                                 genres=genres,
-                                exclude_kp_ids=exclude_kp_ids
+                                exclude_kp_ids=exclude_kp_ids,
+                                query_vector=query_vector,
                             )
                             for movie in hybrid_results:
                                 kp_id = movie.get("kp_id")
@@ -541,38 +838,17 @@ class MovieWeaviateRecommender:
                                     result_kp_ids_set.add(kp_id)
 
                         distance_weight = 0.7  # 70% релевантность, 30% популярность
-                        
-                        for movie in results:
-                            distance = movie.get("distance")
-                            popularity = movie.get("popularity_score", 0.0)
-                            
-                            if distance is not None:
-                                max_distance = 2.0
-                                normalized_distance = min(distance / max_distance, 1.0)
-                                relevance_score = 1.0 - normalized_distance  # Инвертируем: меньше distance = больше score
-                                
-                                # Нормализуем popularity_score (0-10) до 0-1
-                                normalized_popularity = min(popularity / 10.0, 1.0)
-                                
-                                # Комбинированный score: чем больше, тем лучше
-                                combined_score = (distance_weight * relevance_score) + ((1 - distance_weight) * normalized_popularity)
-                                movie["combined_score"] = combined_score
-                            else:
-                                # Для фильмов из found_movies без distance используем только popularity
-                                normalized_popularity = min(popularity / 10.0, 1.0)
-                                movie["combined_score"] = normalized_popularity
-                        
-                        # Для фильмов из found_movies ставим их в начало (они уже релевантны)
-                        results = sorted(
-                            results,
-                            key=lambda x: (
-                                0 if x.get("kp_id") in found_kp_ids else 1,  # Сначала найденные из suggested_titles
-                                -x.get("combined_score", 0.0)  # Затем по combined_score (убывание)
-                            )
+                        combined = combined_scores(
+                            column(results, "distance", default=np.nan),
+                            column(results, "popularity_score"),
+                            distance_weight,
                         )
-                        
-                        # Берем топ 50
-                        results = results[:50]
+                        # Фильмы из found_movies ставим в начало (они уже релевантны), затем по combined_score
+                        found_mask = np.fromiter((m.get("kp_id") in found_kp_ids for m in results), dtype=bool)
+                        top = rank(combined, result_limit, descending=True, priority=found_mask)
+                        results = [results[i] for i in top]
+                        for movie, score in zip(results, combined[top]):
+                            movie["combined_score"] = float(score)
                         
                         logger.info(
                             f"[WeaviateRecommender] Использованы ТОЛЬКО результаты из suggested_titles: "
@@ -585,105 +861,164 @@ class MovieWeaviateRecommender:
                             f"переходим к основному поиску по query"
                         )
                         # Если не удалось усреднить векторы, используем основной поиск
-                        results = await self._search_movies(
-                            query=query,
-                            alpha=0.95,
-                            fetch_limit=self.top_k_hybrid if query else self.top_k_fetch,
-                            result_limit=50,
-                            filters=filters,
-                            genres=genres,
-                            exclude_kp_ids=exclude_kp_ids
-                        )
+                        results = await self._main_search(spec, filters, query, genres, exclude_kp_ids, query_vector, result_limit)
                 else:
                     logger.warning(
                         f"[WeaviateRecommender] Не удалось получить векторы из Weaviate для найденных фильмов, "
                         f"переходим к основному поиску по query"
                     )
                     # Если не удалось получить векторы, используем основной поиск
-                    results = await self._search_movies(
-                        query=query,
-                        alpha=0.95,
-                        fetch_limit=self.top_k_hybrid if query else self.top_k_fetch,
-                        result_limit=50,
-                        filters=filters,
-                        genres=genres,
-                        exclude_kp_ids=exclude_kp_ids
-                    )
+                    results = await self._main_search(spec, filters, query, genres, exclude_kp_ids, query_vector, result_limit)
             else:
                 logger.warning(
                     f"[WeaviateRecommender] Не найдено фильмов по suggested_titles: {suggested_titles}, "
                     f"переходим к основному поиску по query"
                 )
                 # Если не найдено фильмов из suggested_titles, используем основной поиск
-                results = await self._search_movies(
-                    query=query,
-                    alpha=0.95,
-                    fetch_limit=self.top_k_hybrid if query else self.top_k_fetch,
-                    result_limit=50,
-                    filters=filters,
-                    genres=genres,
-                    exclude_kp_ids=exclude_kp_ids
-                )
+                results = await self._main_search(spec, filters, query, genres, exclude_kp_ids, query_vector, result_limit)
         else:
             # Если нет suggested_titles, используем основной семантический поиск
-            results = await self._search_movies(
-                query=query,
-                alpha=0.95,
-                fetch_limit=self.top_k_hybrid if query else self.top_k_fetch,
-                result_limit=50,
-                filters=filters,
-                genres=genres,
-                exclude_kp_ids=exclude_kp_ids
-            )
-        
-        # Fallback: если с contains_all мало результатов — повторяем с первым (главным) жанром
-        MIN_GENRE_FALLBACK = 10
-        if len(results) < MIN_GENRE_FALLBACK and genres and len(genres) > 1:
-            primary_genre = genres[0]
-            logger.info(
-                f"[WeaviateRecommender] Fallback: {len(results)} результатов с contains_all({genres}), "
-                f"повтор с основным жанром: {primary_genre}"
-            )
-            genre_prop = "genres_tmdb" if locale == "en" else "genres"
-            fallback_filters = (
-                Filter.by_property("year").greater_or_equal(start_year) &
-                Filter.by_property("year").less_or_equal(end_year) &
-                Filter.by_property("rating_kp").greater_than(rating_kp) &
-                Filter.by_property("rating_imdb").greater_than(rating_imdb) &
-                Filter.by_property(genre_prop).contains_any([primary_genre])
-            )
-            if cast and len(cast) > 0:
-                fallback_filters = fallback_filters & Filter.by_property("cast").contains_any(cast)
-            if directors and len(directors) > 0:
-                fallback_filters = fallback_filters & Filter.by_property("directors").contains_any(directors)
-
-            results = await self._search_movies(
-                query=query,
-                alpha=0.95,
-                fetch_limit=self.top_k_hybrid if query else self.top_k_fetch,
-                result_limit=50,
-                filters=fallback_filters,
-                genres=genres,
-                exclude_kp_ids=exclude_kp_ids
-            )
+            results = await self._main_search(spec, filters, query, genres, exclude_kp_ids, query_vector, result_limit)
+
+        return results
+
+    def _predict_genre_fallback(self, spec: FilterSpec, exclude_count: int = 0) -> Optional[bool]:
+        """
+        Прогноз по FacetIndex для contains_all: True — заведомо меньше MIN_GENRE_FALLBACK фильмов
+        (даже с FACET_INDEX_SLACK на фильмы, добавленные после скана каталога), False — заведомо
+        хватит (точный счёт с запасом на исключения), None — неизвестно.
+        """
+        estimate = self.facets.count(spec)
+        if estimate is None:
+            return None
+        count, exact = estimate
+        if count + FACET_INDEX_SLACK < MIN_GENRE_FALLBACK:
+            return True
+        if exact and count - exclude_count >= GENRE_FALLBACK_SPECULATE_BELOW:
+            return False
+        return None
+
+    def _genre_fallback_likely(self, genres: List[str], locale: str) -> bool:
+        """
+        Стоит ли запускать fallback по главному жанру заранее, когда фасеты не дают ответа:
+        комбинация жанров ещё не встречалась или в прошлый раз contains_all дал меньше
+        GENRE_FALLBACK_SPECULATE_BELOW фильмов.
+        """
+        last_count = self.genre_fallback_history.get((locale, tuple(sorted(genres))))
+        return last_count is None or last_count < GENRE_FALLBACK_SPECULATE_BELOW
+
+    async def _with_genre_fallback(
+        self,
+        primary: Callable[[], Awaitable[List[dict]]],
+        fallback: Callable[[], Awaitable[List[dict]]],
+        genres: List[str],
+        locale: str,
+        prediction: Optional[bool] = None,
+    ) -> List[dict]:
+        """
+        Возвращает результат primary (поиск с contains_all по всем жанрам), а если в нём меньше
+        MIN_GENRE_FALLBACK фильмов — результат fallback (поиск по главному жанру).
+
+        prediction (см. _predict_genre_fallback): True — primary не запускается вовсе,
+        False — только primary. Иначе, если fallback вероятен (_genre_fallback_likely), оба запроса
+        идут параллельно и лишний отменяется: узкий мультижанровый запрос стоит один round trip.
+        """
+        if prediction is True:
             logger.info(
-                f"[WeaviateRecommender] Fallback с жанром '{primary_genre}' вернул {len(results)} результатов"
+                f"[WeaviateRecommender] По фасетам contains_all({genres}) даст < {MIN_GENRE_FALLBACK} "
+                f"фильмов — сразу ищем по основному жанру: {genres[0]}"
             )
+            self.genre_fallback_stats["predicted"] += 1
+            return await fallback()
 
-        result_kp_ids = [m.get("kp_id") for m in results]
-        excluded_in_results = [kp_id for kp_id in result_kp_ids if kp_id in exclude_set]
-        if excluded_in_results:
-            logger.warning(
-                f"[WeaviateRecommender] ВНИМАНИЕ: В результатах recommend найдены исключенные фильмы! "
-                f"exclude_set содержит {len(exclude_set)} фильмов, но в результатах присутствуют: {excluded_in_results}"
-            )
-        else:
+        history_key = (locale, tuple(sorted(genres)))
+        fallback_task = None
+        if GENRE_FALLBACK_SPECULATIVE and prediction is None and self._genre_fallback_likely(genres, locale):
+            fallback_task = asyncio.create_task(fallback())
+            self.genre_fallback_stats["speculative"] += 1
+
+        try:
+            results = await primary()
+        except BaseException:
+            if fallback_task is not None:
+                fallback_task.cancel()
+            raise
+
+        self.genre_fallback_history.set(history_key, len(results))
+        if len(results) >= MIN_GENRE_FALLBACK:
+            if fallback_task is not None:
+                fallback_task.cancel()
+                self.genre_fallback_stats["cancelled"] += 1
+            return results
+
+        logger.info(
+            f"[WeaviateRecommender] Fallback: {len(results)} результатов с contains_all({genres}), "
+            f"повтор с основным жанром: {genres[0]}"
+            + (" (уже запущен параллельно)" if fallback_task is not None else "")
+        )
+        self.genre_fallback_stats["used"] += 1
+        results = await (fallback_task if fallback_task is not None else fallback())
+        logger.info(
+            f"[WeaviateRecommender] Fallback с жанром '{genres[0]}' вернул {len(results)} результатов"
+        )
+        return results
+
+    def _plan_search(self, spec: FilterSpec, query: Optional[str]) -> Tuple[Optional[str], int]:
+        """
+        (query, fetch_limit) для основного поиска recommend по оценке FacetIndex.
+
+        - fetch_limit не больше числа фильмов под фильтром (+FACET_INDEX_SLACK на фильмы,
+          добавленные после скана каталога).
+        - Если под фильтр попадает не больше fetch_limit фильмов, гибридный поиск вернёт их все,
+          а _search_movies всё равно ранжирует по popularity_score — тогда хватает fetch_objects
+          без эмбеддинга запроса.
+        """
+        fetch_limit = self.top_k_hybrid if query else self.top_k_fetch
+        estimate = self.facets.count(spec)
+        if estimate is None:
+            return query, fetch_limit
+        needed = estimate[0] + FACET_INDEX_SLACK
+        if query and needed <= fetch_limit:
             logger.info(
-                f"[WeaviateRecommender] recommend вернул {len(results)} фильмов, "
-                f"все исключены корректно. KP IDs результатов: {result_kp_ids[:20]}{'...' if len(result_kp_ids) > 20 else ''}"
+                f"[WeaviateRecommender] Под фильтр попадает ~{estimate[0]} фильмов (<= {fetch_limit}), "
+                f"вместо гибридного поиска — fetch_objects"
             )
-        
-        return results
+            query = None
+        return query, min(fetch_limit, needed)
+
+    async def _main_search(
+        self,
+        spec: FilterSpec,
+        filters: Filter,
+        query: Optional[str],
+        genres: Optional[List[str]],
+        exclude_kp_ids: Optional[Set[int]],
+        query_vector: Optional[List[float]],
+        result_limit: int = RECOMMEND_RESULT_LIMIT,
+    ) -> List[dict]:
+        """
+        Основной _search_movies recommend с fetch_limit и типом запроса из _plan_search.
+
+        Запрос без текста (фильтры movie_generator или fetch_objects по плану) при построенном
+        каталоге отбирается локально FacetIndex.select и догружается из кэша документов —
+        без выборки до TOP_K_FETCH объектов из Weaviate.
+        """
+        planned_query, fetch_limit = self._plan_search(spec, query)
+        if planned_query is None and LOCAL_CATALOG_BROWSE:
+            kp_ids = self.facets.select(spec, limit=result_limit, exclude_kp_ids=exclude_kp_ids, selected_genres=genres)
+            if kp_ids is not None:
+                logger.info(f"[WeaviateRecommender] Отбор по фильтрам из локального каталога: {len(kp_ids)} фильмов")
+                return await self._materialize(kp_ids)
+        return await self._search_movies(
+            query=planned_query,
+            alpha=0.95,
+            fetch_limit=fetch_limit,
+            result_limit=result_limit,
+            filters=filters,
+            genres=genres,
+            exclude_kp_ids=exclude_kp_ids,
+            query_vector=query_vector if planned_query else None,
+        )
 
     async def get_movie_by_kp_id(self, kp_id: int) -> Optional[dict]:
         """
@@ -696,7 +1031,21 @@ class MovieWeaviateRecommender:
             dict: данные фильма в формате из _weaviate_to_movie_dict или None если не найден
         """
         try:
-            result = self.collection.query.fetch_objects(
+            cached = self.document_cache.get(kp_id)
+            if cached is not None:
+                return dict(cached)
+
+            uuid = self.kp_index.get_uuid(kp_id)
+            if uuid is not None:
+                obj = await self.collection.query.fetch_object_by_id(
+                    uuid,
+                    return_properties=self._return_properties()
+                )
+                if obj is not None and obj.properties.get("kp_id") == kp_id:
+                    return self._cache_document(obj.properties)
+                self.kp_index.discard(kp_id)
+
+            result = await self.collection.query.fetch_objects(
                 filters=Filter.by_property("kp_id").equal(kp_id),
                 limit=1,
                 return_properties=self._return_properties()
@@ -706,12 +1055,82 @@ class MovieWeaviateRecommender:
                 logger.warning(f"[get_movie_by_kp_id] Фильм kp_id={kp_id} не найден в Weaviate")
                 return None
             
-            props = result.objects[0].properties
-            return self._weaviate_to_movie_dict(props)
+            obj = result.objects[0]
+            self.kp_index.remember(kp_id, obj.uuid, obj.properties.get("genres"))
+            return self._cache_document(obj.properties)
         except Exception as e:
             logger.warning(f"[get_movie_by_kp_id] Ошибка при получении фильма kp_id={kp_id}: {e}")
             return None
 
+    async def _load_popular_movies(
+        self,
+        locale: str,
+        min_year: int,
+        min_rating_kp: float,
+        fetch_limit: int = POPULAR_SNAPSHOT_FETCH_LIMIT,
+    ) -> List[dict]:
+        """
+        Собирает список популярных фильмов для снапшота (без учёта пользователя) из fetch_limit кандидатов:
+        недавно вышедшие с высоким рейтингом и постером (для 'en' — ещё и с tmdb_id).
+        Сортировка: сначала по popularity_score, затем по году, затем по рейтингу КП.
+        """
+        current_year = datetime.now().year
+        filters = Filter.by_property("year").greater_or_equal(min_year) & \
+                  Filter.by_property("year").less_or_equal(current_year) & \
+                  Filter.by_property("rating_kp").greater_or_equal(min_rating_kp)
+
+        results = await self.collection.query.fetch_objects(
+            filters=filters,
+            limit=fetch_limit,
+            return_properties=self._return_properties()
+        )
+
+        movies = []
+        for obj in results.objects:
+            props = obj.properties
+
+            # Фильтруем фильмы без постера
+            if not props.get("kp_file_path"):
+                continue
+
+            # Для английской локализации требуем наличие tmdb_id
+            if locale == "en" and not props.get("tmdb_id"):
+                continue
+
+            movies.append(self._cache_document(props))
+
+        movies.sort(
+            key=lambda x: (
+                x.get("popularity_score") or 0.0,
+                x.get("year") or 0,
+                x.get("rating_kp") or 0.0
+            ),
+            reverse=True
+        )
+
+        logger.debug(
+            f"[WeaviateRecommender] Снапшот популярных: {len(movies)} фильмов "
+            f"(locale={locale}, min_year={min_year}, min_rating_kp={min_rating_kp}, "
+            f"запрошено: {fetch_limit}, получено: {len(results.objects)})"
+        )
+        return movies
+
+    @staticmethod
+    def _is_popular_preset(key: Tuple[str, int, float]) -> bool:
+        """Снапшот держится только для стандартных параметров роута, а не для любых из запроса."""
+        locale, min_year, min_rating_kp = key
+        current_year = datetime.now().year
+        return locale in ("ru", "en") \
+            and min_year in {current_year - years for years in POPULAR_SNAPSHOT_PRESET_YEARS_BACK} \
+            and min_rating_kp in POPULAR_SNAPSHOT_PRESET_RATINGS
+
+    async def _popular_entry(
+        self, min_year: Optional[int], min_rating_kp: float, locale: str, limit: int
+    ) -> PopularEntry:
+        if min_year is None:
+            min_year = datetime.now().year - 1
+        return await self.popular_snapshot.get((locale, min_year, float(min_rating_kp)), limit)
+
     async def get_popular_movies(
         self,
         limit: int = 100,
@@ -721,8 +1140,9 @@ class MovieWeaviateRecommender:
         locale: str = DEFAULT_LOCALE
     ) -> List[dict]:
         """
-        Получает популярные фильмы из Weaviate: недавно вышедшие с высоким рейтингом.
-        Сортировка: сначала по popularity_score, затем по году, затем по рейтингу КП.
+        Получает популярные фильмы: недавно вышедшие с высоким рейтингом.
+        Список берётся из снапшота (см. PopularMoviesSnapshot), на запрос применяются только
+        исключения пользователя и limit.
         Возвращает топ фильмы - клиент сам выбирает что показывать.
         
         Args:
@@ -735,75 +1155,86 @@ class MovieWeaviateRecommender:
         Returns:
             List[dict]: список фильмов в формате из _weaviate_to_movie_dict, отсортированных по popularity_score
         """
-        current_year = datetime.now().year
-        
-        if min_year is None:
-            min_year = current_year - 1
-        
-        filters = Filter.by_property("year").greater_or_equal(min_year) & \
-                  Filter.by_property("year").less_or_equal(current_year) & \
-                  Filter.by_property("rating_kp").greater_or_equal(min_rating_kp)
-        
-        exclude_set = exclude_kp_ids or set()
-        
         try:
-            fetch_limit = max(limit * 10, 1000)
-            
-            results = self.collection.query.fetch_objects(
-                filters=filters,
-                limit=fetch_limit,
-                return_properties=self._return_properties()
-            )
-            
-            movies = []
-            excluded_count = 0
-            
-            for obj in results.objects:
-                props = obj.properties
-                kp_id = props.get("kp_id")
-                
-                if kp_id in exclude_set:
-                    excluded_count += 1
-                    continue
-                
-                # Фильтруем фильмы без постера
-                kp_file_path = props.get("kp_file_path")
-                if not kp_file_path or kp_file_path == "":
-                    continue
-                
-                # Для английской локализации требуем наличие tmdb_id
-                if locale == "en":
-                    tmdb_id = props.get("tmdb_id")
-                    if not tmdb_id:
-                        continue
-                
-                movie_dict = self._weaviate_to_movie_dict(props)
-                movies.append(movie_dict)
-            
-            movies.sort(
-                key=lambda x: (
-                    x.get("popularity_score") or 0.0,
-                    x.get("year") or 0,
-                    x.get("rating_kp") or 0.0
-                ),
-                reverse=True
-            )
-            
-            movies = movies[:limit]
-            
-            logger.debug(
-                f"[WeaviateRecommender] get_popular_movies: найдено {len(movies)} фильмов "
-                f"(locale={locale}, min_year={min_year}, min_rating_kp={min_rating_kp}, limit={limit}, "
-                f"исключено: {excluded_count}, запрошено: {fetch_limit}, "
-                f"требование tmdb_id: {'да' if locale == 'en' else 'нет'}, "
-                f"сортировка: popularity_score -> year -> rating_kp)"
-            )
-            
-            return movies
-            
+            entry = await self._popular_entry(min_year, min_rating_kp, locale, limit)
         except Exception as e:
             logger.warning(f"[WeaviateRecommender] Ошибка при получении популярных фильмов: {e}")
             return []
+        return [dict(entry.movies[i]) for i in entry.select(limit, exclude_kp_ids)]
+
+    async def get_popular_payload(
+        self,
+        limit: int = 100,
+        min_year: Optional[int] = None,
+        min_rating_kp: float = 7.0,
+        exclude_kp_ids: Optional[Set[int]] = None,
+        locale: str = DEFAULT_LOCALE
+    ) -> bytes:
+        """
+        То же, что get_popular_movies, но сразу JSON-массив MovieResponseLocalized
+        из заранее сериализованных фильмов снапшота.
+        """
+        try:
+            entry = await self._popular_entry(min_year, min_rating_kp, locale, limit)
+        except Exception as e:
+            logger.warning(f"[WeaviateRecommender] Ошибка при получении популярных фильмов: {e}")
+            return b"[]"
+        return b"[" + b",".join(entry.payload(i) for i in entry.select(limit, exclude_kp_ids)) + b"]"
+
+    async def _resolve_suggested_titles(
+        self,
+        titles: List[str],
+        locale: str,
+        filters: Optional[Filter] = None,
+    ) -> List[dict]:
+        """
+        Находит по одному фильму на каждое название из suggested_titles.
+        Названия ищутся конкурентно (не больше SUGGESTED_TITLES_CONCURRENCY запросов BM25 разом),
+        результат — в порядке titles без повторов kp_id.
+        """
+        semaphore = asyncio.Semaphore(SUGGESTED_TITLES_CONCURRENCY)
+        alternative_locale = "ru" if locale == "en" else "en"
+
+        async def lookup(title: str, title_locale: str) -> List[dict]:
+            async with semaphore:
+                return await self.find_movies_by_title(
+                    title, locale=title_locale, min_score=5.5, filters=filters
+                )
+
+        async def resolve(title: str) -> Optional[dict]:
+            # Название в "чужом" алфавите почти наверняка промахнётся в основной локали —
+            # тогда альтернативную запускаем сразу, не дожидаясь промаха
+            race = _title_script(title) not in (None, locale)
+            alternative = asyncio.create_task(lookup(title, alternative_locale)) if race else None
+            try:
+                movies = await lookup(title, locale)
+                if not movies:
+                    # Если не нашли в указанной локали, пробуем альтернативную
+                    logger.debug(
+                        f"[WeaviateRecommender] Не найдено для '{title}' в locale={locale}, "
+                        f"пробуем locale={alternative_locale}"
+                    )
+                    movies = await (alternative or lookup(title, alternative_locale))
+                    alternative = None
+            finally:
+                if alternative is not None:
+                    alternative.cancel()
+            return movies[0] if movies else None
+
+        resolved = await asyncio.gather(*(resolve(title) for title in titles))
+
+        found_movies = []
+        found_kp_ids = set()
+        for title, movie in zip(titles, resolved):
+            kp_id = movie.get("kp_id") if movie else None
+            if kp_id and kp_id not in found_kp_ids:
+                found_movies.append(movie)
+                found_kp_ids.add(kp_id)
+                logger.debug(
+                    f"[WeaviateRecommender] Добавлен фильм для '{title}': "
+                    f"kp_id={kp_id}, name={movie.get('name', movie.get('title', 'N/A'))}"
+                )
+        return found_movies
 
     async def find_movies_by_title(
         self,
@@ -813,8 +1244,9 @@ class MovieWeaviateRecommender:
         filters: Optional[Filter] = None
     ) -> List[dict]:
         """
-        Ищет фильмы по названию используя BM25 поиск (без нормализации).
-        Полагается на BM25 score для определения релевантности.
+        Ищет фильмы по названию: сначала в локальном TitleIndex (точное/транслит/опечатка),
+        иначе BM25 поиском. Для BM25 полагается на score для определения релевантности.
+        Одинаковые одновременные запросы без filters выполняются один раз (SingleFlight).
         
         Args:
             title: Название фильма для поиска
@@ -825,7 +1257,33 @@ class MovieWeaviateRecommender:
         Returns:
             List[dict]: список найденных фильмов в формате _weaviate_to_movie_dict
         """
+        if filters is not None:
+            return await self._find_movies_by_title(title, locale, min_score, filters)
+        return await self.inflight.run(
+            ("find_movies_by_title", " ".join(title.lower().split()), locale, min_score),
+            lambda: self._find_movies_by_title(title, locale, min_score),
+        )
+
+    async def _find_movies_by_title(
+        self,
+        title: str,
+        locale: str = "en",
+        min_score: float = 0.5,
+        filters: Optional[Filter] = None
+    ) -> List[dict]:
+        """Поиск по названию без схлопывания вызовов (см. find_movies_by_title)."""
         try:
+            kp_ids = self.title_index.lookup(title, locale)
+            if kp_ids:
+                # Фильтр (например, жанровый) проверяет Weaviate при догрузке документов
+                documents = await self.get_movies_by_kp_ids(kp_ids[:10], filters=filters)
+                if documents:
+                    logger.info(
+                        f"[find_movies_by_title] '{title}' найден в индексе названий: "
+                        f"{[kp_id for kp_id in kp_ids if kp_id in documents]}"
+                    )
+                    return [documents[kp_id] for kp_id in kp_ids if kp_id in documents]
+
             property_name = "title" if locale == "en" else "name"
             
             logger.info(
@@ -845,7 +1303,7 @@ class MovieWeaviateRecommender:
             if filters:
                 query_params["filters"] = filters
             
-            results = self.collection.query.bm25(**query_params)
+            results = await self.collection.query.bm25(**query_params)
             
             # Критерий 1: Пустой результат
             if len(results.objects) == 0:
@@ -872,7 +1330,7 @@ class MovieWeaviateRecommender:
             for obj in results.objects:
                 movie_title = obj.properties.get(property_name, "")
                 movie_title_normalized = " ".join(movie_title.lower().split())
-                movie_dict = self._weaviate_to_movie_dict(obj.properties)
+                movie_dict = self._cache_document(obj.properties)
                 score = obj.metadata.score
                 
                 if movie_title_normalized == title_normalized:
@@ -904,87 +1362,185 @@ class MovieWeaviateRecommender:
             logger.warning(f"[find_movies_by_title] Ошибка при поиске фильма '{title}': {e}")
             return []
 
+    async def get_movies_by_kp_ids(
+        self,
+        kp_ids: List[int],
+        filters: Optional[Filter] = None
+    ) -> Dict[int, dict]:
+        """
+        Получает документы фильмов: из кэша документов, недостающие — одним запросом (`kp_id contains_any`).
+
+        Args:
+            kp_ids: Список kp_id фильмов
+            filters: Дополнительные фильтры Weaviate (фильмы, не прошедшие фильтр, не вернутся).
+                С фильтрами кэш не читается — фильтр вычисляет Weaviate, — но пополняется.
+
+        Returns:
+            Dict[int, dict]: {kp_id: копия фильма в формате _weaviate_to_movie_dict}
+        """
+        kp_ids = [int(kp_id) for kp_id in dict.fromkeys(kp_ids)]
+        if not kp_ids:
+            return {}
+
+        movies: Dict[int, dict] = {}
+        missing = kp_ids
+        if filters is None:
+            missing = []
+            for kp_id in kp_ids:
+                cached = self.document_cache.get(kp_id)
+                if cached is not None:
+                    movies[kp_id] = dict(cached)
+                else:
+                    missing.append(kp_id)
+            if not missing:
+                return movies
+
+        kp_filter = Filter.by_property("kp_id").contains_any(missing)
+        result = await self.collection.query.fetch_objects(
+            filters=kp_filter & filters if filters is not None else kp_filter,
+            limit=len(missing),
+            return_properties=self._return_properties()
+        )
+        for obj in result.objects:
+            movie_dict = self._cache_document(obj.properties)
+            movies[movie_dict["kp_id"]] = movie_dict
+        return movies
+
+    async def _kp_ids_passing(self, kp_ids: List[int], filters: Filter) -> Set[int]:
+        """Какие из kp_ids проходят filters: один запрос `kp_id contains_any` без документов."""
+        if not kp_ids:
+            return set()
+        result = await self.collection.query.fetch_objects(
+            filters=Filter.by_property("kp_id").contains_any(kp_ids) & filters,
+            limit=len(kp_ids),
+            return_properties=["kp_id"],
+        )
+        return {obj.properties.get("kp_id") for obj in result.objects} - {None}
+
+    async def _materialize(self, kp_ids: List[int], objects: Optional[list] = None, **columns) -> List[dict]:
+        """
+        Собирает полные документы только для отобранных кандидатов, в порядке kp_ids.
+
+        Документы берутся из `objects`, если ответ Weaviate уже пришёл с полными свойствами,
+        иначе — вторая фаза двухфазного поиска: кэш документов и один запрос на недостающие.
+        `columns` — значения по позициям kp_ids (distance=..., adjusted_distance=...), NaN не записывается.
+        Фильмы, которых нет в ответе, отбрасываются.
+        """
+        if not kp_ids:
+            return []
+        if objects is None:
+            docs = await self.get_movies_by_kp_ids(kp_ids)
+        else:
+            wanted = set(kp_ids)
+            docs = {}
+            for obj in objects:
+                kp_id = obj.properties.get("kp_id")
+                if kp_id in wanted and kp_id not in docs:
+                    docs[kp_id] = self._cache_document(obj.properties)
+
+        movies = []
+        for i, kp_id in enumerate(kp_ids):
+            doc = docs.get(kp_id)
+            if doc is None:
+                continue
+            for name, values in columns.items():
+                value = float(values[i])
+                if not np.isnan(value):
+                    doc[name] = value
+            movies.append(doc)
+        return movies
+
+    @staticmethod
+    def _extract_vector(vector) -> Optional[List[float]]:
+        """
+        Достаёт вектор из ответа Weaviate: может прийти как list или как dict
+        вида {"default": [0.1, 0.2, ...]} (named vectors).
+        """
+        if isinstance(vector, dict):
+            if "default" in vector:
+                vector = vector["default"]
+            elif len(vector) > 0:
+                vector = next(iter(vector.values()))
+            else:
+                return None
+        if isinstance(vector, (list, tuple)) and len(vector) > 0:
+            return list(vector)
+        return None
+
+    async def get_movie_vectors(self, kp_ids: List[int]) -> Dict[int, np.ndarray]:
+        """
+        Возвращает векторы фильмов {kp_id: float32-вектор}.
+
+        Сначала смотрит в in-memory кэш векторов и локальное зеркало, недостающие забирает
+        из Weaviate одним запросом (`kp_id contains_any` + include_vector).
+        """
+        vectors: Dict[int, np.ndarray] = {}
+        missing = []
+        for kp_id in dict.fromkeys(kp_ids):
+            cached = self.vector_cache.get(kp_id)
+            if cached is not None:
+                vectors[kp_id] = cached
+            else:
+                missing.append(kp_id)
+
+        mirror = self._fresh_mirror()
+        if mirror is not None and missing:
+            not_in_mirror = []
+            for kp_id in missing:
+                vector = mirror.vector(kp_id)
+                if vector is None:
+                    not_in_mirror.append(kp_id)
+                else:
+                    vectors[kp_id] = vector
+            missing = not_in_mirror
+
+        if not missing:
+            return vectors
+
+        result = await self.collection.query.fetch_objects(
+            filters=Filter.by_property("kp_id").contains_any(missing),
+            limit=len(missing),
+            include_vector=True,
+            return_properties=["kp_id"]
+        )
+
+        for obj in result.objects:
+            kp_id = obj.properties.get("kp_id")
+            vector = self._extract_vector(obj.vector)
+            if kp_id is None or vector is None:
+                logger.warning(
+                    f"[get_movie_vectors] Не удалось получить вектор для kp_id={kp_id}, "
+                    f"объект не содержит вектор"
+                )
+                continue
+            array = np.asarray(vector, dtype=np.float32)
+            self.vector_cache.set(kp_id, array)
+            vectors[kp_id] = array
+
+        not_found = [kp_id for kp_id in missing if kp_id not in vectors]
+        if not_found:
+            logger.warning(f"[get_movie_vectors] Фильмы не найдены в Weaviate: {not_found}")
+
+        return vectors
+
     async def get_movie_vectors_by_kp_ids(self, kp_ids: List[int]) -> List[List[float]]:
         """
-        Получает векторы фильмов из Weaviate по их kp_id.
+        Получает векторы фильмов из Weaviate по их kp_id (один запрос на все id + кэш векторов).
         
         Args:
             kp_ids: Список kp_id фильмов
             
         Returns:
-            List[List[float]]: список векторов фильмов из Weaviate
+            List[List[float]]: список векторов фильмов в порядке kp_ids (ненайденные пропускаются)
         """
-        vectors = []
-        
         try:
-            for kp_id in kp_ids:
-                # Получаем объект по kp_id
-                result = self.collection.query.fetch_objects(
-                    filters=Filter.by_property("kp_id").equal(kp_id),
-                    limit=1,
-                    return_properties=["kp_id"]  # Минимальные свойства, нам нужен только UUID
-                )
-                
-                if not result.objects:
-                    logger.warning(
-                        f"[get_movie_vectors_by_kp_ids] Фильм kp_id={kp_id} не найден, пропускаем"
-                    )
-                    continue
-                
-                obj_uuid = result.objects[0].uuid
-                
-                # Получаем вектор объекта из Weaviate
-                try:
-                    obj_data = self.collection.query.fetch_object_by_id(
-                        uuid=obj_uuid,
-                        include_vector=True
-                    )
-                    
-                    if obj_data and hasattr(obj_data, 'vector') and obj_data.vector:
-                        vector = obj_data.vector
-                        
-                        # Проверяем тип вектора - может быть dict или list
-                        if isinstance(vector, dict):
-                            # Если вектор в формате dict, извлекаем значения
-                            # В Weaviate вектор может быть в формате {"default": [0.1, 0.2, ...]}
-                            if "default" in vector:
-                                vector = vector["default"]
-                            elif len(vector) > 0:
-                                # Берем первый ключ, если есть
-                                first_key = list(vector.keys())[0]
-                                vector = vector[first_key]
-                            else:
-                                logger.warning(
-                                    f"[get_movie_vectors_by_kp_ids] Вектор для kp_id={kp_id} в неожиданном формате dict: {vector}"
-                                )
-                                continue
-                        
-                        # Проверяем, что вектор - это список чисел
-                        if isinstance(vector, list) and len(vector) > 0:
-                            vectors.append(vector)
-                            logger.debug(
-                                f"[get_movie_vectors_by_kp_ids] Получен вектор для kp_id={kp_id}, "
-                                f"размерность: {len(vector)}"
-                            )
-                        else:
-                            logger.warning(
-                                f"[get_movie_vectors_by_kp_ids] Вектор для kp_id={kp_id} не является списком: {type(vector)}"
-                            )
-                    else:
-                        logger.warning(
-                            f"[get_movie_vectors_by_kp_ids] Не удалось получить вектор для kp_id={kp_id}, "
-                            f"объект не содержит вектор"
-                        )
-                except Exception as e:
-                    logger.warning(
-                        f"[get_movie_vectors_by_kp_ids] Ошибка при получении вектора для kp_id={kp_id}: {e}"
-                    )
-                    continue
-            
+            vectors_by_kp_id = await self.get_movie_vectors(kp_ids)
+            vectors = [vectors_by_kp_id[kp_id].tolist() for kp_id in kp_ids if kp_id in vectors_by_kp_id]
+
             logger.info(
                 f"[get_movie_vectors_by_kp_ids] Получено {len(vectors)} векторов из {len(kp_ids)} запрошенных"
             )
-            
+
             return vectors
             
         except Exception as e:
@@ -1059,37 +1615,32 @@ class MovieWeaviateRecommender:
                 f"[find_similar_by_vector] Поиск ближайших фильмов к вектору, "
                 f"limit={limit}, exclude_kp_ids={len(exclude_set)} фильмов"
             )
+
+            mirror = self._fresh_mirror()
+            if mirror is not None:
+                movies = await self._find_similar_in_mirror(mirror, vector, limit, exclude_set, filters)
+                if movies is not None:
+                    return movies
             
-            results = self.collection.query.near_vector(
+            exclusion_filter = self._exclusion_filter(exclude_set)
+            results = await self.collection.query.near_vector(
                 near_vector=vector,
-                limit=limit + len(exclude_set),  # Берем больше, чтобы компенсировать исключения
+                # Без фильтра исключений берем больше, чтобы компенсировать исключения
+                limit=limit if exclusion_filter is not None else limit + len(exclude_set),
                 return_metadata=["distance"],
-                return_properties=self._return_properties(),
-                filters=filters
+                return_properties=(
+                    self._candidate_properties() if TWO_PHASE_RETRIEVAL else self._return_properties()
+                ),
+                filters=self._combine_filters(filters, exclusion_filter)
             )
             
-            movies = []
-            excluded_count = 0
-            
-            for obj in results.objects:
-                props = obj.properties
-                kp_id = props.get("kp_id")
-                
-                if kp_id in exclude_set:
-                    excluded_count += 1
-                    logger.debug(
-                        f"[find_similar_by_vector] Фильм kp_id={kp_id} исключен "
-                        f"(находится в exclude_set)"
-                    )
-                    continue
-                
-                movie_dict = self._weaviate_to_movie_dict(props)
-                if hasattr(obj.metadata, 'distance'):
-                    movie_dict["distance"] = obj.metadata.distance
-                movies.append(movie_dict)
-                
-                if len(movies) >= limit:
-                    break
+            batch, excluded_count = CandidateBatch.from_objects(results.objects, exclude_set)
+            batch = batch.take(np.arange(min(len(batch), limit)))
+            movies = await self._materialize(
+                batch.kp_id_list(),
+                objects=None if TWO_PHASE_RETRIEVAL else results.objects,
+                distance=batch.distances,
+            )
             
             logger.info(
                 f"[find_similar_by_vector] Найдено {len(movies)} фильмов, "
@@ -1102,56 +1653,238 @@ class MovieWeaviateRecommender:
             logger.warning(f"[find_similar_by_vector] Ошибка при поиске по вектору: {e}")
             return []
 
+    async def _find_similar_in_mirror(
+        self,
+        mirror: VectorMirror,
+        vector: List[float],
+        limit: int,
+        exclude_set: Set[int],
+        filters: Optional[Filter] = None
+    ) -> Optional[List[dict]]:
+        """
+        Top-k по локальному зеркалу + догрузка документов только победителей (_materialize).
+
+        С фильтрами берём VECTOR_MIRROR_CANDIDATES ближайших и отдаём фильтрацию Weaviate
+        (`kp_id contains_any` & filters, только kp_id), порядок зеркала сохраняется. Возвращает None,
+        если после фильтра осталось меньше `limit` фильмов, а кандидаты не исчерпаны — тогда
+        вызывающий код идёт в near_vector.
+        """
+        k = limit if filters is None else max(limit, VECTOR_MIRROR_CANDIDATES)
+        rows, distances = await asyncio.to_thread(mirror.search, vector, k, exclude_set)
+        candidate_kp_ids = mirror.kp_ids[rows]
+
+        if filters is not None:
+            passed = await self._kp_ids_passing(candidate_kp_ids.tolist(), filters)
+            keep = np.flatnonzero(np.isin(candidate_kp_ids, np.fromiter(passed, dtype=np.int64, count=len(passed))))
+            if len(keep) < limit and len(rows) == k:
+                logger.info(
+                    f"[find_similar_by_vector] Зеркало: после фильтров осталось {len(keep)} из {len(rows)} "
+                    f"кандидатов (< limit={limit}), fallback на near_vector"
+                )
+                return None
+            keep = keep[:limit]
+            candidate_kp_ids, distances = candidate_kp_ids[keep], distances[keep]
+
+        movies = await self._materialize(candidate_kp_ids[:limit].tolist(), distance=distances[:limit])
+
+        logger.info(
+            f"[find_similar_by_vector] Найдено {len(movies)} фильмов по локальному зеркалу "
+            f"(кандидатов: {len(rows)}, фильтры: {'да' if filters is not None else 'нет'})"
+        )
+        return movies
+
+    async def _recommend_similar_from_table(
+            self,
+            source_kp_id: int,
+            penalty_weight: float,
+            exclude_set: Set[int],
+    ) -> Optional[List[dict]]:
+        """
+        recommend_similar по предрасчитанной таблице соседей: онлайн только исключения
+        пользователя и догрузка документов. None — таблица неприменима, нужен поиск.
+        """
+        table = self.neighbour_table
+        if not table.is_fresh() or table.penalty_weight != penalty_weight:
+            return None
+
+        found = table.lookup(source_kp_id, limit=100, exclude_kp_ids=exclude_set)
+        if found is None:
+            return None
+
+        kp_ids, scores = found
+        movies = await self._materialize(kp_ids, adjusted_distance=scores)
+
+        logger.info(
+            f"[WeaviateRecommender] recommend_similar (таблица соседей): source_kp_id={source_kp_id}, "
+            f"exclude_kp_ids={len(exclude_set)} фильмов, вернется: {len(movies)}"
+        )
+        return movies
+
+    async def _recommend_similar_from_mirror(
+            self,
+            mirror: VectorMirror,
+            source_kp_id: int,
+            penalty_weight: float,
+            exclude_set: Set[int],
+    ) -> Optional[List[dict]]:
+        """
+        recommend_similar по локальному зеркалу: соседи, конфликт жанров и adjusted_distance
+        считаются по массивам зеркала, из Weaviate догружаются только итоговые 100 документов.
+        Возвращает None, если исходного фильма нет в зеркале.
+        """
+        source_row = mirror.row_of(source_kp_id)
+        if source_row is None:
+            return None
+
+        rows, distances = await asyncio.to_thread(
+            mirror.search,
+            mirror.vectors[source_row],
+            self.top_k_similar,
+            exclude_set | {source_kp_id},
+        )
+
+        popularity = mirror.popularity[rows]
+        genre_conflict = genre_conflict_mask(mirror.flags[rows], int(mirror.flags[source_row]))
+        low_score = popularity <= 0
+        keep = ~genre_conflict & ~low_score
+        adjusted = adjusted_distances(distances, popularity, penalty_weight)
+
+        kept = np.flatnonzero(keep)
+        top = kept[top_k(adjusted[kept], 100)]
+        top_kp_ids = [int(kp_id) for kp_id in mirror.kp_ids[rows[top]]]
+        movies = await self._materialize(top_kp_ids, adjusted_distance=adjusted[top])
+
+        logger.info(
+            f"[WeaviateRecommender] recommend_similar (зеркало): source_kp_id={source_kp_id}, "
+            f"кандидатов: {len(rows)}, исключено по жанрам: {int(genre_conflict.sum())}, "
+            f"исключено по score: {int((low_score & ~genre_conflict).sum())}, вернется: {len(movies)}"
+        )
+        return movies
+
+    async def _resolve_similar_source(
+            self,
+            source_kp_id: int,
+            source_movie: Optional[dict] = None,
+    ) -> Optional[Tuple[object, List[str]]]:
+        """
+        (UUID, жанры) исходного фильма для near_object. Без запроса к Weaviate, если UUID есть
+        в индексе, а жанры — в переданном документе или в жанровых флагах индекса.
+        """
+        source_uuid = self.kp_index.get_uuid(source_kp_id)
+        if source_uuid is not None:
+            if source_movie is not None:
+                return source_uuid, source_movie.get("genres") or []
+            has_anime = self.kp_index.has_anime(source_kp_id)
+            # Для проверки конфликта жанров важно только, есть ли у исходного фильма 'аниме'
+            return source_uuid, ["аниме"] if has_anime else []
+
+        result = await self.collection.query.fetch_objects(
+            filters=Filter.by_property("kp_id").equal(source_kp_id),
+            limit=1,
+            return_properties=["kp_id", "genres"]
+        )
+        if not result.objects:
+            return None
+
+        source_obj = result.objects[0]
+        source_genres = source_obj.properties.get("genres", [])
+        self.kp_index.remember(source_kp_id, source_obj.uuid, source_genres)
+        return source_obj.uuid, source_genres
+
     async def recommend_similar(
             self,
             source_kp_id: int,
-            penalty_weight: float = 0.15,
+            penalty_weight: float = SIMILAR_PENALTY_WEIGHT,
             exclude_kp_ids: Optional[Set[int]] = None,
+            source_movie: Optional[dict] = None,
     ) -> List[dict]:
         """
         Ищет фильмы, похожие на заданный по `kp_id`, с переранжировкой по adjusted_distance.
 
         Алгоритм:
-        - Находит UUID и жанры объекта по `kp_id`.
-        - Выполняет near_object-поиск ближайших фильмов.
+        - Если есть свежая таблица соседей — берёт готовый список и убирает исключённые фильмы.
+        - Иначе, если локальное зеркало векторов свежее — соседи и переранжировка считаются по нему.
+        - Иначе берёт UUID объекта из индекса kp_id -> UUID (промах — запрос по `kp_id`)
+          и выполняет near_object-поиск в Weaviate.
         - Вычисляет dynamic_score.
         - Переранжирует по формуле: distance * (1 + penalty_weight * log1p(10 - dynamic_score)).
 
         Параметры:
             kp_id (int): идентификатор фильма, для которого ищутся похожие.
             penalty_weight (float): вес штрафа за низкий score.
+            source_movie (dict, optional): уже загруженный документ исходного фильма
+                (жанры берутся из него, повторно фильм не запрашивается).
 
         Возвращает:
             List[dict]: топ `limit` переранжированных фильмов.
+
+        Одинаковые одновременные вызовы (лендинг под нагрузкой краулеров) выполняются один раз.
         """
+        return await self.inflight.run(
+            ("recommend_similar", source_kp_id, penalty_weight, frozenset(exclude_kp_ids or ())),
+            lambda: self._recommend_similar(source_kp_id, penalty_weight, exclude_kp_ids, source_movie),
+        )
+
+    async def _recommend_similar(
+            self,
+            source_kp_id: int,
+            penalty_weight: float = SIMILAR_PENALTY_WEIGHT,
+            exclude_kp_ids: Optional[Set[int]] = None,
+            source_movie: Optional[dict] = None,
+    ) -> List[dict]:
+        """Похожие фильмы без схлопывания вызовов (см. recommend_similar)."""
         try:
-            result = self.collection.query.fetch_objects(
-                filters=Filter.by_property("kp_id").equal(source_kp_id),
-                limit=1,
-                return_properties=self._return_properties()
+            movies = await self._recommend_similar_from_table(
+                source_kp_id, penalty_weight, exclude_kp_ids or set()
             )
+            if movies is not None:
+                return movies
 
-            if not result.objects:
-                return []
-
-            source_obj = result.objects[0]
-            source_uuid = source_obj.uuid
-            source_props = source_obj.properties
-            
-            source_genres = source_props.get("genres", [])
+            mirror = self._fresh_mirror()
+            if mirror is not None:
+                movies = await self._recommend_similar_from_mirror(
+                    mirror, source_kp_id, penalty_weight, exclude_kp_ids or set()
+                )
+                if movies is not None:
+                    return movies
 
-            response = self.collection.query.near_object(
-                near_object=source_uuid,
-                limit=self.top_k_similar,
-                return_metadata=["distance"],
-                return_properties=self._return_properties()
+            source = await self._resolve_similar_source(source_kp_id, source_movie)
+            if source is None:
+                return []
+            source_uuid, source_genres = source
+            exclusion_filter = self._exclusion_filter(exclude_kp_ids)
+            return_properties = (
+                self._candidate_properties() if TWO_PHASE_RETRIEVAL else self._return_properties()
             )
 
+            try:
+                response = await self.collection.query.near_object(
+                    near_object=source_uuid,
+                    limit=self.top_k_similar,
+                    return_metadata=["distance"],
+                    return_properties=return_properties,
+                    filters=exclusion_filter
+                )
+            except Exception as e:
+                # UUID из индекса мог устареть (объект пересоздан) — резолвим заново запросом
+                logger.info(
+                    f"[WeaviateRecommender] near_object по UUID из индекса для kp_id={source_kp_id} "
+                    f"не удался ({e}), повторяем с поиском по kp_id"
+                )
+                self.kp_index.discard(source_kp_id)
+                source = await self._resolve_similar_source(source_kp_id, source_movie)
+                if source is None:
+                    return []
+                source_uuid, source_genres = source
+                response = await self.collection.query.near_object(
+                    near_object=source_uuid,
+                    limit=self.top_k_similar,
+                    return_metadata=["distance"],
+                    return_properties=return_properties,
+                    filters=exclusion_filter
+                )
+
             exclude_set = exclude_kp_ids or set()
-            movies = []
-            excluded_count = 0
-            genre_conflict_count = 0
-            low_score_count = 0
 
             logger.info(
                 f"[WeaviateRecommender] recommend_similar: source_kp_id={source_kp_id}, "
@@ -1159,57 +1892,27 @@ class MovieWeaviateRecommender:
                 f"получено {len(response.objects)} похожих фильмов"
             )
 
-            for obj in response.objects:
-                props = obj.properties
-                obj_kp_id = props.get("kp_id")
-                if obj_kp_id == source_kp_id or obj_kp_id in exclude_set:
-                    excluded_count += 1
-                    logger.debug(
-                        f"[WeaviateRecommender] recommend_similar: фильм kp_id={obj_kp_id} исключен "
-                        f"(source_kp_id={source_kp_id} или в exclude_set)"
-                    )
-                    continue
-
-                movie_dict = self._weaviate_to_movie_dict(props)
-                movie_genres = movie_dict.get("genres", [])
-
-                if self._skip_due_to_genre_conflict(movie_genres, source_genres):
-                    genre_conflict_count += 1
-                    logger.debug(
-                        f"[WeaviateRecommender] recommend_similar: фильм kp_id={obj_kp_id} исключен "
-                        f"из-за конфликта жанров"
-                    )
-                    continue
-
-                dynamic_score = movie_dict.get("popularity_score") or 0.0
-                if dynamic_score <= 0:
-                    low_score_count += 1
-                    continue
-
-                distance = obj.metadata.distance
-                # Ограничиваем dynamic_score сверху значением 10, чтобы избежать math domain error
-                # при вычислении log1p(10 - dynamic_score)
-                score_diff = max(0.0, 10.0 - min(dynamic_score, 10.0))
-                adjusted_distance = distance * (1 + penalty_weight * math.log1p(score_diff))
+            # Конфликт жанров, нулевая популярность и adjusted_distance — разом по массивам
+            batch, excluded_count = CandidateBatch.from_objects(response.objects, exclude_set | {source_kp_id})
+            genre_conflict = batch.genre_conflicts(source_genres)
+            low_score = batch.popularity <= 0
+            genre_conflict_count = int(genre_conflict.sum())
+            low_score_count = int((low_score & ~genre_conflict).sum())
+            kept = np.flatnonzero(~genre_conflict & ~low_score)
+            adjusted = adjusted_distances(batch.distances[kept], batch.popularity[kept], penalty_weight)
 
-                movie_dict["adjusted_distance"] = adjusted_distance
-                movies.append(movie_dict)
-
-            result_kp_ids = [m.get("kp_id") for m in movies]
-            excluded_in_results = [kp_id for kp_id in result_kp_ids if kp_id in exclude_set]
-            if excluded_in_results:
-                logger.warning(
-                    f"[WeaviateRecommender] ВНИМАНИЕ: В результатах recommend_similar найдены исключенные фильмы! "
-                    f"exclude_set содержит {len(exclude_set)} фильмов, но в результатах присутствуют: {excluded_in_results}"
-                )
-            
             logger.info(
                 f"[WeaviateRecommender] recommend_similar: исключено по exclude_set/source: {excluded_count}, "
                 f"исключено по жанрам: {genre_conflict_count}, исключено по score: {low_score_count}, "
-                f"осталось: {len(movies)}, вернется: {min(len(movies), 100)}"
+                f"осталось: {len(kept)}, вернется: {min(len(kept), 100)}"
             )
 
-            return sorted(movies, key=lambda x: x["adjusted_distance"])[:100]
+            top = top_k(adjusted, 100)
+            return await self._materialize(
+                batch.take(kept[top]).kp_id_list(),
+                objects=None if TWO_PHASE_RETRIEVAL else response.objects,
+                adjusted_distance=adjusted[top],
+            )
 
         except Exception as e:
             logger.warning(f"[MovieRAG] Ошибка в recommend_similar: {e}")
@@ -1233,6 +1936,7 @@ class MovieWeaviateRecommender:
             query: str = None,
             movie_name: str = None,
             genres: Optional[List[str]] = None,
+            atmospheres: Optional[List[str]] = None,
             start_year: int = 1900,
             end_year: int = CURRENT_YEAR,
             rating_kp: float = 5.0,
@@ -1257,6 +1961,8 @@ class MovieWeaviateRecommender:
             query (str, optional): Текстовый запрос (например, атмосфера или описание).
             movie_name (str, optional): Точное имя фильма для поиска (приоритетный путь).
             genres (List[str], optional): Список жанров фильмов.
+            atmospheres (List[str], optional): Атмосферы из ATMOSPHERE_MAPPING, из которых собран `query`.
+                Вектор запроса берётся из таблицы атмосфер без обращения к OpenAI.
             start_year (int): Минимальный год выпуска.
             end_year (int): Максимальный год выпуска.
             rating_kp (float): Минимальный рейтинг на Кинопоиске.
@@ -1299,7 +2005,8 @@ class MovieWeaviateRecommender:
                     exclude_kp_ids=exclude_set,
                     locale=locale,
                     cast=cast,
-                    directors=directors
+                    directors=directors,
+                    query_vector=self.atmosphere_embeddings.compose(atmospheres) if query else None,
                 )
 
             for movie in movies:
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 
 from contextlib import asynccontextmanager
@@ -14,7 +15,13 @@ from clients.weaviate_client  import MovieWeaviateRecommender, load_vectorstore_
 from clients.client_factory import kp_client, openai_client_base_async
 from openapi_config import custom_openapi
 from routers import health, favorites, movies, users, landing, reddit
-from settings import ALLOW_ORIGINS
+from settings import (
+    ALLOW_ORIGINS,
+    CATALOG_RESCAN_INTERVAL,
+    COLLECTION_VERSION_CHECK_INTERVAL,
+    POPULAR_SNAPSHOT_REFRESH_INTERVAL,
+    VECTOR_MIRROR_RELOAD_INTERVAL,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,10 +30,21 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+async def _run_periodically(name: str, interval: float, job) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ Periodic job {name} failed: {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     weaviate_client = load_vectorstore_weaviate()
-    weaviate_client.connect()
+    await weaviate_client.connect()
     recommender = MovieWeaviateRecommender(
         weaviate_client=weaviate_client,
         openai_client=openai_client_base_async,
@@ -34,11 +52,53 @@ async def lifespan(app: FastAPI):
     )
     logger.info("✅ MovieWeaviateRecommender initialized with Weaviate.")
 
+    recommender.embedding_cache.load_snapshot()
+    recommender.vector_mirror.load()
+    recommender.neighbour_table.load()
+    try:
+        await recommender.load_catalog()
+    except Exception as e:
+        logger.warning(f"⚠️ Catalog indexes not loaded, falling back to per-request lookups: {e}")
+    try:
+        await recommender.atmosphere_embeddings.load_or_build()
+    except Exception as e:
+        logger.warning(f"⚠️ Atmosphere embeddings not loaded, falling back to per-query embeddings: {e}")
+
+    try:
+        await recommender.refresh_collection_version()
+    except Exception as e:
+        logger.warning(f"⚠️ Collection version not resolved: {e}")
+
+    background_tasks = [
+        asyncio.create_task(_run_periodically(
+            "collection_version", COLLECTION_VERSION_CHECK_INTERVAL, recommender.refresh_collection_version
+        )),
+        asyncio.create_task(_run_periodically(
+            "vector_mirror", VECTOR_MIRROR_RELOAD_INTERVAL, recommender.reload_vector_mirror
+        )),
+        asyncio.create_task(_run_periodically(
+            "neighbour_table", VECTOR_MIRROR_RELOAD_INTERVAL, recommender.reload_neighbour_table
+        )),
+        asyncio.create_task(_run_periodically(
+            "catalog", CATALOG_RESCAN_INTERVAL, recommender.load_catalog
+        )),
+        asyncio.create_task(_run_periodically(
+            "popular_snapshot", POPULAR_SNAPSHOT_REFRESH_INTERVAL, recommender.popular_snapshot.refresh_all
+        )),
+    ]
+
     app.state.recommender = recommender
     app.state.openai_client = openai_client_base_async
 
     yield
 
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
+    recommender.embedding_cache.save_snapshot()
+    await weaviate_client.close()
+
 
 def create_app() -> FastAPI:
     fastapi_app = FastAPI(lifespan=lifespan)
@@ -169,6 +169,36 @@ class MovieResponseLocalized(BaseModel):
     rating_imdb: Optional[float] = None
     movie_length: Optional[int] = None
 
+    @classmethod
+    def from_weaviate(cls, movie: dict) -> "MovieResponseLocalized":
+        """Собирает ответ из документа Weaviate (формат _weaviate_to_movie_dict)."""
+        genres_ru = to_name_dicts(movie.get("genres", []))
+        countries_ru = to_name_dicts(movie.get("countries", []))
+        genres_en = to_name_dicts(movie.get("genres_tmdb", []))
+        countries_en = to_name_dicts(movie.get("origin_country", []))
+        return cls(
+            movie_id=movie.get("kp_id"),
+            imdb_id=movie.get("imdb_id"),
+            # Русская локализация
+            name=movie.get("name") or "",
+            overview_ru=movie.get("description") or "",
+            genres_ru=genres_ru or None,
+            countries_ru=countries_ru or None,
+            poster_url_kp=movie.get("kp_file_path") or "",
+            background_color_kp=movie.get("kp_background_color"),
+            # Английская локализация
+            title=movie.get("title") or movie.get("name") or "",
+            overview_en=movie.get("overview") or "",
+            genres_en=genres_en or None,
+            countries_en=countries_en or None,
+            poster_url_tmdb=movie.get("tmdb_file_path") or "",
+            background_color_tmdb=movie.get("tmdb_background_color"),
+            # Общие поля
+            year=movie.get("year"),
+            rating_kp=movie.get("rating_kp"),
+            rating_imdb=movie.get("rating_imdb"),
+            movie_length=movie.get("movieLength")
+        )
 
 
 class AddSkippedRequest(BaseModel):
@@ -1,8 +1,17 @@
-from fastapi import APIRouter, status
+from fastapi import APIRouter, Request, status
 from fastapi.responses import JSONResponse
 
+from routers import landing
+
 router = APIRouter()
 
 @router.get("/health", tags=["Health"])
 async def health_check():
     return JSONResponse(content={"status": "ok"}, status_code=status.HTTP_200_OK)
+
+
+@router.get("/health/caches", tags=["Health"])
+async def cache_stats(request: Request):
+    recommender = request.app.state.recommender
+    content = {**recommender.get_stats(), "landing_rerank": landing.rerank_flight.stats()}
+    return JSONResponse(content=content, status_code=status.HTTP_200_OK)
@@ -4,19 +4,31 @@ API endpoints для SEO-лендинга
 import asyncio
 import logging
 import re
+import time
+from contextlib import nullcontext
 from typing import List, Optional
 
 from fastapi import APIRouter, Request, HTTPException, status
 from openai import AsyncOpenAI
 from pydantic import BaseModel
 
+from clients.rerank import LocalReranker, RerankCache, RerankLoad, RerankPromptBuilder
+from clients.search import SingleFlight
 from clients.weaviate_client import MovieWeaviateRecommender
-from settings import RERANK_PROMPT_TEMPLATE_RU, RERANK_PROMPT_TEMPLATE_EN, MODEL_RERANK
+from settings import (
+    RERANK_PROMPT_TEMPLATE_RU,
+    RERANK_PROMPT_TEMPLATE_EN,
+    MODEL_RERANK,
+    RERANK_LANDING_MAX_CANDIDATES,
+)
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Краулеры и всплески трафика запрашивают одну страницу одновременно — реранк делаем один раз
+rerank_flight = SingleFlight(name="landing_rerank")
+
 
 async def _rerank_movies(
     openai_client: AsyncOpenAI,
@@ -24,19 +36,57 @@ async def _rerank_movies(
     movies: List[dict],
     locale: str = "ru",
     source_movie_name: str | None = None,
+    cache: Optional[RerankCache] = None,
+    local_reranker: Optional[LocalReranker] = None,
+    load: Optional[RerankLoad] = None,
+    prompts: Optional[RerankPromptBuilder] = None,
 ) -> List[dict]:
     """Реранк фильмов через OpenAI (не-стриминговый, для лендинга)."""
     if not movies:
         return movies
+    key = (query, locale, source_movie_name, tuple(m.get("kp_id") for m in movies))
+    return await rerank_flight.run(
+        key,
+        lambda: _rerank_movies_once(
+            openai_client, query, movies, locale, source_movie_name, cache, local_reranker, load, prompts
+        ),
+    )
 
-    # Форматируем список фильмов
-    lines = []
-    for i, m in enumerate(movies):
-        name = m.get("name") or m.get("title") or ""
-        desc = (m.get("page_content") or "")[:200]
-        lines.append(f"{i + 1}. [{name}] {desc}")
-    movies_list = "\n".join(lines)
 
+async def _local_order(query: str, movies: List[dict], local_reranker: Optional[LocalReranker]) -> List[dict]:
+    """Порядок локального реранка (без LLM); без него или при его ошибке — исходный."""
+    if local_reranker is None:
+        return movies
+    try:
+        return await local_reranker.rank(query, movies)
+    except Exception as e:
+        logger.warning(f"[Landing] Ошибка локального rerank: {e}, исходный порядок")
+        return movies
+
+
+def _with_tail(reranked: List[dict], movies: List[dict]) -> List[dict]:
+    """Дополняет реранк фильмами, которые модель не вернула, в исходном порядке."""
+    if len(reranked) < len(movies):
+        reranked_kp_ids = {m.get("kp_id") for m in reranked}
+        reranked = reranked + [m for m in movies if m.get("kp_id") not in reranked_kp_ids]
+    return reranked
+
+
+async def _rerank_movies_once(
+    openai_client: AsyncOpenAI,
+    query: str,
+    movies: List[dict],
+    locale: str,
+    source_movie_name: str | None,
+    cache: Optional[RerankCache] = None,
+    local_reranker: Optional[LocalReranker] = None,
+    load: Optional[RerankLoad] = None,
+    prompts: Optional[RerankPromptBuilder] = None,
+) -> List[dict]:
+    """
+    Один реранк: из кэша перестановок или запросом к OpenAI (вызывается через rerank_flight).
+    При перегрузке модели (load) и при ошибке или таймауте — локальный порядок.
+    """
     # Exclude instruction
     exclude_instruction = ""
     if source_movie_name:
@@ -45,14 +95,31 @@ async def _rerank_movies(
         else:
             exclude_instruction = f"\n⚠️ ИСКЛЮЧИ сам фильм \"{source_movie_name}\" из ранжирования."
 
+    # На странице 9 фильмов: в промпт идут первые кандидаты в пределах бюджета токенов,
+    # остальные дописываются хвостом в порядке recommend_similar
     template = RERANK_PROMPT_TEMPLATE_EN if locale == "en" else RERANK_PROMPT_TEMPLATE_RU
-    prompt = template.format(
+    prompt_builder = prompts or RerankPromptBuilder()
+    rerank_prompt = prompt_builder.build(
+        template,
+        movies,
+        locale=locale,
+        max_candidates=RERANK_LANDING_MAX_CANDIDATES,
         query=query,
-        movies_list=movies_list,
-        movies_count=len(movies),
         exclude_instruction=exclude_instruction,
         criteria_context="",
     )
+    candidates = rerank_prompt.movies
+
+    kp_ids = [m.get("kp_id") for m in candidates]
+    cache_key = RerankCache.key(MODEL_RERANK, locale, query, exclude_instruction)
+    cached_order = cache.lookup(cache_key, kp_ids) if cache is not None else None
+    if cached_order is not None:
+        by_kp_id = {m.get("kp_id"): m for m in candidates}
+        logger.info(f"[Landing] Rerank из кэша: {len(cached_order)} фильмов")
+        return _with_tail([by_kp_id[kp_id] for kp_id in cached_order], movies)
+
+    if load is not None and load.overloaded():
+        return await _local_order(query, movies, local_reranker)
 
     system_content = (
         "You are a movie recommendation assistant." if locale == "en"
@@ -60,15 +127,25 @@ async def _rerank_movies(
     )
 
     try:
-        response = await asyncio.wait_for(
-            openai_client.chat.completions.create(
-                model=MODEL_RERANK,
-                messages=[
-                    {"role": "system", "content": system_content},
-                    {"role": "user", "content": prompt},
-                ],
-            ),
-            timeout=30,
+        started_at = time.monotonic()
+        with load.track() if load is not None else nullcontext():
+            response = await asyncio.wait_for(
+                openai_client.chat.completions.create(
+                    model=MODEL_RERANK,
+                    messages=[
+                        {"role": "system", "content": system_content},
+                        {"role": "user", "content": rerank_prompt.prompt},
+                    ],
+                ),
+                timeout=30,
+            )
+
+        usage = getattr(response, "usage", None)
+        prompt_builder.observe(
+            rerank_prompt,
+            time.monotonic() - started_at,
+            prompt_tokens=usage.prompt_tokens if isinstance(getattr(usage, "prompt_tokens", None), int) else None,
+            source="Landing",
         )
 
         content = response.choices[0].message.content or ""
@@ -78,22 +155,22 @@ async def _rerank_movies(
             match = re.match(r"(\d+)", line.strip())
             if match:
                 idx = int(match.group(1)) - 1
-                if 0 <= idx < len(movies) and idx not in seen:
+                if 0 <= idx < len(candidates) and idx not in seen:
                     seen.add(idx)
-                    reranked.append(movies[idx])
+                    reranked.append(candidates[idx])
+
+        if cache is not None:
+            cache.store(cache_key, kp_ids, [m.get("kp_id") for m in reranked])
 
         # Дополняем фильмами, которые реранк не вернул
-        if len(reranked) < len(movies):
-            reranked_kp_ids = {m.get("kp_id") for m in reranked}
-            remaining = [m for m in movies if m.get("kp_id") not in reranked_kp_ids]
-            reranked.extend(remaining)
+        reranked = _with_tail(reranked, movies)
 
         logger.info(f"[Landing] Rerank: {len(reranked)} фильмов отсортировано")
         return reranked
 
     except Exception as e:
-        logger.error(f"[Landing] Ошибка rerank: {e}, возвращаем исходный порядок")
-        return movies
+        logger.error(f"[Landing] Ошибка rerank: {e!r}, возвращаем локальный порядок")
+        return await _local_order(query, movies, local_reranker)
 
 
 class SimilarMoviesResponse(BaseModel):
@@ -187,7 +264,8 @@ async def get_movies_like(
         # Получаем похожие фильмы
         similar_movies = await recommender.recommend_similar(
             source_kp_id=source_kp_id,
-            exclude_kp_ids=None  # На лендинге не исключаем фильмы
+            exclude_kp_ids=None,  # На лендинге не исключаем фильмы
+            source_movie=source_movie,  # Уже загружен выше — повторно не запрашиваем
         )
 
         # Определяем название фильма для лога и реранка
@@ -202,6 +280,10 @@ async def get_movies_like(
             movies=similar_movies,
             locale=locale,
             source_movie_name=movie_title_for_log,
+            cache=recommender.rerank_cache,
+            local_reranker=recommender.local_reranker,
+            load=recommender.rerank_load,
+            prompts=recommender.rerank_prompts,
         )
 
         # Ограничиваем количество результатов
@@ -11,7 +11,7 @@ from fastapi import (
     status
 )
 from fastapi.websockets import WebSocketState
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List, Callable, Awaitable, TypedDict, Any, Union
@@ -35,7 +35,6 @@ from models import (
     QuestionStreamingRequest,
     AddSkippedRequest
 )
-from models.movies import to_name_dicts
 from routers.dependencies import get_session, get_movie_manager
 from routers.auth import check_user_stars
 from routers.ws_auth import authenticate_websocket
@@ -127,48 +126,15 @@ async def get_popular_movies(
         skipped = await movie_manager.get_skipped(user_id=user_id, platform=platform)
         exclude_kp_ids = set(favorites + skipped)
     
-    movies = await recommender.get_popular_movies(
+    payload = await recommender.get_popular_payload(
         limit=limit,
         min_year=min_year,
         min_rating_kp=min_rating_kp,
         exclude_kp_ids=exclude_kp_ids,
         locale=locale
     )
-    
-    result = []
-    for movie in movies:
-        
-        
-        genres_ru_dict = to_name_dicts(movie.get("genres", []))
-        countries_ru_dict = to_name_dicts(movie.get("countries", []))
-        genres_en_dict = to_name_dicts(movie.get("genres_tmdb", []))
-        countries_en_dict = to_name_dicts(movie.get("origin_country", []))
-        
-        result.append(MovieResponseLocalized(
-            movie_id=movie.get("kp_id"),
-            imdb_id=movie.get("imdb_id"),
-            # Русская локализация
-            name=movie.get("name") or "",
-            overview_ru=movie.get("description") or "",
-            genres_ru=genres_ru_dict if genres_ru_dict else None,
-            countries_ru=countries_ru_dict if countries_ru_dict else None,
-            poster_url_kp=movie.get("kp_file_path") or "",
-            background_color_kp=movie.get("kp_background_color"),
-            # Английская локализация
-            title=movie.get("title") or movie.get("name") or "",
-            overview_en=movie.get("overview") or "",
-            genres_en=genres_en_dict if genres_en_dict else None,
-            countries_en=countries_en_dict if countries_en_dict else None,
-            poster_url_tmdb=movie.get("tmdb_file_path") or "",
-            background_color_tmdb=movie.get("tmdb_background_color"),
-            # Общие поля
-            year=movie.get("year"),
-            rating_kp=movie.get("rating_kp"),
-            rating_imdb=movie.get("rating_imdb"),
-            movie_length=movie.get("movieLength")
-        ))
-    
-    return result
+    # Фильмы уже сериализованы в MovieResponseLocalized при сборке снапшота
+    return Response(content=payload, media_type="application/json")
 
 @router.get("/preview/{params}", response_class=HTMLResponse)
 async def preview_movie(
@@ -254,7 +220,11 @@ async def movie_agent_qa_ws(websocket: WebSocket):
     agent = MovieAgent(
         openai_client=openai_client_base_async,
         kp_client=kp_client,
-        recommender=websocket.app.state.recommender
+        recommender=websocket.app.state.recommender,
+        rerank_cache=websocket.app.state.recommender.rerank_cache,
+        local_reranker=websocket.app.state.recommender.local_reranker,
+        rerank_load=websocket.app.state.recommender.rerank_load,
+        rerank_prompts=websocket.app.state.recommender.rerank_prompts,
     )
     last_tool_call_id_ref: dict[str, Optional[str]] = {"id": None}
     search_completed = False  # Флаг: агент уже выполнил поиск (done отправлен)
@@ -410,6 +380,7 @@ async def handle_movie_agent_streaming(websocket: WebSocket, data: dict, agent:
     rating_kp = data.get("rating_kp", 0.0)
     rating_imdb = data.get("rating_imdb", 0.0)
     skip_rerank = data.get("skip_rerank", False)
+    fast_start = data.get("fast_start", False)
 
     stream_start = time.time()
     recommended_movies = []
@@ -430,6 +401,7 @@ async def handle_movie_agent_streaming(websocket: WebSocket, data: dict, agent:
         rating_kp=rating_kp,
         rating_imdb=rating_imdb,
         skip_rerank=skip_rerank,
+        fast_start=fast_start,
     ):
         if websocket.application_state != WebSocketState.CONNECTED:
             break
@@ -464,9 +436,8 @@ async def handle_movie_wv_streaming(websocket: WebSocket, data: dict, recommende
 
     atmospheres = data.get("atmospheres")
     if atmospheres and "любой" in atmospheres:
-        wv_query = None
-    else:
-        wv_query = ",".join([ATMOSPHERE_MAPPING[a] for a in atmospheres]) if atmospheres else None
+        atmospheres = None
+    wv_query = ",".join([ATMOSPHERE_MAPPING[a] for a in atmospheres]) if atmospheres else None
 
     platform = data.get("platform", "telegram")
     locale = data.get("locale", "ru")
@@ -479,6 +450,7 @@ async def handle_movie_wv_streaming(websocket: WebSocket, data: dict, recommende
         query=wv_query,
         movie_name=data.get("movie_name") or None,
         genres=genres,
+        atmospheres=atmospheres,
         start_year=data.get("start_year", 1900),
         end_year=data.get("end_year", CURRENT_YEAR),
         rating_kp=data.get("rating_kp", 5.0),
@@ -530,7 +502,11 @@ async def movie_streaming_ws(websocket: WebSocket):
     agent = MovieAgent(
         openai_client=openai_client_base_async,
         kp_client=kp_client,
-        recommender=websocket.app.state.recommender
+        recommender=websocket.app.state.recommender,
+        rerank_cache=websocket.app.state.recommender.rerank_cache,
+        local_reranker=websocket.app.state.recommender.local_reranker,
+        rerank_load=websocket.app.state.recommender.rerank_load,
+        rerank_prompts=websocket.app.state.recommender.rerank_prompts,
     )
     recommender: MovieWeaviateRecommender = websocket.app.state.recommender
 
@@ -109,6 +109,23 @@ MODEL_QA = "gpt-5.1"
 TEMPERATURE_QA = 0.9
 MODEL_MOVIES = "gpt-4o-mini"
 MODEL_RERANK = "gpt-4o-mini"
+FAST_START_CARDS = 3  # fast_start: карточек по векторному порядку до ответа реранка
+FAST_START_RERANK_BUDGET = 3.0  # секунды до первого номера от реранка, иначе векторный порядок
+RERANK_CACHE_MAX_ENTRIES = 5000  # (модель, локаль, запрос, инструкции) -> перестановки кандидатов
+RERANK_CACHE_MAX_BYTES = 16 * 1024 * 1024
+RERANK_CACHE_TTL = 24 * 3600  # секунды
+RERANK_CACHE_MIN_COVERAGE = 0.8  # доля текущих кандидатов, известных кэшу, для частичного переиспользования
+RERANK_CACHE_VARIANTS = 4  # наборов кандидатов на один ключ
+LOCAL_RERANK_KEYWORD_WEIGHT = 0.3  # вес совпадения слов запроса в локальном реранке (остальное — близость векторов)
+LOCAL_RERANK_TIMEOUT = 1.0  # секунды на эмбеддинг запроса и векторы фильмов, иначе только по словам
+LOCAL_RERANK_PREFILTER_SIZE = 0  # >0: в промпт LLM-реранка идут только N лучших по локальному скору
+RERANK_LLM_MAX_IN_FLIGHT = 32  # одновременных LLM-реранков, сверх — сразу локальный порядок
+RERANK_PROMPT_TOKEN_BUDGET = 2500  # токенов на промпт реранка (шаблон + список кандидатов)
+RERANK_PROMPT_MAX_CANDIDATES = 40  # кандидатов в промпте чата
+RERANK_PROMPT_MIN_CANDIDATES = 15  # меньше не отбрасываем даже сверх бюджета
+RERANK_PROMPT_SNIPPET_LENGTHS = (200, 120, 60)  # символов описания, от длинного к короткому
+RERANK_LANDING_MAX_CANDIDATES = 30  # кандидатов в промпте лендинга (показывается 9)
+RERANK_SUMMARY_CACHE_MAX_ENTRIES = 30000  # строк кандидатов (kp_id, локаль, длина описания)
 TEMPERATURE_MOVIES = 0.9
 QUESTION_PREFIX_PATTERN = r'\{\s*"questions"\s*:\s*\['
 MOVIES_PREFIX_PATTERN = r'\{\s*"movies"\s*:\s*\['
@@ -145,6 +162,55 @@ WEAVIATE_HOST_HTTP = "weaviate"
 WEAVIATE_PORT_HTTP = 8080
 WEAVIATE_HOST_GRPC = "weaviate"
 WEAVIATE_PORT_GRPC = 50051
+WEAVIATE_TIMEOUT_INIT = 5  # секунды на подключение
+WEAVIATE_TIMEOUT_QUERY = 15  # секунды на один запрос (hybrid/bm25/near_*)
+
+# clients.search (in-process кэши и индексы рекомендателя)
+EMBEDDING_CACHE_MAX_ENTRIES = 2000  # ~12 КБ на вектор text-embedding-3-large (float32)
+EMBEDDING_CACHE_TTL = 7 * 24 * 3600  # секунды
+EMBEDDING_CACHE_SNAPSHOT_PATH = os.path.join(INDEX_PATH, "embedding_cache.npz")
+ATMOSPHERE_EMBEDDINGS_PATH = os.path.join(INDEX_PATH, "atmosphere_embeddings.npz")
+MOVIE_VECTOR_CACHE_MAX_ENTRIES = 5000  # kp_id -> вектор фильма (float32)
+VECTOR_MIRROR_DIR = os.path.join(INDEX_PATH, "vector_mirror")  # пересборка: python -m clients.search.vector_mirror
+VECTOR_MIRROR_QUANTIZED = False  # перебор по int8-матрице с пересчётом лучших кандидатов по float32
+VECTOR_MIRROR_OVERSAMPLE = 4  # во сколько раз больше кандидатов пересчитывать по float32 в int8-режиме
+VECTOR_MIRROR_MAX_AGE = 7 * 24 * 3600  # секунды; старше — similarity-запросы идут в Weaviate
+VECTOR_MIRROR_RELOAD_INTERVAL = 60  # секунды между проверками новой сборки
+VECTOR_MIRROR_CANDIDATES = 1000  # кандидатов из зеркала для запросов с фильтрами Weaviate
+NEIGHBOUR_TABLE_DIR = os.path.join(INDEX_PATH, "neighbours")  # пересборка: python -m clients.search.neighbours
+NEIGHBOUR_TABLE_SIZE = 200  # соседей на фильм (после переранжировки, до исключений пользователя)
+SIMILAR_PENALTY_WEIGHT = 0.15  # вес штрафа за низкий popularity_score в recommend_similar
+EXCLUDE_FILTER_CHUNK = 1000  # kp_id в одном contains_none (части объединяются через AND)
+EXCLUDE_FILTER_MAX_IDS = 10000  # больше — исключения фильтруются на стороне приложения с over-fetch
+TWO_PHASE_RETRIEVAL = True  # кандидаты — только kp_id/popularity_score/genres, полные документы — для победителей
+DOCUMENT_CACHE_MAX_ENTRIES = 20000  # kp_id -> документ фильма (_weaviate_to_movie_dict)
+DOCUMENT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+DOCUMENT_CACHE_TTL = 6 * 3600  # секунды
+COLLECTION_VERSION_CHECK_INTERVAL = 300  # секунды между проверками версии коллекции
+POPULAR_SNAPSHOT_FETCH_LIMIT = 5000  # сколько кандидатов читать из Weaviate при сборке снапшота
+POPULAR_SNAPSHOT_REFRESH_INTERVAL = 600  # секунды между фоновыми обновлениями снапшотов
+POPULAR_SNAPSHOT_MAX_AGE = 1800  # снапшот старше этого перестраивается на запросе
+POPULAR_SNAPSHOT_IDLE_TTL = 24 * 3600  # ключи без обращений дольше этого не обновляются
+POPULAR_SNAPSHOT_PRESET_YEARS_BACK = (1,)  # min_year = текущий год минус N; (1,) — значение по умолчанию у роута
+POPULAR_SNAPSHOT_PRESET_RATINGS = (7.0,)  # min_rating_kp, для которых держится снапшот
+SUGGESTED_TITLES_CONCURRENCY = 8  # одновременных BM25-запросов при поиске suggested_titles
+TITLE_INDEX_FUZZY_MIN_RATIO = 0.85  # минимальное сходство для исправления опечатки в названии
+TITLE_INDEX_FUZZY_MARGIN = 0.05  # отрыв лучшего кандидата от второго, иначе название неоднозначно
+TITLE_INDEX_FUZZY_CANDIDATES = 20  # сколько кандидатов по триграммам проверять SequenceMatcher
+TITLE_INDEX_FUZZY_MAX_POSTINGS = 500  # триграммы, встречающиеся в большем числе названий, не учитываются
+MIN_GENRE_FALLBACK = 10  # меньше фильмов с contains_all(genres) — повтор по главному жанру
+GENRE_FALLBACK_SPECULATIVE = True  # запускать fallback по главному жанру параллельно, если он вероятен
+GENRE_FALLBACK_SPECULATE_BELOW = 20  # "вероятен": прошлый contains_all по этим жанрам дал меньше фильмов
+GENRE_FALLBACK_HISTORY_MAX_ENTRIES = 5000
+FACET_INDEX_SLACK = 20  # запас к счёту FacetIndex на фильмы, добавленные после скана каталога
+LOCAL_CATALOG_BROWSE = True  # recommend без текста запроса отбирается по колонкам FacetIndex
+CATALOG_RESCAN_INTERVAL = 3600  # секунды между фоновыми пересканами каталога
+RECOMMEND_RESULT_LIMIT = 50  # фильмов в выдаче recommend
+RECOMMEND_CACHE_ENABLED = True  # общий кэш результатов recommend по критериям (без исключений пользователя)
+RECOMMEND_CACHE_MAX_ENTRIES = 5000
+RECOMMEND_CACHE_MAX_BYTES = 32 * 1024 * 1024
+RECOMMEND_CACHE_TTL = 1800  # секунды
+RECOMMEND_CACHE_HEADROOM = 50  # сколько фильмов сверх RECOMMEND_RESULT_LIMIT кэшируется на исключения пользователя
 
 # Локализация
 DEFAULT_LOCALE = "ru"  # ru или en
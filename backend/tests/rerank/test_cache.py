@@ -0,0 +1,46 @@
+"""Tests for the rerank permutation cache."""
+from clients.rerank.cache import RerankCache
+
+
+def test_key_normalizes_query_case_and_whitespace():
+    assert RerankCache.key("m", "ru", "  Про  Космос ") == RerankCache.key("m", "ru", "про космос")
+    assert RerankCache.key("m", "ru", "про космос", "ИСКЛЮЧИ X") != RerankCache.key("m", "ru", "про космос")
+
+
+def test_exact_hit_returns_stored_permutation():
+    cache = RerankCache()
+    key = RerankCache.key("m", "ru", "q")
+    cache.store(key, [1, 2, 3], [3, 1])
+
+    assert cache.lookup(key, [1, 2, 3]) == [3, 1]
+    assert cache.lookup(key, [3, 2, 1]) == [3, 1]  # тот же набор, другой порядок — частичное совпадение
+    assert cache.stats()["exact_hits"] == 1
+
+
+def test_partial_reuse_after_exclusions():
+    cache = RerankCache(min_coverage=0.75)
+    key = RerankCache.key("m", "ru", "q")
+    cache.store(key, [1, 2, 3, 4, 5], [5, 4, 3, 2, 1])
+
+    # Пользователь исключил 4, снизу подтянулся 6: известны 4 из 5 кандидатов
+    assert cache.lookup(key, [1, 2, 3, 5, 6]) == [5, 3, 2, 1]
+    # Известна только половина — спрашиваем модель
+    assert cache.lookup(key, [1, 2, 7, 8]) is None
+    assert cache.stats()["partial_hits"] == 1
+
+
+def test_variants_per_key_are_bounded():
+    cache = RerankCache(variants=2)
+    key = RerankCache.key("m", "ru", "q")
+    for first in (1, 10, 20):
+        cache.store(key, [first, first + 1], [first + 1, first])
+
+    assert cache.lookup(key, [1, 2]) is None
+    assert cache.lookup(key, [20, 21]) == [21, 20]
+
+
+def test_empty_permutation_not_stored():
+    cache = RerankCache()
+    key = RerankCache.key("m", "ru", "q")
+    cache.store(key, [1, 2], [])
+    assert cache.lookup(key, [1, 2]) is None
@@ -0,0 +1,69 @@
+"""Tests for the local (embedding + keyword) reranker and the LLM rerank load counter."""
+import asyncio
+import numpy as np
+import pytest
+
+from unittest.mock import AsyncMock
+
+from clients.rerank import LocalReranker, RerankLoad
+from clients.rerank.local import keyword_overlap, local_scores
+
+
+def _movies(*kp_ids, **texts):
+    return [{"kp_id": kp_id, "page_content": texts.get(f"m{kp_id}", "")} for kp_id in kp_ids]
+
+
+def test_keyword_overlap_matches_inflected_words():
+    movies = [
+        {"kp_id": 1, "page_content": "Экипаж летит в далёком космосе", "keywords": []},
+        {"kp_id": 2, "page_content": "Комедия о свадьбе", "keywords": ["космос"]},
+        {"kp_id": 3, "page_content": "Детектив", "keywords": None},
+    ]
+    overlap = keyword_overlap("про космос", movies)
+
+    assert overlap.tolist() == [1.0, 1.0, 0.0]  # "про" короче 4 символов и не учитывается
+
+
+def test_local_scores_unknown_vectors_rank_last():
+    movie_vectors = np.array([[0.0, 1.0], [np.nan, np.nan], [1.0, 0.0]], dtype=np.float32)
+    scores = local_scores(np.array([1.0, 0.0]), movie_vectors, np.zeros(3, dtype=np.float32), keyword_weight=0.0)
+
+    assert scores.tolist() == [0.0, 0.0, 1.0]
+
+
+@pytest.mark.asyncio
+async def test_rank_combines_vectors_and_keywords():
+    vectors = {1: np.array([0.0, 1.0]), 2: np.array([1.0, 0.0]), 3: np.array([0.7, 0.7])}
+    reranker = LocalReranker(
+        embed=AsyncMock(return_value=[1.0, 0.0]),
+        vectors=AsyncMock(return_value=vectors),
+        keyword_weight=0.45,
+    )
+    movies = _movies(1, 2, 3, m1="фильм про космос")
+
+    ranked = await reranker.rank("космос", movies)
+
+    # 2: близость 1.0 (0.55); 1: только слова (0.45); 3: близость ~0.7 (0.39)
+    assert [m["kp_id"] for m in ranked] == [2, 1, 3]
+
+
+@pytest.mark.asyncio
+async def test_rank_falls_back_to_keywords_when_vectors_are_slow():
+    async def slow_embed(text):
+        await asyncio.sleep(10)
+
+    reranker = LocalReranker(embed=slow_embed, vectors=AsyncMock(return_value={}), timeout=0.01)
+    movies = _movies(1, 2, 3, m3="космос")
+
+    ranked = await reranker.rank("космос", movies)
+
+    assert [m["kp_id"] for m in ranked] == [3, 1, 2]
+    assert reranker.stats() == {"calls": 1, "failures": 1}
+
+
+def test_rerank_load_sheds_over_limit():
+    load = RerankLoad(max_in_flight=1)
+    with load.track():
+        assert load.overloaded()
+    assert not load.overloaded()
+    assert load.stats() == {"in_flight": 0, "max_in_flight": 1, "started": 1, "shed": 1}
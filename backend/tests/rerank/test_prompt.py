@@ -0,0 +1,76 @@
+"""Tests for the token-budgeted rerank prompt builder."""
+from clients.rerank import RerankPromptBuilder
+from clients.rerank.prompt import candidate_line
+
+TEMPLATE = "{query}{exclude_instruction}{criteria_context}\n{movies_count}:\n{movies_list}"
+
+
+def _movies(count, content="x" * 300):
+    return [{"kp_id": i, "name": f"Фильм {i}", "title": f"Movie {i}", "page_content": content} for i in range(count)]
+
+
+def _builder(budget, **kwargs):
+    # Один токен на символ — так бюджет легко считать руками
+    return RerankPromptBuilder(token_budget=budget, count_tokens=len, snippet_lengths=(200, 60), **kwargs)
+
+
+def _build(builder, movies, **kwargs):
+    return builder.build(TEMPLATE, movies, query="q", exclude_instruction="", criteria_context="", **kwargs)
+
+
+def test_candidate_line_collapses_whitespace_and_truncates():
+    movie = {"name": "Матрица", "title": "The Matrix", "page_content": "Хакер  Нео\nузнаёт правду"}
+
+    assert candidate_line(movie, "ru", 10) == "[Матрица] Хакер Нео"
+    assert candidate_line(movie, "en", 0) == "[The Matrix]"
+
+
+def test_all_candidates_with_full_snippets_when_budget_allows():
+    prompt = _build(_builder(10_000), _movies(5))
+
+    assert len(prompt.movies) == 5
+    assert prompt.snippet_length == 200
+    assert prompt.dropped == 0
+    assert "5:\n1. [Фильм 0] " in prompt.prompt
+
+
+def test_shorter_snippets_before_dropping_candidates():
+    # ~214 токенов на строку с описанием 200 и ~74 с описанием 60
+    prompt = _build(_builder(400), _movies(5))
+
+    assert (len(prompt.movies), prompt.snippet_length) == (5, 60)
+    assert prompt.tokens <= 400
+
+
+def test_candidates_dropped_from_the_end_down_to_minimum():
+    builder = _builder(200, min_candidates=1)
+    prompt = _build(builder, _movies(5))
+
+    assert [m["kp_id"] for m in prompt.movies] == [0, 1]
+    assert prompt.dropped == 3
+    assert "2:\n" in prompt.prompt
+    assert builder.stats()["truncated"] == 1
+
+    floor = _build(_builder(10, min_candidates=3), _movies(5))
+    assert len(floor.movies) == 3
+
+
+def test_max_candidates_and_cached_summaries():
+    builder = _builder(10_000)
+    _build(builder, _movies(50), max_candidates=30)
+    prompt = _build(builder, _movies(50), max_candidates=30)
+
+    assert len(prompt.movies) == 30
+    assert builder.summaries.stats()["hits"] == 30
+
+
+def test_observe_prefers_reported_usage():
+    builder = _builder(10_000)
+    prompt = _build(builder, _movies(2))
+    builder.observe(prompt, 0.5, prompt_tokens=100)
+    builder.observe(prompt, 1.5)
+
+    stats = builder.stats()
+    assert stats["calls"] == 2
+    assert stats["avg_prompt_tokens"] == (100 + prompt.tokens) / 2
+    assert stats["avg_latency"] == 1.0
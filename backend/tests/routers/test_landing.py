@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+
+from unittest.mock import AsyncMock, MagicMock
+
+from routers import landing
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_reranks_call_openai_once():
+    async def create(**kwargs):
+        await asyncio.sleep(0.01)
+        response = MagicMock()
+        response.choices = [MagicMock(message=MagicMock(content="2\n1"))]
+        return response
+
+    openai_client = MagicMock()
+    openai_client.chat.completions.create = AsyncMock(side_effect=create)
+    movies = [{"kp_id": 1, "name": "A"}, {"kp_id": 2, "name": "B"}]
+
+    results = await asyncio.gather(*(
+        landing._rerank_movies(openai_client, "фильмы похожие на X", movies, source_movie_name="X")
+        for _ in range(3)
+    ))
+
+    assert openai_client.chat.completions.create.await_count == 1
+    assert all([m["kp_id"] for m in result] == [2, 1] for result in results)
+
+
+@pytest.mark.asyncio
+async def test_rerank_reuses_cached_permutation():
+    from clients.rerank import RerankCache
+
+    response = MagicMock()
+    response.choices = [MagicMock(message=MagicMock(content="3\n1"))]
+    openai_client = MagicMock()
+    openai_client.chat.completions.create = AsyncMock(return_value=response)
+    cache = RerankCache()
+    movies = [{"kp_id": i, "name": str(i)} for i in (1, 2, 3)]
+
+    first = await landing._rerank_movies(openai_client, "movies similar to X", movies, "en", "X", cache=cache)
+    second = await landing._rerank_movies(openai_client, "movies similar to X", movies, "en", "X", cache=cache)
+
+    assert openai_client.chat.completions.create.await_count == 1
+    assert [m["kp_id"] for m in first] == [m["kp_id"] for m in second] == [3, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_rerank_timeout_returns_local_order():
+    openai_client = MagicMock()
+    openai_client.chat.completions.create = AsyncMock(side_effect=TimeoutError())
+    local_reranker = MagicMock()
+    local_reranker.rank = AsyncMock(side_effect=lambda query, movies: list(reversed(movies)))
+    movies = [{"kp_id": i, "name": str(i)} for i in (1, 2, 3)]
+
+    result = await landing._rerank_movies(
+        openai_client, "movies similar to Y", movies, "en", "Y", local_reranker=local_reranker
+    )
+
+    assert [m["kp_id"] for m in result] == [3, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_rerank_prompt_capped_and_rest_appended():
+    from unittest.mock import patch
+    from clients.rerank import RerankPromptBuilder
+
+    response = MagicMock()
+    response.choices = [MagicMock(message=MagicMock(content="2\n1"))]
+    response.usage.prompt_tokens = 321
+    openai_client = MagicMock()
+    openai_client.chat.completions.create = AsyncMock(return_value=response)
+    prompts = RerankPromptBuilder()
+    movies = [{"kp_id": i, "name": f"Фильм {i}", "page_content": "описание"} for i in range(1, 6)]
+
+    with patch("routers.landing.RERANK_LANDING_MAX_CANDIDATES", 3):
+        result = await landing._rerank_movies(openai_client, "фильмы похожие на Z", movies, prompts=prompts)
+
+    prompt = openai_client.chat.completions.create.call_args.kwargs["messages"][1]["content"]
+    assert "[Фильм 3]" in prompt and "[Фильм 4]" not in prompt
+    assert [m["kp_id"] for m in result] == [2, 1, 3, 4, 5]
+    assert prompts.stats()["avg_prompt_tokens"] == 321
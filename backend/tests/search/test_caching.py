@@ -0,0 +1,181 @@
+"""Tests for in-process caches of the recommender: LRUCache, EmbeddingCache, AtmosphereEmbeddingTable."""
+import pytest
+import numpy as np
+
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from clients.search.caching import LRUCache
+from clients.search.embeddings import EmbeddingCache, AtmosphereEmbeddingTable
+
+
+# ── LRUCache ───────────────────────────────────────────────────────────
+
+class TestLRUCache:
+    def test_get_set(self):
+        cache = LRUCache(name="test", max_entries=10)
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        assert cache.get("missing") is None
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(name="test", max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")  # "b" становится самым старым
+        cache.set("c", 3)
+        assert "a" in cache
+        assert "b" not in cache
+        assert cache.stats()["evictions"] == 1
+
+    def test_ttl_expiration(self):
+        cache = LRUCache(name="test", max_entries=10, ttl=60)
+        with patch("clients.search.caching.time.time", return_value=1000.0):
+            cache.set("a", 1)
+        with patch("clients.search.caching.time.time", return_value=1061.0):
+            assert cache.get("a") is None
+        assert cache.stats()["expirations"] == 1
+
+    def test_max_bytes(self):
+        cache = LRUCache(name="test", max_entries=100, max_bytes=100, sizeof=lambda v: 40)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.set("c", 3)
+        assert len(cache) == 2
+        assert "a" not in cache
+
+    def test_version_change_clears(self):
+        cache = LRUCache(name="test", max_entries=10)
+        cache.set_version(1)
+        cache.set("a", 1)
+        assert cache.set_version(1) is False
+        assert cache.get("a") == 1
+        assert cache.set_version(2) is True
+        assert cache.get("a") is None
+
+    def test_hit_rate(self):
+        cache = LRUCache(name="test", max_entries=10)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_peek_does_not_touch_stats_or_order(self):
+        cache = LRUCache(name="test", max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.peek("a") == 1
+        assert cache.peek("missing", 0) == 0
+        cache.set("c", 3)
+        assert "a" not in cache
+        assert cache.stats()["hits"] == 0 and cache.stats()["misses"] == 0
+
+
+# ── EmbeddingCache ─────────────────────────────────────────────────────
+
+def _embedding_response(vector):
+    resp = MagicMock()
+    resp.data = [MagicMock(embedding=vector)]
+    return resp
+
+
+class TestEmbeddingCache:
+    @pytest.mark.asyncio
+    async def test_second_call_hits_cache(self):
+        openai_client = MagicMock()
+        openai_client.embeddings.create = AsyncMock(return_value=_embedding_response([0.1, 0.2]))
+        cache = EmbeddingCache(openai_client=openai_client, model_name="m")
+
+        first = await cache.embed("Мрачный  Триллер")
+        second = await cache.embed("мрачный триллер")
+
+        assert openai_client.embeddings.create.await_count == 1
+        assert np.allclose(first, second)
+        assert cache.stats()["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_key_includes_model(self):
+        openai_client = MagicMock()
+        openai_client.embeddings.create = AsyncMock(return_value=_embedding_response([0.1, 0.2]))
+        cache_a = EmbeddingCache(openai_client=openai_client, model_name="a")
+        cache_a.put("query", [1.0, 0.0])
+        assert cache_a.get("query") is not None
+        cache_b = EmbeddingCache(openai_client=openai_client, model_name="b")
+        assert cache_b._key("query") != cache_a._key("query")
+
+    def test_snapshot_roundtrip(self, tmp_path):
+        path = str(tmp_path / "emb.npz")
+        cache = EmbeddingCache(openai_client=MagicMock(), model_name="m", snapshot_path=path)
+        cache.put("про любовь", [0.5, 0.25])
+        assert cache.save_snapshot() == 1
+
+        restored = EmbeddingCache(openai_client=MagicMock(), model_name="m", snapshot_path=path)
+        assert restored.load_snapshot() == 1
+        assert np.allclose(restored.get("про любовь"), [0.5, 0.25])
+
+    def test_snapshot_skips_other_model(self, tmp_path):
+        path = str(tmp_path / "emb.npz")
+        cache = EmbeddingCache(openai_client=MagicMock(), model_name="m1", snapshot_path=path)
+        cache.put("query", [0.5, 0.25])
+        cache.save_snapshot()
+
+        restored = EmbeddingCache(openai_client=MagicMock(), model_name="m2", snapshot_path=path)
+        assert restored.load_snapshot() == 0
+
+
+# ── AtmosphereEmbeddingTable ──────────────────────────────────────────
+
+def _batch_embedding_response(vectors):
+    resp = MagicMock()
+    resp.data = [MagicMock(embedding=v, index=i) for i, v in enumerate(vectors)]
+    return resp
+
+
+class TestAtmosphereEmbeddingTable:
+    MAPPING = {"про любовь": "text a", "мрачный": "text b"}
+
+    def _table(self, tmp_path, openai_client):
+        cache = EmbeddingCache(openai_client=openai_client, model_name="m")
+        return AtmosphereEmbeddingTable(cache, mapping=self.MAPPING, path=str(tmp_path / "atm.npz"))
+
+    @pytest.mark.asyncio
+    async def test_build_then_load_from_file(self, tmp_path):
+        openai_client = MagicMock()
+        openai_client.embeddings.create = AsyncMock(
+            return_value=_batch_embedding_response([[1.0, 0.0], [0.0, 1.0]])
+        )
+        table = self._table(tmp_path, openai_client)
+        assert await table.load_or_build() == 2
+        assert openai_client.embeddings.create.await_count == 1
+
+        reloaded = self._table(tmp_path, openai_client)
+        assert await reloaded.load_or_build() == 2
+        assert openai_client.embeddings.create.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_single_phrase_goes_to_embedding_cache(self, tmp_path):
+        openai_client = MagicMock()
+        openai_client.embeddings.create = AsyncMock(
+            return_value=_batch_embedding_response([[1.0, 0.0], [0.0, 1.0]])
+        )
+        table = self._table(tmp_path, openai_client)
+        await table.load_or_build()
+        assert table.embedding_cache.get("text a") is not None
+
+    @pytest.mark.asyncio
+    async def test_compose_averages_and_normalizes(self, tmp_path):
+        openai_client = MagicMock()
+        openai_client.embeddings.create = AsyncMock(
+            return_value=_batch_embedding_response([[2.0, 0.0], [0.0, 3.0]])
+        )
+        table = self._table(tmp_path, openai_client)
+        await table.load_or_build()
+        composed = table.compose(["про любовь", "мрачный"])
+        assert np.allclose(composed, [2 ** -0.5, 2 ** -0.5])
+
+    def test_compose_unknown_atmosphere_returns_none(self, tmp_path):
+        table = self._table(tmp_path, MagicMock())
+        assert table.compose(["про любовь"]) is None
+        assert table.compose(None) is None
@@ -0,0 +1,44 @@
+"""Tests for the columnar candidate batch."""
+import numpy as np
+
+from unittest.mock import MagicMock
+
+from clients.search.candidates import CandidateBatch
+
+
+def _obj(kp_id, popularity=None, genres=None, distance=None):
+    obj = MagicMock()
+    obj.properties = {"kp_id": kp_id, "popularity_score": popularity, "genres": genres or []}
+    obj.metadata.distance = distance
+    return obj
+
+
+def test_from_objects_builds_columns_and_skips_excluded():
+    batch, excluded = CandidateBatch.from_objects(
+        [_obj(1, 5.0, distance=0.1), _obj(2, 7.0), _obj(3, None, distance=0.3), _obj(None)],
+        exclude_kp_ids={2},
+    )
+
+    assert excluded == 1
+    assert batch.kp_id_list() == [1, 3]
+    assert batch.popularity.tolist() == [5.0, 0.0]
+    assert batch.distances[0] == 0.1 and batch.distances[1] == 0.3
+
+
+def test_missing_distance_is_nan():
+    batch, _ = CandidateBatch.from_objects([_obj(1, 5.0)])
+
+    assert np.isnan(batch.distances[0])
+
+
+def test_genre_conflicts_and_take():
+    batch, _ = CandidateBatch.from_objects([
+        _obj(1, genres=["аниме", "мультфильм"]),
+        _obj(2, genres=["мультфильм"]),
+        _obj(3, genres=["аниме"]),
+    ])
+
+    assert batch.genre_conflicts(["мультфильм"]).tolist() == [True, False, False]
+    assert batch.genre_conflicts(["аниме"]).tolist() == [False, False, False]
+    assert batch.take(np.array([2, 0])).kp_id_list() == [3, 1]
+    assert len(batch.take(np.array([], dtype=np.intp))) == 0
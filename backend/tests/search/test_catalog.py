@@ -0,0 +1,172 @@
+"""Tests for single-pass catalog indexes."""
+import pytest
+
+from collections import Counter
+
+from unittest.mock import MagicMock
+
+from clients.search.catalog import CatalogIndex, KpIdIndex, TitleIndex, compact_title, normalize_title, scan_catalog
+
+
+def _obj(uuid, **props):
+    obj = MagicMock()
+    obj.uuid = uuid
+    obj.properties = props
+    return obj
+
+
+def _collection(objects, fail_after=None):
+    collection = MagicMock()
+    calls = []
+
+    async def iterator(**kwargs):
+        calls.append(kwargs)
+        for i, obj in enumerate(objects):
+            if fail_after is not None and i >= fail_after:
+                raise RuntimeError("connection lost")
+            yield obj
+
+    collection.iterator = iterator
+    collection.calls = calls
+    return collection
+
+
+@pytest.mark.asyncio
+async def test_scan_fills_kp_id_index():
+    index = KpIdIndex()
+    collection = _collection([
+        _obj("u1", kp_id=1, genres=["драма"]),
+        _obj("u2", kp_id=2, genres=["аниме", "мультфильм"]),
+        _obj("u3", kp_id=None),
+    ])
+
+    assert await scan_catalog(collection, [index]) == 3
+
+    assert len(index) == 2
+    assert index.get_uuid(1) == "u1"
+    assert index.has_anime(2) is True
+    assert index.has_anime(1) is False
+    assert index.get_uuid(3) is None
+    assert collection.calls[0]["return_properties"] == ["genres", "kp_id"]
+
+
+@pytest.mark.asyncio
+async def test_failed_rescan_keeps_previous_version():
+    index = KpIdIndex()
+    await scan_catalog(_collection([_obj("u1", kp_id=1)]), [index])
+
+    with pytest.raises(RuntimeError):
+        await scan_catalog(_collection([_obj("u9", kp_id=9), _obj("u8", kp_id=8)], fail_after=1), [index])
+
+    assert index.get_uuid(1) == "u1"
+    assert index.get_uuid(9) is None
+
+
+def test_remember_and_discard():
+    index = KpIdIndex()
+    index.remember(5, "u5", ["аниме"])
+    assert index.get_uuid(5) == "u5"
+    assert index.has_anime(5) is True
+
+    index.discard(5)
+    assert index.get_uuid(5) is None
+    assert index.stats()["misses"] == 1
+
+
+# ── TitleIndex ───────────────────────────────────────────────────────
+
+def _title_index(*rows):
+    index = TitleIndex()
+    index.reset()
+    for kp_id, name, title, popularity in rows:
+        index.add(f"u{kp_id}", {"kp_id": kp_id, "name": name, "title": title, "popularity_score": popularity})
+    index.finalize()
+    return index
+
+
+def test_title_normalization():
+    assert normalize_title("  Ёлки:  Новые! ") == "елки новые"
+    assert compact_title("Матрица") == "matrica"
+    assert compact_title("the-matrix") == compact_title("The Matrix") == "thematrix"
+
+
+def test_exact_match_prefers_locale_field_and_popularity():
+    index = _title_index(
+        (1, "Матрица", "The Matrix", 0.9),
+        (2, "Дюна", "Dune", 0.5),
+        (3, "Дюна", "Dune", 0.8),
+    )
+
+    assert index.lookup("the matrix", "en") == [1]
+    assert index.lookup("дюна", "ru") == [3, 2]
+    assert index.lookup("Матрица", "en") == [1]
+    assert index.stats()["hits"]["exact"] == 3
+
+
+def test_slug_and_transliteration():
+    index = _title_index((1, "Матрица", "The Matrix", 0.9), (2, "Начало", "Inception", 0.8))
+
+    assert index.lookup("matrica", "ru") == [1]
+    assert index.lookup("nachalo", "en") == [2]
+    assert index.lookup("the-matrix", "en") == [1]
+    assert index.stats()["hits"]["compact"] == 2
+
+
+def test_typo_tolerance_and_ambiguity():
+    index = _title_index(
+        (1, "Интерстеллар", "Interstellar", 0.9),
+        (2, "Пила", "Saw", 0.5),
+        (3, "Форсаж 7", "Furious 7", 0.4),
+        (4, "Форсаж 8", "Furious 8", 0.4),
+    )
+
+    assert index.lookup("Interstelar", "en") == [1]
+    assert index.lookup("Furious 9", "en") is None  # одинаково близко к 7 и 8
+    assert index.lookup("Completely different", "en") is None
+    assert index.lookup("Sav", "en") is None  # короткие названия не правим
+
+
+def test_fuzzy_skips_common_trigrams(monkeypatch):
+    index = _title_index(
+        (1, "Интерстеллар", "Interstellar", 0.9),
+        *((kp_id, f"Фильм {kp_id}", f"The Movie {kp_id}", 0.1) for kp_id in range(10, 40)),
+    )
+    index.max_postings = 10
+    counted = []
+
+    class RecordingCounter(Counter):
+        def update(self, key_ids=None, **kwargs):
+            if key_ids is not None:
+                counted.append(len(key_ids))
+            super().update(key_ids, **kwargs)
+
+    monkeypatch.setattr("clients.search.catalog.Counter", RecordingCounter)
+
+    assert index.lookup("Interstelar", "en") == [1]
+    # "#th", "the", "mov" встречаются в 30 названиях и в подсчёт не попадают
+    assert index.lookup("The Movie Star", "en") is None
+    assert counted and max(counted) <= 10
+
+
+@pytest.mark.asyncio
+async def test_scan_fills_title_index_alongside_kp_id_index():
+    kp_index, title_index = KpIdIndex(), TitleIndex()
+    collection = _collection([_obj("u1", kp_id=1, name="Матрица", title="The Matrix", genres=[])])
+
+    await scan_catalog(collection, [kp_index, title_index])
+
+    assert len(collection.calls) == 1
+    assert title_index.lookup("The Matrix", "en") == [1]
+    assert kp_index.get_uuid(1) == "u1"
+
+
+def test_index_without_finalize_fails_on_creation():
+    class Incomplete(CatalogIndex):
+        def reset(self):
+            pass
+
+        def add(self, uuid, props):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,80 @@
+"""Tests for catalog facet counts and FilterSpec."""
+import pytest
+
+from clients.search.facets import FacetIndex
+from clients.search.filters import FilterSpec
+
+
+def _facets(*movies):
+    index = FacetIndex()
+    index.reset()
+    for props in movies:
+        index.add(None, props)
+    index.finalize()
+    return index
+
+
+@pytest.fixture
+def facets():
+    return _facets(
+        {"year": 1999, "rating_kp": 8.5, "rating_imdb": 8.7, "genres": ["фантастика", "боевик"],
+         "genres_tmdb": ["Science Fiction", "Action"], "cast": ["Keanu Reeves"], "directors": ["Lana Wachowski"]},
+        {"year": 2014, "rating_kp": 8.6, "rating_imdb": 8.7, "genres": ["фантастика", "драма"],
+         "genres_tmdb": ["Science Fiction", "Drama"], "cast": ["Matthew McConaughey"]},
+        {"year": 2014, "rating_kp": 6.0, "rating_imdb": None, "genres": ["драма"]},
+        {"year": None, "rating_kp": 9.0, "rating_imdb": 9.0, "genres": ["драма"]},
+    )
+
+
+def test_not_loaded_returns_none():
+    assert FacetIndex().count(FilterSpec()) is None
+
+
+def test_counts_years_ratings_and_genre_intersections(facets):
+    # Пустой год или рейтинг не проходит фильтр, как и в Weaviate
+    assert facets.count(FilterSpec(end_year=2030)) == (2, True)
+    assert facets.count(FilterSpec(end_year=2030, rating_imdb=-1.0)) == (2, True)
+    assert facets.count(FilterSpec(start_year=2000, end_year=2030)) == (1, True)
+    assert facets.count(FilterSpec(end_year=2030, rating_kp=8.55)) == (1, True)
+    assert facets.count(FilterSpec(genres=("фантастика", "драма"), end_year=2030)) == (1, True)
+    assert facets.count(FilterSpec(genres=("фантастика",), end_year=2030)) == (2, True)
+    assert facets.count(FilterSpec(genres=("мюзикл",), end_year=2030)) == (0, True)
+    assert facets.count(FilterSpec(genres=("Drama",), genre_prop="genres_tmdb", end_year=2030)) == (1, True)
+    assert facets.genre_count("драма") == 3
+
+
+def test_cast_and_directors_give_upper_bound(facets):
+    assert facets.count(FilterSpec(end_year=2030, cast=("Keanu Reeves",))) == (1, False)
+    assert facets.count(FilterSpec(end_year=2030, directors=("Nobody",))) == (0, False)
+
+
+def test_filter_spec_builds_weaviate_filter():
+    spec = FilterSpec.create(2000, 2020, 7.0, 6.0, genres=["Drama", "Comedy"], locale="en", cast=["Tom Hanks"])
+
+    assert spec.genre_prop == "genres_tmdb"
+    assert spec.genre_filter().operator.name == "CONTAINS_ALL"
+    assert spec.with_genres(["Drama"]).genre_filter().operator.name == "CONTAINS_ANY"
+    assert len(spec.to_filter().filters) >= 2
+    assert hash(spec) == hash(FilterSpec.create(2000, 2020, 7.0, 6.0, ["Drama", "Comedy"], "en", ["Tom Hanks"]))
+
+
+def test_select_ranks_by_popularity_with_exclusions():
+    index = _facets(
+        {"kp_id": 1, "popularity_score": 5.0, "year": 2000, "rating_kp": 7.0, "rating_imdb": 7.0, "genres": ["драма"]},
+        {"kp_id": 2, "popularity_score": 9.0, "year": 2000, "rating_kp": 7.0, "rating_imdb": 7.0, "genres": ["драма"]},
+        {"kp_id": 3, "popularity_score": 7.0, "year": 2000, "rating_kp": 7.0, "rating_imdb": 7.0,
+         "genres": ["драма", "аниме", "мультфильм"]},
+        {"kp_id": 4, "popularity_score": None, "year": 2000, "rating_kp": 7.0, "rating_imdb": 7.0, "genres": ["драма"]},
+        {"kp_id": 5, "popularity_score": 99.0, "year": 1980, "rating_kp": 7.0, "rating_imdb": 7.0, "genres": ["драма"]},
+    )
+    spec = FilterSpec(start_year=1990, end_year=2030, genres=("драма",))
+
+    assert index.select(spec, limit=10) == [2, 3, 1, 4]
+    assert index.select(spec, limit=2, exclude_kp_ids={2}) == [3, 1]
+    # 'аниме' + 'мультфильм' отсекается только при выбранных жанрах, как в _search_movies
+    assert index.select(spec, limit=10, selected_genres=["драма"]) == [2, 1, 4]
+
+
+def test_select_declines_cast_filters_and_unloaded_index(facets):
+    assert FacetIndex().select(FilterSpec(), limit=10) is None
+    assert facets.select(FilterSpec(cast=("Keanu Reeves",)), limit=10) is None
@@ -0,0 +1,135 @@
+"""Tests for the precomputed nearest-neighbour table."""
+import time
+import pytest
+import numpy as np
+
+from unittest.mock import patch
+
+from clients.search.neighbours import NeighbourTable, build_neighbour_table
+from clients.search.scoring import FLAG_ANIME, FLAG_CARTOON
+from clients.search.vector_mirror import VectorMirror
+
+
+def _mirror(kp_ids, vectors, popularity, flags=None, build_name="build-1"):
+    mirror = VectorMirror(directory="unused")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    mirror.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    mirror.kp_ids = np.asarray(kp_ids, dtype=np.int64)
+    mirror.popularity = np.asarray(popularity, dtype=np.float32)
+    mirror.flags = np.asarray(flags if flags is not None else [0] * len(kp_ids), dtype=np.uint8)
+    mirror._order = np.argsort(mirror.kp_ids)
+    mirror._sorted_kp_ids = mirror.kp_ids[mirror._order]
+    mirror.meta = {"built_at": 1e12, "dim": vectors.shape[1]}
+    mirror.build_name = build_name
+    return mirror
+
+
+def _random_mirror(n=60, dim=8, seed=0, **kwargs):
+    rng = np.random.default_rng(seed)
+    return _mirror(
+        kp_ids=list(range(100, 100 + n)),
+        vectors=rng.normal(size=(n, dim)),
+        popularity=rng.uniform(0, 10, size=n).round(1),
+        flags=rng.choice([0, 0, 0, FLAG_ANIME | FLAG_CARTOON, FLAG_ANIME], size=n),
+        **kwargs,
+    )
+
+
+def _load(directory):
+    table = NeighbourTable(directory=directory)
+    assert table.load()
+    return table
+
+
+def test_rows_match_online_reranking(tmp_path):
+    mirror = _mirror(
+        kp_ids=[1, 2, 3, 4, 5],
+        vectors=[[1, 0], [0.9, 0.1], [0.8, 0.2], [0.7, 0.3], [0, 1]],
+        popularity=[9, 5, 9, 0, 9],
+        flags=[0, FLAG_ANIME | FLAG_CARTOON, 0, 0, 0],
+    )
+    build_neighbour_table(mirror, directory=str(tmp_path), size=3, candidates=10, penalty_weight=0.15)
+    table = _load(str(tmp_path))
+
+    kp_ids, scores = table.lookup(1, limit=3)
+    # 2 — конфликт аниме/мультфильм, 4 — нулевая популярность
+    assert kp_ids == [3, 5]
+    distance = 1 - mirror.vectors[0] @ mirror.vectors[2]
+    assert scores[0] == pytest.approx(distance * (1 + 0.15 * np.log1p(1.0)), rel=1e-5)
+
+
+def test_lookup_applies_exclusions_and_falls_back_when_row_is_exhausted(tmp_path):
+    mirror = _random_mirror()
+    build_neighbour_table(mirror, directory=str(tmp_path), size=5, candidates=30)
+    table = _load(str(tmp_path))
+
+    kp_ids, _ = table.lookup(100, limit=5)
+    assert len(kp_ids) == 5
+
+    kp_ids_excluded, _ = table.lookup(100, limit=3, exclude_kp_ids={kp_ids[0]})
+    assert kp_ids_excluded == kp_ids[1:4]
+
+    # Строка заполнена, а после исключений соседей меньше limit — нужен онлайн-поиск
+    assert table.lookup(100, limit=5, exclude_kp_ids={kp_ids[0]}) is None
+    assert table.lookup(999, limit=5) is None
+
+
+def test_incremental_rebuild_matches_full_rebuild(tmp_path):
+    old = _random_mirror(seed=1, build_name="build-1")
+    build_neighbour_table(old, directory=str(tmp_path / "incremental"), size=10, candidates=20)
+    previous = _load(str(tmp_path / "incremental"))
+
+    # Меняем вектор одного фильма, популярность другого, удаляем третий и добавляем новый
+    rng = np.random.default_rng(2)
+    vectors = np.array(old.vectors)
+    popularity = np.array(old.popularity)
+    vectors[5] = rng.normal(size=vectors.shape[1])
+    popularity[7] = 9.9
+    keep = np.arange(len(old)) != 11
+    new = _mirror(
+        kp_ids=list(old.kp_ids[keep]) + [500],
+        vectors=np.vstack([vectors[keep], rng.normal(size=(1, vectors.shape[1]))]),
+        popularity=list(popularity[keep]) + [8.0],
+        flags=list(old.flags[keep]) + [0],
+        build_name="build-2",
+    )
+
+    meta = build_neighbour_table(
+        new, directory=str(tmp_path / "incremental"), size=10, candidates=20,
+        previous=previous, previous_mirror=old,
+    )
+    build_neighbour_table(new, directory=str(tmp_path / "full"), size=10, candidates=20)
+
+    incremental = _load(str(tmp_path / "incremental"))
+    full = _load(str(tmp_path / "full"))
+
+    assert 0 < meta["recomputed"] < len(new)
+    assert np.array_equal(incremental.kp_ids, full.kp_ids)
+    assert np.array_equal(incremental.neighbours, full.neighbours)
+    assert np.allclose(incremental.scores, full.scores)
+
+
+def test_unchanged_collection_recomputes_nothing(tmp_path):
+    mirror = _random_mirror(seed=3)
+    build_neighbour_table(mirror, directory=str(tmp_path), size=10, candidates=20)
+    previous = _load(str(tmp_path))
+
+    meta = build_neighbour_table(
+        mirror, directory=str(tmp_path), size=10, candidates=20, previous=previous, previous_mirror=mirror,
+    )
+    assert meta["recomputed"] == 0
+
+
+def test_reload_picks_up_new_build_without_touching_old_table(tmp_path):
+    build_neighbour_table(_random_mirror(n=20), directory=str(tmp_path), size=5, candidates=10)
+    table = _load(str(tmp_path))
+    old_build = table.build_name
+    assert table.reloaded() is None
+
+    with patch("clients.search.neighbours.time.time", return_value=time.time() + 10):
+        build_neighbour_table(_random_mirror(n=30), directory=str(tmp_path), size=5, candidates=10)
+    reloaded = table.reloaded()
+
+    assert reloaded.build_name != old_build
+    assert len(reloaded) == 30
+    assert table.build_name == old_build and len(table) == 20
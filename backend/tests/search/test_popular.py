@@ -0,0 +1,111 @@
+"""Tests for the materialized popular-movies snapshot."""
+import json
+import asyncio
+import pytest
+
+from clients.search.popular import PopularMoviesSnapshot
+
+
+def _loader(movies_by_key, calls):
+    async def loader(locale, min_year, min_rating_kp, fetch_limit):
+        calls.append((locale, min_year, min_rating_kp))
+        await asyncio.sleep(0)
+        return [dict(movie) for movie in movies_by_key.get(locale, [])]
+    return loader
+
+
+def _serializer(movie):
+    return json.dumps({"movie_id": movie["kp_id"]}).encode()
+
+
+class TestPopularMoviesSnapshot:
+    @pytest.mark.asyncio
+    async def test_builds_once_and_serves_from_memory(self):
+        calls = []
+        snapshot = PopularMoviesSnapshot(_loader({"ru": [{"kp_id": 1}, {"kp_id": 2}]}, calls), _serializer)
+
+        entries = await asyncio.gather(*(snapshot.get(("ru", 2025, 7.0)) for _ in range(5)))
+
+        assert calls == [("ru", 2025, 7.0)]
+        assert all(entry is entries[0] for entry in entries)
+        assert entries[0].payloads == [b'{"movie_id": 1}', b'{"movie_id": 2}']
+        assert snapshot.stats()["builds"] == 1
+
+    @pytest.mark.asyncio
+    async def test_select_skips_exclusions_and_applies_limit(self):
+        movies = [{"kp_id": kp_id} for kp_id in range(1, 11)]
+        snapshot = PopularMoviesSnapshot(_loader({"ru": movies}, []), _serializer)
+        entry = await snapshot.get(("ru", 2025, 7.0))
+
+        selected = entry.select(3, exclude_kp_ids={1, 3})
+
+        assert [entry.movies[i]["kp_id"] for i in selected] == [2, 4, 5]
+
+    @pytest.mark.asyncio
+    async def test_rebuilds_expired_snapshot_on_request(self):
+        calls = []
+        snapshot = PopularMoviesSnapshot(_loader({"ru": [{"kp_id": 1}]}, calls), _serializer, max_age=0)
+
+        await snapshot.get(("ru", 2025, 7.0))
+        await asyncio.sleep(0.01)
+        await snapshot.get(("ru", 2025, 7.0))
+
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_refresh_all_rebuilds_active_and_drops_idle_keys(self):
+        calls = []
+        snapshot = PopularMoviesSnapshot(_loader({"ru": [{"kp_id": 1}]}, calls), _serializer)
+        await snapshot.get(("ru", 2025, 7.0))
+        await snapshot.get(("en", 2025, 7.0))
+        snapshot._entries[("en", 2025, 7.0)].last_access = 0
+
+        assert await snapshot.refresh_all() == 1
+        assert calls[-1] == ("ru", 2025, 7.0)
+        assert snapshot.stats()["keys"] == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_refresh_keeps_previous_snapshot(self):
+        movies = {"ru": [{"kp_id": 1}]}
+        snapshot = PopularMoviesSnapshot(_loader(movies, []), _serializer)
+        entry = await snapshot.get(("ru", 2025, 7.0))
+
+        async def broken(*args):
+            raise RuntimeError("weaviate down")
+
+        snapshot.loader = broken
+        assert await snapshot.refresh_all() == 0
+        assert (await snapshot.get(("ru", 2025, 7.0))) is entry
+
+    @pytest.mark.asyncio
+    async def test_non_preset_key_loaded_without_storing(self):
+        calls = []
+        snapshot = PopularMoviesSnapshot(
+            _loader({"ru": [{"kp_id": 1}]}, calls), _serializer, is_preset=lambda key: key[1] == 2025
+        )
+
+        entry = await snapshot.get(("ru", 1990, 7.0))
+        await snapshot.get(("ru", 1990, 7.0))
+
+        assert [movie["kp_id"] for movie in entry.movies] == [1]
+        assert len(calls) == 2
+        assert snapshot.stats()["keys"] == 0
+        assert snapshot.stats()["direct"] == 2
+        assert await snapshot.refresh_all() == 0
+
+    @pytest.mark.asyncio
+    async def test_non_preset_loads_are_shared_and_serialized_lazily(self):
+        calls, serialized = [], []
+        snapshot = PopularMoviesSnapshot(
+            _loader({"ru": [{"kp_id": 1}, {"kp_id": 2}, {"kp_id": 3}]}, calls),
+            lambda movie: serialized.append(movie["kp_id"]) or _serializer(movie),
+            is_preset=lambda key: False,
+        )
+
+        entries = await asyncio.gather(*(snapshot.get(("ru", 1990, 7.0), limit=2) for _ in range(3)))
+        entry = entries[0]
+
+        assert len(calls) == 1
+        assert [entry.payload(i) for i in entry.select(2, exclude_kp_ids={1})] == \
+            [b'{"movie_id": 2}', b'{"movie_id": 3}']
+        assert serialized == [2, 3]
@@ -0,0 +1,990 @@
+"""Tests for MovieWeaviateRecommender paths that talk to Weaviate (collection is mocked)."""
+import json
+import asyncio
+import pytest
+import numpy as np
+
+from unittest.mock import AsyncMock, MagicMock, patch
+from weaviate.classes.query import Filter
+
+from clients.search import NeighbourTable, VectorMirror
+from clients.weaviate_client import MovieWeaviateRecommender
+
+
+def _obj(kp_id, vector=None, distance=None, **props):
+    obj = MagicMock()
+    obj.properties = {"kp_id": kp_id, **props}
+    obj.vector = vector
+    obj.uuid = f"uuid-{kp_id}"
+    obj.metadata.distance = distance
+    return obj
+
+
+def _result(objects):
+    result = MagicMock()
+    result.objects = objects
+    return result
+
+
+@pytest.fixture
+def recommender(tmp_path):
+    weaviate_client = MagicMock()
+    collection = MagicMock()
+    weaviate_client.collections.get.return_value = collection
+    recommender = MovieWeaviateRecommender(
+        weaviate_client=weaviate_client,
+        kp_client=MagicMock(),
+        openai_client=MagicMock(),
+    )
+    recommender.vector_mirror = VectorMirror(directory=str(tmp_path / "vector_mirror"))
+    recommender.neighbour_table = NeighbourTable(directory=str(tmp_path / "neighbours"))
+    return recommender
+
+
+def _mirror(kp_ids, vectors, popularity, flags=None):
+    mirror = VectorMirror(directory="unused")
+    mirror.vectors = np.asarray(vectors, dtype=np.float32)
+    mirror.vectors /= np.linalg.norm(mirror.vectors, axis=1, keepdims=True)
+    mirror.kp_ids = np.asarray(kp_ids, dtype=np.int64)
+    mirror.popularity = np.asarray(popularity, dtype=np.float32)
+    mirror.flags = np.asarray(flags or [0] * len(kp_ids), dtype=np.uint8)
+    mirror._order = np.argsort(mirror.kp_ids)
+    mirror._sorted_kp_ids = mirror.kp_ids[mirror._order]
+    mirror.meta = {"built_at": 1e12, "dim": mirror.vectors.shape[1]}
+    mirror._last_check = 1e12
+    return mirror
+
+
+def _docs_by_kp_id_filter(call_kwargs):
+    """Достаёт kp_id из фильтра (contains_any или equal), с которым вызван fetch_objects."""
+    flt = call_kwargs["filters"]
+    filters = getattr(flt, "filters", None) or [flt]
+    for f in filters:
+        if getattr(f, "target", None) == "kp_id":
+            return list(f.value) if isinstance(f.value, list) else [f.value]
+    raise AssertionError("kp_id filter not found")
+
+
+async def _hydrating_fetch(**kwargs):
+    """fetch_objects, возвращающий документ на каждый запрошенный kp_id."""
+    return _result([_obj(kp_id, genres=[]) for kp_id in _docs_by_kp_id_filter(kwargs)])
+
+
+def _source_lookups(fetch_objects):
+    """Вызовы fetch_objects с kp_id == X (поиск исходного фильма, а не догрузка документов)."""
+    return [
+        call for call in fetch_objects.await_args_list
+        if getattr(call.kwargs["filters"], "operator", None) is not None
+        and call.kwargs["filters"].operator.name == "EQUAL"
+    ]
+
+
+# ── get_movie_vectors_by_kp_ids ───────────────────────────────────────
+
+class TestGetMovieVectors:
+    @pytest.mark.asyncio
+    async def test_single_batched_query_keeps_order(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(return_value=_result([
+            _obj(2, vector={"default": [0.0, 1.0]}),
+            _obj(1, vector=[1.0, 0.0]),
+        ]))
+
+        vectors = await recommender.get_movie_vectors_by_kp_ids([1, 2, 3])
+
+        assert recommender.collection.query.fetch_objects.await_count == 1
+        assert np.allclose(vectors, [[1.0, 0.0], [0.0, 1.0]])
+
+    @pytest.mark.asyncio
+    async def test_second_call_served_from_cache(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(return_value=_result([
+            _obj(1, vector=[1.0, 0.0]),
+        ]))
+
+        await recommender.get_movie_vectors_by_kp_ids([1])
+        vectors = await recommender.get_movie_vectors_by_kp_ids([1])
+
+        assert recommender.collection.query.fetch_objects.await_count == 1
+        assert np.allclose(vectors, [[1.0, 0.0]])
+
+    @pytest.mark.asyncio
+    async def test_error_returns_empty(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=RuntimeError("boom"))
+        assert await recommender.get_movie_vectors_by_kp_ids([1]) == []
+
+
+# ── локальное зеркало векторов ─────────────────────────────────────────
+
+class TestVectorMirrorPaths:
+    @pytest.mark.asyncio
+    async def test_recommend_similar_uses_mirror_and_batched_hydration(self, recommender):
+        recommender.vector_mirror = _mirror(
+            kp_ids=[10, 11, 12, 13, 14],
+            vectors=[[1, 0], [0.9, 0.1], [0.8, 0.2], [0.7, 0.3], [0, 1]],
+            popularity=[9, 5, 9, 0, 9],
+            flags=[0, 3, 0, 0, 0],
+        )
+
+        async def fetch_objects(**kwargs):
+            return _result([_obj(kp_id) for kp_id in _docs_by_kp_id_filter(kwargs)])
+
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=fetch_objects)
+        recommender.collection.query.near_object = AsyncMock()
+
+        movies = await recommender.recommend_similar(source_kp_id=10, exclude_kp_ids={14})
+
+        # 11 — конфликт аниме/мультфильм, 13 — нулевая популярность, 14 — исключён
+        assert [m["kp_id"] for m in movies] == [12]
+        assert movies[0]["adjusted_distance"] >= 0
+        recommender.collection.query.near_object.assert_not_awaited()
+        assert recommender.collection.query.fetch_objects.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_recommend_similar_falls_back_when_mirror_missing(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=_hydrating_fetch)
+        recommender.collection.query.near_object = AsyncMock(return_value=_result([
+            _obj(11, distance=0.1, popularity_score=8.0, genres=[]),
+        ]))
+
+        movies = await recommender.recommend_similar(source_kp_id=10)
+
+        assert [m["kp_id"] for m in movies] == [11]
+        recommender.collection.query.near_object.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_find_similar_by_vector_falls_back_when_filters_exhaust_candidates(self, recommender):
+        recommender.vector_mirror = _mirror(
+            kp_ids=list(range(1, 1101)),
+            vectors=[[1, i / 1100] for i in range(1100)],
+            popularity=[5] * 1100,
+        )
+        async def fetch_objects(**kwargs):
+            # Кандидаты зеркала с фильтром не проходят, догрузка победителей near_vector — проходит
+            if getattr(kwargs["filters"], "filters", None):
+                return _result([])
+            return await _hydrating_fetch(**kwargs)
+
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=fetch_objects)
+        recommender.collection.query.near_vector = AsyncMock(return_value=_result([
+            _obj(5, distance=0.2),
+        ]))
+
+        movies = await recommender.find_similar_by_vector(
+            [1.0, 0.0], limit=10, filters=Filter.by_property("year").greater_or_equal(2000),
+        )
+
+        assert [m["kp_id"] for m in movies] == [5]
+        recommender.collection.query.near_vector.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_filtered_mirror_search_hydrates_only_winners(self, recommender):
+        recommender.vector_mirror = _mirror(
+            kp_ids=list(range(1, 21)),
+            vectors=[[1, i / 20] for i in range(20)],
+            popularity=[5] * 20,
+        )
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=_hydrating_fetch)
+
+        movies = await recommender.find_similar_by_vector(
+            [1.0, 0.0], limit=3, filters=Filter.by_property("year").greater_or_equal(2000),
+        )
+
+        assert [m["kp_id"] for m in movies] == [1, 2, 3]
+        filter_pass, hydration = recommender.collection.query.fetch_objects.await_args_list
+        assert filter_pass.kwargs["return_properties"] == ["kp_id"]
+        assert sorted(_docs_by_kp_id_filter(hydration.kwargs)) == [1, 2, 3]
+
+    @pytest.mark.asyncio
+    async def test_find_similar_by_vector_from_mirror(self, recommender):
+        recommender.vector_mirror = _mirror(
+            kp_ids=[1, 2, 3],
+            vectors=[[0, 1], [1, 0], [1, 1]],
+            popularity=[5, 5, 5],
+        )
+
+        async def fetch_objects(**kwargs):
+            return _result([_obj(kp_id) for kp_id in _docs_by_kp_id_filter(kwargs)])
+
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=fetch_objects)
+        recommender.collection.query.near_vector = AsyncMock()
+
+        movies = await recommender.find_similar_by_vector([1.0, 0.0], limit=2, exclude_kp_ids={2})
+
+        assert [m["kp_id"] for m in movies] == [3, 1]
+        assert movies[0]["distance"] < movies[1]["distance"]
+        recommender.collection.query.near_vector.assert_not_awaited()
+
+
+# ── таблица соседей ──────────────────────────────────────────────────
+
+class TestNeighbourTablePath:
+    @pytest.mark.asyncio
+    async def test_recommend_similar_served_from_table(self, recommender):
+        table = recommender.neighbour_table
+        table.kp_ids = np.array([10], dtype=np.int64)
+        # Строка не заполнена целиком (-1): других подходящих соседей у фильма нет
+        table.neighbours = np.array([[11, 12, 13, -1]], dtype=np.int32)
+        table.scores = np.array([[0.1, 0.2, 0.3, np.inf]], dtype=np.float32)
+        table._order = np.array([0])
+        table._sorted_kp_ids = table.kp_ids
+        table.meta = {"built_at": 1e12, "size": 4, "penalty_weight": 0.15}
+
+        async def fetch_objects(**kwargs):
+            return _result([_obj(kp_id) for kp_id in _docs_by_kp_id_filter(kwargs)])
+
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=fetch_objects)
+        recommender.collection.query.near_object = AsyncMock()
+
+        movies = await recommender.recommend_similar(source_kp_id=10, exclude_kp_ids={12})
+
+        assert [m["kp_id"] for m in movies] == [11, 13]
+        assert movies[0]["adjusted_distance"] == pytest.approx(0.1)
+        recommender.collection.query.near_object.assert_not_awaited()
+
+
+# ── индекс kp_id -> UUID ─────────────────────────────────────────────
+
+class TestKpIdIndexPaths:
+    @pytest.mark.asyncio
+    async def test_recommend_similar_skips_source_lookup_when_uuid_known(self, recommender):
+        recommender.kp_index.remember(10, "uuid-10", ["драма"])
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=_hydrating_fetch)
+        recommender.collection.query.near_object = AsyncMock(return_value=_result([
+            _obj(11, distance=0.1, popularity_score=8.0, genres=["аниме", "мультфильм"]),
+            _obj(12, distance=0.2, popularity_score=8.0, genres=["драма"]),
+        ]))
+
+        movies = await recommender.recommend_similar(source_kp_id=10)
+
+        # Исходный фильм без 'аниме' — конфликт аниме/мультфильм отбрасывается по флагам индекса
+        assert [m["kp_id"] for m in movies] == [12]
+        assert _source_lookups(recommender.collection.query.fetch_objects) == []
+        assert recommender.collection.query.near_object.await_args.kwargs["near_object"] == "uuid-10"
+
+    @pytest.mark.asyncio
+    async def test_recommend_similar_uses_passed_source_movie(self, recommender):
+        recommender.kp_index.remember(10, "uuid-10")
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=_hydrating_fetch)
+        recommender.collection.query.near_object = AsyncMock(return_value=_result([
+            _obj(11, distance=0.1, popularity_score=8.0, genres=["аниме", "мультфильм"]),
+        ]))
+
+        movies = await recommender.recommend_similar(
+            source_kp_id=10, source_movie={"kp_id": 10, "genres": ["аниме"]},
+        )
+
+        assert [m["kp_id"] for m in movies] == [11]
+        assert _source_lookups(recommender.collection.query.fetch_objects) == []
+
+    @pytest.mark.asyncio
+    async def test_stale_uuid_is_resolved_again(self, recommender):
+        recommender.kp_index.remember(10, "stale-uuid")
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=_hydrating_fetch)
+        recommender.collection.query.near_object = AsyncMock(side_effect=[
+            RuntimeError("object not found"),
+            _result([_obj(12, distance=0.2, popularity_score=8.0, genres=[])]),
+        ])
+
+        movies = await recommender.recommend_similar(source_kp_id=10)
+
+        assert [m["kp_id"] for m in movies] == [12]
+        assert recommender.kp_index.get_uuid(10) == "uuid-10"
+
+    @pytest.mark.asyncio
+    async def test_get_movie_by_kp_id_fetches_by_uuid(self, recommender):
+        recommender.kp_index.remember(10, "uuid-10")
+        recommender.collection.query.fetch_object_by_id = AsyncMock(return_value=_obj(10, name="Фильм"))
+        recommender.collection.query.fetch_objects = AsyncMock()
+
+        movie = await recommender.get_movie_by_kp_id(10)
+
+        assert movie["name"] == "Фильм"
+        recommender.collection.query.fetch_objects.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_get_movie_by_kp_id_remembers_uuid_on_miss(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(return_value=_result([_obj(10, genres=[])]))
+
+        await recommender.get_movie_by_kp_id(10)
+
+        assert recommender.kp_index.get_uuid(10) == "uuid-10"
+
+
+# ── исключения фильтром Weaviate ─────────────────────────────────────
+
+def _excluded_ids(flt):
+    """Собирает kp_id из всех contains_none в дереве фильтров."""
+    if flt is None:
+        return []
+    children = getattr(flt, "filters", None)
+    if children:
+        return [kp_id for child in children for kp_id in _excluded_ids(child)]
+    if getattr(flt, "target", None) == "kp_id" and flt.operator.name == "CONTAINS_NONE":
+        return list(flt.value)
+    return []
+
+
+class TestExclusionFilter:
+    def test_chunks_large_exclude_sets(self):
+        with patch("clients.weaviate_client.EXCLUDE_FILTER_CHUNK", 2):
+            flt = MovieWeaviateRecommender._exclusion_filter({5, 1, 3, 4, 2})
+        assert len(flt.filters) == 3
+        assert sorted(_excluded_ids(flt)) == [1, 2, 3, 4, 5]
+
+    def test_no_filter_for_empty_or_huge_sets(self):
+        assert MovieWeaviateRecommender._exclusion_filter(set()) is None
+        with patch("clients.weaviate_client.EXCLUDE_FILTER_MAX_IDS", 2):
+            assert MovieWeaviateRecommender._exclusion_filter({1, 2, 3}) is None
+
+    @pytest.mark.asyncio
+    async def test_find_similar_by_vector_pushes_exclusions_and_keeps_limit(self, recommender):
+        recommender.collection.query.near_vector = AsyncMock(return_value=_result([_obj(5, distance=0.1)]))
+
+        await recommender.find_similar_by_vector([1.0, 0.0], limit=30, exclude_kp_ids=set(range(1000)))
+
+        kwargs = recommender.collection.query.near_vector.await_args.kwargs
+        assert kwargs["limit"] == 30
+        assert len(_excluded_ids(kwargs["filters"])) == 1000
+
+    @pytest.mark.asyncio
+    async def test_find_similar_by_vector_overfetches_without_filter(self, recommender):
+        recommender.collection.query.near_vector = AsyncMock(return_value=_result([]))
+
+        with patch("clients.weaviate_client.EXCLUDE_FILTER_MAX_IDS", 10):
+            await recommender.find_similar_by_vector([1.0, 0.0], limit=30, exclude_kp_ids=set(range(50)))
+
+        kwargs = recommender.collection.query.near_vector.await_args.kwargs
+        assert kwargs["limit"] == 80
+        assert kwargs["filters"] is None
+
+    @pytest.mark.asyncio
+    async def test_search_movies_combines_exclusions_with_filters(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(return_value=_result([]))
+        base = Filter.by_property("year").greater_or_equal(2000)
+
+        await recommender._search_movies(
+            query=None, alpha=0.95, fetch_limit=100, result_limit=50, filters=base, exclude_kp_ids={7, 8},
+        )
+
+        kwargs = recommender.collection.query.fetch_objects.await_args.kwargs
+        assert kwargs["limit"] == 100
+        assert sorted(_excluded_ids(kwargs["filters"])) == [7, 8]
+
+
+# ── двухфазный поиск ─────────────────────────────────────────────────
+
+class TestTwoPhaseRetrieval:
+    @pytest.mark.asyncio
+    async def test_candidates_are_narrow_and_only_winners_are_hydrated(self, recommender):
+        candidates = [
+            _obj(kp_id, popularity_score=float(kp_id % 10), genres=[]) for kp_id in range(1, 201)
+        ]
+        recommender.collection.query.hybrid = AsyncMock(return_value=_result(candidates))
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=_hydrating_fetch)
+
+        movies = await recommender._search_movies(
+            query="космос", alpha=0.95, fetch_limit=1000, result_limit=5, query_vector=[1.0, 0.0],
+        )
+
+        hybrid_kwargs = recommender.collection.query.hybrid.await_args.kwargs
+        assert hybrid_kwargs["return_properties"] == MovieWeaviateRecommender._candidate_properties()
+        hydrate_kwargs = recommender.collection.query.fetch_objects.await_args.kwargs
+        assert len(_docs_by_kp_id_filter(hydrate_kwargs)) == 5
+        assert "page_content" in hydrate_kwargs["return_properties"]
+        assert [m["kp_id"] for m in movies] == [9, 19, 29, 39, 49]
+
+    @pytest.mark.asyncio
+    async def test_single_phase_mode_returns_full_documents(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(return_value=_result([
+            _obj(1, popularity_score=5.0, name="Фильм"),
+        ]))
+
+        movies = await recommender._search_movies(
+            query=None, alpha=0.95, fetch_limit=10, result_limit=5, two_phase=False,
+        )
+
+        assert recommender.collection.query.fetch_objects.await_count == 1
+        assert movies[0]["name"] == "Фильм"
+
+
+# ── кэш документов ───────────────────────────────────────────────────
+
+class TestDocumentCache:
+    @pytest.mark.asyncio
+    async def test_hydration_served_from_cache(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=_hydrating_fetch)
+
+        await recommender.get_movies_by_kp_ids([1, 2])
+        movies = await recommender.get_movies_by_kp_ids([2, 1, 3])
+
+        assert set(movies) == {1, 2, 3}
+        second_call = recommender.collection.query.fetch_objects.await_args_list[1]
+        assert _docs_by_kp_id_filter(second_call.kwargs) == [3]
+        assert recommender.document_cache.stats()["hits"] == 2
+
+    @pytest.mark.asyncio
+    async def test_cached_documents_are_copies(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=_hydrating_fetch)
+
+        movie = (await recommender.get_movies_by_kp_ids([1]))[1]
+        movie["distance"] = 0.5
+
+        assert "distance" not in (await recommender.get_movies_by_kp_ids([1]))[1]
+
+    @pytest.mark.asyncio
+    async def test_get_movie_by_kp_id_uses_cache(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=_hydrating_fetch)
+        await recommender.get_movies_by_kp_ids([1])
+
+        movie = await recommender.get_movie_by_kp_id(1)
+
+        assert movie["kp_id"] == 1
+        assert recommender.collection.query.fetch_objects.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_collection_version_change_invalidates(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=_hydrating_fetch)
+        counts = iter([100, 100, 101])
+
+        async def over_all(total_count=True):
+            result = MagicMock()
+            result.total_count = next(counts)
+            return result
+
+        recommender.collection.aggregate.over_all = over_all
+
+        assert await recommender.refresh_collection_version()
+        await recommender.get_movies_by_kp_ids([1])
+        assert not await recommender.refresh_collection_version()
+        assert 1 in recommender.document_cache
+
+        assert await recommender.refresh_collection_version()
+        assert len(recommender.document_cache) == 0
+
+
+# ── снапшот популярных ───────────────────────────────────────────────
+
+class TestPopularSnapshot:
+    def _popular_objects(self):
+        return [
+            _obj(1, popularity_score=0.5, year=2025, kp_file_path="p1", tmdb_id=11, title="One"),
+            _obj(2, popularity_score=0.9, year=2025, kp_file_path="p2", title="Two"),
+            _obj(3, popularity_score=0.7, year=2025, kp_file_path="", tmdb_id=33),
+            _obj(4, popularity_score=0.1, year=2025, kp_file_path="p4", tmdb_id=44, title="Four"),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_users_share_one_fetch(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(return_value=_result(self._popular_objects()))
+
+        first = await recommender.get_popular_movies(limit=10)
+        second = await recommender.get_popular_movies(limit=1, exclude_kp_ids={2})
+
+        assert [m["kp_id"] for m in first] == [2, 1, 4]
+        assert [m["kp_id"] for m in second] == [1]
+        assert recommender.collection.query.fetch_objects.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_en_locale_requires_tmdb_id(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(return_value=_result(self._popular_objects()))
+
+        movies = await recommender.get_popular_movies(limit=10, locale="en")
+
+        assert [m["kp_id"] for m in movies] == [1, 4]
+
+    @pytest.mark.asyncio
+    async def test_payload_is_serialized_response_list(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(return_value=_result(self._popular_objects()))
+
+        payload = json.loads(await recommender.get_popular_payload(limit=2, exclude_kp_ids={1}))
+
+        assert [m["movie_id"] for m in payload] == [2, 4]
+        assert payload[0]["title"] == "Two"
+        assert payload[0]["poster_url_kp"] == "p2"
+        assert payload[0]["genres_ru"] is None
+
+
+    @pytest.mark.asyncio
+    async def test_non_preset_params_are_not_snapshotted(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(return_value=_result(self._popular_objects()))
+
+        for min_rating_kp in (6.1, 6.2):
+            movies = await recommender.get_popular_movies(limit=10, min_year=2001, min_rating_kp=min_rating_kp)
+            assert [m["kp_id"] for m in movies] == [2, 1, 4]
+        await recommender.get_popular_movies(limit=10, locale="xx")
+
+        stats = recommender.popular_snapshot.stats()
+        assert (stats["keys"], stats["direct"]) == (0, 3)
+        # Как до снапшотов: кандидатов max(limit * 10, 1000), а не POPULAR_SNAPSHOT_FETCH_LIMIT
+        assert recommender.collection.query.fetch_objects.call_args.kwargs["limit"] == 1000
+
+
+# ── suggested_titles ─────────────────────────────────────────────────
+
+class TestSuggestedTitles:
+    @pytest.mark.asyncio
+    async def test_keeps_order_and_dedups(self, recommender):
+        by_title = {"b": [{"kp_id": 2}], "a": [{"kp_id": 1}], "a2": [{"kp_id": 1}], "c": [{"kp_id": 3}]}
+
+        async def find(title, locale, min_score, filters):
+            await asyncio.sleep(0.01 if title == "b" else 0)
+            return by_title.get(title, []) if locale == "en" else []
+
+        recommender.find_movies_by_title = find
+
+        movies = await recommender._resolve_suggested_titles(["b", "a", "missing", "a2", "c"], locale="en")
+
+        assert [m["kp_id"] for m in movies] == [2, 1, 3]
+
+    @pytest.mark.asyncio
+    async def test_lookups_run_concurrently_within_limit(self, recommender):
+        active, peak = 0, 0
+
+        async def find(title, locale, min_score, filters):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return [{"kp_id": int(title)}]
+
+        recommender.find_movies_by_title = find
+
+        with patch("clients.weaviate_client.SUGGESTED_TITLES_CONCURRENCY", 3):
+            movies = await recommender._resolve_suggested_titles([str(i) for i in range(1, 10)], locale="en")
+
+        assert len(movies) == 9
+        assert peak == 3
+
+    @pytest.mark.asyncio
+    async def test_alternate_locale_used_on_miss(self, recommender):
+        calls = []
+
+        async def find(title, locale, min_score, filters):
+            calls.append(locale)
+            return [{"kp_id": 7}] if locale == "ru" else []
+
+        recommender.find_movies_by_title = find
+
+        movies = await recommender._resolve_suggested_titles(["Inception"], locale="en")
+
+        assert [m["kp_id"] for m in movies] == [7]
+        assert calls == ["en", "ru"]
+
+    @pytest.mark.asyncio
+    async def test_races_locales_for_foreign_script_and_prefers_primary(self, recommender):
+        started = []
+
+        async def find(title, locale, min_score, filters):
+            started.append(locale)
+            await asyncio.sleep(0.01 if locale == "en" else 0)
+            return [{"kp_id": 1 if locale == "en" else 2}]
+
+        recommender.find_movies_by_title = find
+
+        movies = await recommender._resolve_suggested_titles(["Начало"], locale="en")
+
+        assert sorted(started) == ["en", "ru"]
+        assert [m["kp_id"] for m in movies] == [1]
+
+    @pytest.mark.asyncio
+    async def test_same_script_title_does_not_race(self, recommender):
+        calls = []
+
+        async def find(title, locale, min_score, filters):
+            calls.append(locale)
+            return [{"kp_id": 1}]
+
+        recommender.find_movies_by_title = find
+
+        await recommender._resolve_suggested_titles(["Inception"], locale="en")
+
+        assert calls == ["en"]
+
+
+# ── индекс названий ──────────────────────────────────────────────────
+
+class TestTitleIndexPath:
+    def _index(self, recommender):
+        recommender.title_index.reset()
+        recommender.title_index.add("u1", {"kp_id": 1, "name": "Матрица", "title": "The Matrix"})
+        recommender.title_index.finalize()
+
+    @pytest.mark.asyncio
+    async def test_indexed_title_skips_bm25(self, recommender):
+        self._index(recommender)
+        recommender.collection.query.bm25 = AsyncMock()
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=_hydrating_fetch)
+
+        movies = await recommender.find_movies_by_title("matrica", locale="ru")
+
+        assert [m["kp_id"] for m in movies] == [1]
+        recommender.collection.query.bm25.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_filtered_out_title_falls_back_to_bm25(self, recommender):
+        self._index(recommender)
+        recommender.collection.query.fetch_objects = AsyncMock(return_value=_result([]))
+        recommender.collection.query.bm25 = AsyncMock(return_value=_result([]))
+
+        movies = await recommender.find_movies_by_title(
+            "The Matrix", locale="en", filters=Filter.by_property("genres").contains_any(["драма"])
+        )
+
+        assert movies == []
+        recommender.collection.query.bm25.assert_awaited_once()
+
+
+# ── векторизованный скоринг ──────────────────────────────────────────
+
+class TestVectorizedScoring:
+    @pytest.mark.asyncio
+    async def test_recommend_similar_ranks_by_adjusted_distance(self, recommender):
+        recommender.kp_index.remember(10, "uuid-10")
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=_hydrating_fetch)
+        recommender.collection.query.near_object = AsyncMock(return_value=_result([
+            _obj(11, distance=0.10, popularity_score=1.0, genres=[]),
+            _obj(12, distance=0.12, popularity_score=9.5, genres=[]),
+            _obj(13, distance=0.05, popularity_score=0.0, genres=[]),
+            _obj(14, distance=0.01, popularity_score=9.0, genres=["аниме", "мультфильм"]),
+        ]))
+
+        movies = await recommender.recommend_similar(source_kp_id=10, source_movie={"kp_id": 10, "genres": []})
+
+        assert [m["kp_id"] for m in movies] == [12, 11]
+        assert movies[0]["adjusted_distance"] < movies[1]["adjusted_distance"]
+
+    @pytest.mark.asyncio
+    async def test_search_movies_keeps_most_popular(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=[
+            _result([_obj(kp_id, popularity_score=float(p), genres=[]) for kp_id, p in [(1, 2), (2, 9), (3, 5), (4, 9)]]),
+        ])
+
+        movies = await recommender._search_movies(
+            query=None, alpha=0.95, fetch_limit=100, result_limit=3, two_phase=False,
+        )
+
+        assert [m["kp_id"] for m in movies] == [2, 4, 3]
+
+
+# ── колоночные кандидаты ─────────────────────────────────────────────
+
+class TestCandidateMaterialization:
+    @pytest.mark.asyncio
+    async def test_full_properties_response_is_not_fetched_again(self, recommender):
+        recommender.collection.query.fetch_objects = AsyncMock(return_value=_result([
+            _obj(kp_id, popularity_score=float(kp_id), genres=[], name=f"Фильм {kp_id}") for kp_id in range(1, 6)
+        ]))
+
+        movies = await recommender._search_movies(
+            query=None, alpha=0.95, fetch_limit=100, result_limit=2, two_phase=False,
+        )
+
+        assert [m["name"] for m in movies] == ["Фильм 5", "Фильм 4"]
+        assert recommender.collection.query.fetch_objects.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_only_selected_candidates_are_hydrated(self, recommender):
+        recommender.collection.query.near_vector = AsyncMock(return_value=_result([
+            _obj(kp_id, distance=kp_id / 100, genres=[]) for kp_id in range(1, 51)
+        ]))
+        recommender.collection.query.fetch_objects = AsyncMock(side_effect=_hydrating_fetch)
+
+        movies = await recommender.find_similar_by_vector([1.0, 0.0], limit=5, exclude_kp_ids={1})
+
+        assert [m["kp_id"] for m in movies] == [2, 3, 4, 5, 6]
+        assert movies[0]["distance"] == pytest.approx(0.02)
+        hydrate_call = recommender.collection.query.fetch_objects.await_args
+        assert sorted(_docs_by_kp_id_filter(hydrate_call.kwargs)) == [2, 3, 4, 5, 6]
+
+
+# ── fallback по главному жанру ───────────────────────────────────────
+
+def _has_operator(flt, name):
+    children = getattr(flt, "filters", None)
+    if children:
+        return any(_has_operator(child, name) for child in children)
+    return getattr(getattr(flt, "operator", None), "name", None) == name
+
+
+class TestGenreFallback:
+    def _search(self, started, primary_count, fallback_count, delay=0.01):
+        async def search_movies(**kwargs):
+            kind = "primary" if _has_operator(kwargs["filters"], "CONTAINS_ALL") else "fallback"
+            started.append(kind)
+            await asyncio.sleep(delay)
+            count = fallback_count if kind == "fallback" else primary_count
+            return [{"kp_id": (1000 if kind == "fallback" else 0) + i} for i in range(count)]
+        return search_movies
+
+    @pytest.mark.asyncio
+    async def test_fallback_runs_in_parallel_and_replaces_narrow_results(self, recommender):
+        started = []
+        recommender._search_movies = self._search(started, primary_count=3, fallback_count=30)
+
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        results = await recommender.recommend(query=None, genres=["драма", "мюзикл"])
+        elapsed = loop.time() - t0
+
+        assert sorted(started) == ["fallback", "primary"]
+        assert results[0]["kp_id"] == 1000
+        assert elapsed < 0.019  # один round trip, а не два
+        assert recommender.genre_fallback_stats == {"predicted": 0, "speculative": 1, "cancelled": 0, "used": 1}
+
+    @pytest.mark.asyncio
+    async def test_speculative_fallback_cancelled_when_enough_results(self, recommender):
+        started = []
+        recommender._search_movies = self._search(started, primary_count=30, fallback_count=30)
+
+        results = await recommender.recommend(query=None, genres=["драма", "комедия"])
+
+        assert len(results) == 30 and results[0]["kp_id"] == 0
+        assert recommender.genre_fallback_stats["cancelled"] == 1
+
+    @pytest.mark.asyncio
+    async def test_history_of_wide_combination_skips_speculation(self, recommender):
+        started = []
+        recommender._search_movies = self._search(started, primary_count=40, fallback_count=30)
+
+        await recommender.recommend(query=None, genres=["драма", "комедия"])
+        started.clear()
+        await recommender.recommend(query=None, genres=["комедия", "драма"])
+
+        assert started == ["primary"]
+        assert recommender.genre_fallback_stats["speculative"] == 1
+
+    @pytest.mark.asyncio
+    async def test_sequential_mode(self, recommender):
+        started = []
+        recommender._search_movies = self._search(started, primary_count=3, fallback_count=30)
+
+        with patch("clients.weaviate_client.GENRE_FALLBACK_SPECULATIVE", False):
+            results = await recommender.recommend(query=None, genres=["драма", "мюзикл"])
+
+        assert started == ["primary", "fallback"]
+        assert results[0]["kp_id"] == 1000
+
+
+# ── фасеты каталога ──────────────────────────────────────────────────
+
+def _load_facets(recommender, movies):
+    recommender.facets.reset()
+    for props in movies:
+        recommender.facets.add(None, props)
+    recommender.facets.finalize()
+
+
+@pytest.fixture
+def remote_browse():
+    """Поиск без текста идёт в Weaviate, а не в локальный каталог (проверяем план запроса)."""
+    with patch("clients.weaviate_client.LOCAL_CATALOG_BROWSE", False):
+        yield
+
+
+@pytest.mark.usefixtures("remote_browse")
+class TestFacetPlanning:
+    @pytest.mark.asyncio
+    async def test_starving_genre_combination_skips_contains_all(self, recommender):
+        _load_facets(recommender, [{"year": 2000, "rating_kp": 7.0, "rating_imdb": 7.0, "genres": ["драма", "мюзикл"]}])
+        started = []
+        recommender._search_movies = TestGenreFallback()._search(started, primary_count=3, fallback_count=30)
+
+        with patch("clients.weaviate_client.FACET_INDEX_SLACK", 0):
+            results = await recommender.recommend(query=None, genres=["драма", "мюзикл"])
+
+        assert started == ["fallback"]
+        assert results[0]["kp_id"] == 1000
+        assert recommender.genre_fallback_stats["predicted"] == 1
+
+    @pytest.mark.asyncio
+    async def test_stale_facet_count_does_not_skip_contains_all(self, recommender):
+        # После скана могли появиться фильмы с этими жанрами — contains_all всё равно запрашивается
+        _load_facets(recommender, [{"year": 2000, "rating_kp": 7.0, "rating_imdb": 7.0, "genres": ["драма", "мюзикл"]}])
+        started = []
+        recommender._search_movies = TestGenreFallback()._search(started, primary_count=12, fallback_count=30)
+
+        results = await recommender.recommend(query=None, genres=["драма", "мюзикл"])
+
+        assert "primary" in started
+        assert len(results) == 12
+        assert recommender.genre_fallback_stats["predicted"] == 0
+
+    @pytest.mark.asyncio
+    async def test_wide_genre_combination_runs_single_query(self, recommender):
+        _load_facets(recommender, [
+            {"year": 2000, "rating_kp": 7.0, "rating_imdb": 7.0, "genres": ["драма", "комедия"]}
+        ] * 100)
+        started = []
+        recommender._search_movies = TestGenreFallback()._search(started, primary_count=30, fallback_count=30)
+
+        await recommender.recommend(query=None, genres=["драма", "комедия"])
+
+        assert started == ["primary"]
+        assert recommender.genre_fallback_stats["speculative"] == 0
+
+    @pytest.mark.asyncio
+    async def test_selective_filter_uses_fetch_objects_instead_of_hybrid(self, recommender):
+        _load_facets(recommender, [{"year": 2000, "rating_kp": 7.0, "rating_imdb": 7.0, "genres": ["вестерн"]}] * 5)
+        recommender.embedding_cache.embed = AsyncMock()
+        recommender.collection.query.hybrid = AsyncMock()
+        recommender.collection.query.fetch_objects = AsyncMock(return_value=_result([]))
+
+        await recommender.recommend(query="ковбои", genres=["вестерн"])
+
+        recommender.collection.query.hybrid.assert_not_awaited()
+        recommender.embedding_cache.embed.assert_not_awaited()
+        assert recommender.collection.query.fetch_objects.await_args.kwargs["limit"] == 5 + 20
+
+    @pytest.mark.asyncio
+    async def test_without_facets_keeps_configured_limits(self, recommender):
+        recommender.embedding_cache.embed = AsyncMock(return_value=[0.1, 0.2])
+        recommender.collection.query.hybrid = AsyncMock(return_value=_result([]))
+
+        await recommender.recommend(query="ковбои", genres=["вестерн"])
+
+        assert recommender.collection.query.hybrid.await_args.kwargs["limit"] == recommender.top_k_hybrid
+
+
+class TestLocalCatalogBrowse:
+    @pytest.mark.asyncio
+    async def test_filter_only_recommend_served_from_catalog(self, recommender):
+        _load_facets(recommender, [
+            {"kp_id": i, "popularity_score": float(i), "year": 2000, "rating_kp": 7.0, "rating_imdb": 7.0,
+             "genres": ["драма"]}
+            for i in range(1, 81)
+        ] + [{"kp_id": 500, "popularity_score": 999.0, "year": 1950, "rating_kp": 7.0, "rating_imdb": 7.0,
+              "genres": ["драма"]}])
+        recommender.collection.query.fetch_objects = AsyncMock(
+            side_effect=lambda **kwargs: _result([_obj(kp_id) for kp_id in range(1, 81)])
+        )
+
+        with patch("clients.weaviate_client.RECOMMEND_CACHE_ENABLED", False):
+            results = await recommender.recommend(
+                query=None, genres=["драма"], start_year=1990, end_year=2010, exclude_kp_ids={80}
+            )
+
+        # Одна догрузка документов по kp_id вместо выборки TOP_K_FETCH объектов
+        assert recommender.collection.query.fetch_objects.await_count == 1
+        assert [movie["kp_id"] for movie in results] == list(range(79, 29, -1))
+        assert recommender.facets.selects == 1
+
+    @pytest.mark.asyncio
+    async def test_cast_filter_goes_to_weaviate(self, recommender):
+        _load_facets(recommender, [
+            {"kp_id": 1, "year": 2000, "rating_kp": 7.0, "rating_imdb": 7.0, "cast": ["Keanu Reeves"]}
+        ] * 100)
+        recommender.collection.query.fetch_objects = AsyncMock(return_value=_result([]))
+
+        await recommender.recommend(query=None, cast=["Keanu Reeves"])
+
+        filters = recommender.collection.query.fetch_objects.await_args.kwargs["filters"]
+        assert _has_operator(filters, "CONTAINS_ANY")
+        assert recommender.facets.selects == 0
+
+
+# ── кэш результатов recommend ────────────────────────────────────────
+
+class TestRecommendCache:
+    @staticmethod
+    def _counting_recommend(recommender, kp_ids):
+        calls = []
+
+        async def _recommend(*args):
+            calls.append(args[6])  # exclude_kp_ids
+            exclude = args[6] or set()
+            limit = args[13] if len(args) > 13 else 50  # result_limit
+            movies = [{"kp_id": kp_id, "combined_score": 1.0 / kp_id} for kp_id in kp_ids if kp_id not in exclude]
+            return movies[:limit]
+
+        recommender._recommend = _recommend
+        return calls
+
+    @pytest.mark.asyncio
+    async def test_same_criteria_share_one_search(self, recommender):
+        calls = self._counting_recommend(recommender, range(1, 51))
+        for kp_id in range(1, 51):
+            recommender.document_cache.set(kp_id, {"kp_id": kp_id})
+
+        first = await recommender.recommend(query="ковбои", genres=["вестерн"], exclude_kp_ids={1})
+        second = await recommender.recommend(query="  ковбои ", genres=["вестерн"], exclude_kp_ids={2, 3})
+
+        assert calls == [None]
+        assert [m["kp_id"] for m in first] == list(range(2, 51))
+        assert [m["kp_id"] for m in second] == [1] + list(range(4, 51))
+        assert second[0]["combined_score"] == 1.0
+        assert recommender.recommend_cache.stats()["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_headroom_fills_results_after_exclusions(self, recommender):
+        calls = self._counting_recommend(recommender, range(1, 201))
+
+        results = await recommender.recommend(query="ковбои", exclude_kp_ids=set(range(1, 41)))
+
+        assert calls == [None]
+        assert [m["kp_id"] for m in results] == list(range(41, 91))
+        assert recommender.recommend_cache.stats()["shortfalls"] == 0
+
+    @pytest.mark.asyncio
+    async def test_exclusions_beyond_headroom_fall_back_to_personal_search(self, recommender):
+        calls = self._counting_recommend(recommender, range(1, 201))
+
+        results = await recommender.recommend(query="ковбои", exclude_kp_ids=set(range(1, 61)))
+
+        # Персональный поиск шёл параллельно с общим
+        assert sorted(calls, key=lambda exclude: len(exclude or ())) == [None, set(range(1, 61))]
+        assert [m["kp_id"] for m in results] == list(range(61, 111))
+        assert recommender.recommend_cache.stats()["shortfalls"] == 1
+
+    @pytest.mark.asyncio
+    async def test_collection_version_change_drops_results(self, recommender):
+        calls = self._counting_recommend(recommender, [1, 2, 3])
+        recommender.collection.aggregate.over_all = AsyncMock(return_value=MagicMock(total_count=10))
+        await recommender.refresh_collection_version()
+
+        await recommender.recommend(query="ковбои")
+        recommender.collection.aggregate.over_all = AsyncMock(return_value=MagicMock(total_count=11))
+        await recommender.refresh_collection_version()
+        await recommender.recommend(query="ковбои")
+
+        assert calls == [None, None]
+
+
+# ── схлопывание одновременных вызовов ────────────────────────────────
+
+class TestSingleFlight:
+    @pytest.mark.asyncio
+    async def test_concurrent_similar_calls_share_one_search(self, recommender):
+        calls = []
+
+        async def _recommend_similar(source_kp_id, penalty_weight, exclude_kp_ids, source_movie):
+            calls.append(source_kp_id)
+            await asyncio.sleep(0.01)
+            return [{"kp_id": 2}]
+
+        recommender._recommend_similar = _recommend_similar
+
+        results = await asyncio.gather(*(recommender.recommend_similar(source_kp_id=1) for _ in range(4)))
+        await recommender.recommend_similar(source_kp_id=1, exclude_kp_ids={2})
+
+        assert calls == [1, 1]
+        assert all(result == [{"kp_id": 2}] for result in results)
+        assert recommender.get_stats()["singleflight"]["shared"] == 3
+
+    @pytest.mark.asyncio
+    async def test_concurrent_cache_misses_share_one_recommend(self, recommender):
+        calls = []
+
+        async def _recommend(*args):
+            calls.append(args[6])
+            await asyncio.sleep(0.01)
+            return [{"kp_id": kp_id} for kp_id in range(1, 51)]
+
+        recommender._recommend = _recommend
+
+        first, second = await asyncio.gather(
+            recommender.recommend(query="ковбои", exclude_kp_ids={1}),
+            recommender.recommend(query="ковбои", exclude_kp_ids={2}),
+        )
+
+        assert calls == [None]
+        assert first[0]["kp_id"] == 2 and second[0]["kp_id"] == 1
@@ -0,0 +1,63 @@
+"""Tests for the shared recommend result cache."""
+import numpy as np
+
+from clients.search.filters import FilterSpec
+from clients.search.result_cache import CachedResult, RecommendResultCache, recommend_cache_key
+
+
+def test_key_normalizes_whitespace_and_name_order():
+    spec = FilterSpec.create(genres=["драма", "комедия"], cast=["B", "A"])
+    same = FilterSpec.create(genres=["драма", "комедия"], cast=["A", "B"])
+
+    assert recommend_cache_key(spec, " про  любовь", None, None, None) == \
+        recommend_cache_key(same, "про любовь ", None, None, None)
+    # Первый жанр — главный для fallback, порядок жанров значим
+    assert recommend_cache_key(spec, None, None, None, None) != \
+        recommend_cache_key(spec.with_genres(["комедия", "драма"]), None, None, None, None)
+    assert recommend_cache_key(spec, "q", None, None, [0.1, 0.2]) != \
+        recommend_cache_key(spec, "q", None, None, [0.1, 0.3])
+
+
+def test_cached_result_keeps_scores_and_drops_exclusions():
+    result = CachedResult.from_movies([
+        {"kp_id": 1, "distance": 0.1},
+        {"kp_id": 2},
+        {"kp_id": 3, "distance": 0.3},
+    ])
+
+    assert list(result.columns) == ["distance"]
+    personal = result.without({2})
+    assert personal.kp_ids.tolist() == [1, 3]
+    assert np.allclose(personal.columns["distance"], [0.1, 0.3])
+
+
+def test_personalize_fills_limit_from_headroom():
+    cache = RecommendResultCache(limit=3, headroom=2, min_results=1)
+    cached = cache.store("key", [{"kp_id": i} for i in range(1, 6)])
+
+    assert cache.personalize(cached, None).kp_ids.tolist() == [1, 2, 3]
+    assert cache.personalize(cached, {1, 2}).kp_ids.tolist() == [3, 4, 5]
+    assert cache.personalize(cached, {1, 2, 3}) is None
+    # Короткий общий список (под фильтр попало мало фильмов) — не нехватка
+    short = cache.store("short", [{"kp_id": 1}, {"kp_id": 2}, {"kp_id": 3}])
+    assert cache.personalize(short, {1}).kp_ids.tolist() == [2, 3]
+    assert cache.stats()["shortfalls"] == 1
+
+
+def test_personalize_reports_drop_below_genre_fallback_threshold():
+    cache = RecommendResultCache(limit=50, headroom=50, min_results=10)
+    narrow = cache.store("narrow", [{"kp_id": i} for i in range(1, 13)])
+
+    assert cache.personalize(narrow, {1, 2}).kp_ids.tolist() == list(range(3, 13))
+    # 7 из 12: до исключений fallback по главному жанру не понадобился, после — нужен
+    assert cache.personalize(narrow, {1, 2, 3, 4, 5}) is None
+    # Общий список и без исключений ниже порога — персональный поиск не даст больше
+    tiny = cache.store("tiny", [{"kp_id": i} for i in range(1, 6)])
+    assert cache.personalize(tiny, {1}).kp_ids.tolist() == [2, 3, 4, 5]
+    assert cache.stats()["shortfalls"] == 1
+
+
+def test_empty_results_not_cached():
+    cache = RecommendResultCache()
+    cache.store("key", [])
+    assert cache.get("key") is None
@@ -0,0 +1,68 @@
+"""Tests for vectorized candidate scoring."""
+import math
+import numpy as np
+
+from clients.search.scoring import (
+    FLAG_ANIME,
+    FLAG_CARTOON,
+    adjusted_distances,
+    column,
+    combined_scores,
+    genre_flags,
+    rank,
+    top_k,
+)
+
+
+def test_genre_flags():
+    assert genre_flags(["аниме", "мультфильм"]) == FLAG_ANIME | FLAG_CARTOON
+    assert genre_flags(["драма"]) == 0
+    assert genre_flags(None) == 0
+
+
+def test_top_k_matches_stable_sort_with_ties():
+    rng = np.random.default_rng(0)
+    scores = rng.integers(0, 5, size=300).astype(float)  # много равных значений
+
+    for k in (1, 7, 50, 299, 300, 400):
+        assert top_k(scores, k).tolist() == np.argsort(scores, kind="stable")[:k].tolist()
+        expected = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+        assert top_k(scores, k, descending=True).tolist() == expected
+
+
+def test_top_k_empty():
+    assert top_k(np.array([]), 5).tolist() == []
+    assert top_k(np.array([1.0, 2.0]), 0).tolist() == []
+
+
+def test_rank_puts_priority_group_first():
+    scores = np.array([0.9, 0.1, 0.5, 0.7, 0.3])
+    priority = np.array([False, True, False, False, True])
+
+    assert rank(scores, 4, descending=True, priority=priority).tolist() == [4, 1, 0, 3]
+    assert rank(scores, 1, descending=True, priority=priority).tolist() == [4]
+
+
+def test_combined_scores_match_scalar_formula():
+    distances = np.array([0.2, 3.0, np.nan])
+    popularity = np.array([5.0, 12.0, 8.0])
+
+    scores = combined_scores(distances, popularity, 0.7)
+
+    assert math.isclose(scores[0], 0.7 * 0.9 + 0.3 * 0.5)
+    assert math.isclose(scores[1], 0.3 * 1.0)
+    assert math.isclose(scores[2], 0.8)
+
+
+def test_adjusted_distances_match_scalar_formula():
+    adjusted = adjusted_distances(np.array([0.4, 0.4]), np.array([2.0, 15.0]), 0.15)
+
+    assert math.isclose(adjusted[0], 0.4 * (1 + 0.15 * math.log1p(8.0)))
+    assert math.isclose(adjusted[1], 0.4)
+
+
+def test_column_replaces_missing_values():
+    movies = [{"popularity_score": 3.0}, {"popularity_score": None}, {}]
+
+    assert column(movies, "popularity_score").tolist() == [3.0, 0.0, 0.0]
+    assert np.isnan(column(movies, "distance", default=np.nan)).all()
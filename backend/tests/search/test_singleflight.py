@@ -0,0 +1,73 @@
+"""Tests for single-flight call coalescing."""
+import asyncio
+import pytest
+
+from clients.search.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_computation():
+    flight = SingleFlight(name="test")
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return [{"kp_id": 1}]
+
+    results = await asyncio.gather(*(flight.run("key", compute) for _ in range(5)))
+
+    assert len(calls) == 1
+    assert all(result == [{"kp_id": 1}] for result in results)
+    # Каждому вызывающему — своя копия
+    results[0][0]["kp_id"] = 2
+    assert results[1][0]["kp_id"] == 1
+    assert flight.stats() == {"name": "test", "in_flight": 0, "leaders": 1, "shared": 4, "dedup_rate": 0.8}
+
+
+@pytest.mark.asyncio
+async def test_finished_call_is_not_reused():
+    flight = SingleFlight(name="test")
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return []
+
+    await flight.run("key", compute)
+    await flight.run("key", compute)
+
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_exception_reaches_every_waiter():
+    flight = SingleFlight(name="test")
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("weaviate down")
+
+    results = await asyncio.gather(*(flight.run("key", compute) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flight.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_cancel_shared_computation():
+    flight = SingleFlight(name="test")
+    started = asyncio.Event()
+
+    async def compute():
+        started.set()
+        await asyncio.sleep(0.01)
+        return [{"kp_id": 1}]
+
+    first = asyncio.create_task(flight.run("key", compute))
+    await started.wait()
+    second = asyncio.create_task(flight.run("key", compute))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == [{"kp_id": 1}]
@@ -0,0 +1,136 @@
+"""Tests for the local vector mirror: build, load, search, staleness."""
+import os
+import time
+import pytest
+import numpy as np
+
+from unittest.mock import MagicMock, patch
+
+from clients.search.scoring import FLAG_ANIME, FLAG_CARTOON
+from clients.search.vector_mirror import VectorMirror, build_vector_mirror
+
+
+def _obj(kp_id, vector, popularity=5.0, genres=None):
+    obj = MagicMock()
+    obj.properties = {"kp_id": kp_id, "popularity_score": popularity, "genres": genres or []}
+    obj.vector = vector
+    return obj
+
+
+def _collection(objects):
+    collection = MagicMock()
+
+    async def over_all(total_count=True):
+        result = MagicMock()
+        result.total_count = len(objects)
+        return result
+
+    async def iterator(**kwargs):
+        for obj in objects:
+            yield obj
+
+    collection.aggregate.over_all = over_all
+    collection.iterator = iterator
+    return collection
+
+
+OBJECTS = [
+    _obj(1, [1.0, 0.0, 0.0], popularity=8.0),
+    _obj(2, {"default": [0.9, 0.1, 0.0]}, popularity=6.0, genres=["аниме", "мультфильм"]),
+    _obj(3, [0.0, 1.0, 0.0], popularity=0.0),
+    _obj(4, [0.0, 0.0, 2.0], popularity=7.0, genres=["мультфильм"]),
+]
+
+
+@pytest.fixture
+async def mirror_dir(tmp_path):
+    await build_vector_mirror(_collection(OBJECTS), directory=str(tmp_path), quantize=True)
+    return str(tmp_path)
+
+
+@pytest.mark.asyncio
+async def test_build_writes_normalized_vectors_and_metadata(mirror_dir):
+    mirror = VectorMirror(directory=mirror_dir)
+    assert mirror.load()
+
+    assert len(mirror) == 4
+    assert mirror.meta["dim"] == 3
+    assert np.allclose(np.linalg.norm(mirror.vectors, axis=1), 1.0)
+    assert list(mirror.kp_ids) == [1, 2, 3, 4]
+    assert mirror.flags[1] == FLAG_ANIME | FLAG_CARTOON
+    assert mirror.popularity[0] == pytest.approx(8.0)
+
+
+@pytest.mark.asyncio
+async def test_search_orders_by_cosine_distance_and_excludes(mirror_dir):
+    mirror = VectorMirror(directory=mirror_dir)
+    mirror.load()
+
+    rows, distances = mirror.search([1.0, 0.0, 0.0], k=3)
+    assert list(mirror.kp_ids[rows]) == [1, 2, 3]
+    assert distances[0] == pytest.approx(0.0, abs=1e-6)
+    assert list(distances) == sorted(distances)
+
+    rows, _ = mirror.search([1.0, 0.0, 0.0], k=2, exclude_kp_ids={1})
+    assert list(mirror.kp_ids[rows]) == [2, 3]
+
+
+@pytest.mark.asyncio
+async def test_quantized_search_matches_float(mirror_dir):
+    float_mirror = VectorMirror(directory=mirror_dir, quantized=False)
+    int8_mirror = VectorMirror(directory=mirror_dir, quantized=True)
+    float_mirror.load()
+    int8_mirror.load()
+    assert int8_mirror.vectors_i8 is not None
+
+    query = [0.5, 0.4, 0.1]
+    float_rows, float_distances = float_mirror.search(query, k=3)
+    int8_rows, int8_distances = int8_mirror.search(query, k=3)
+
+    assert list(int8_rows) == list(float_rows)
+    # После пересчёта по float32 дистанции совпадают точно
+    assert np.allclose(int8_distances, float_distances)
+
+
+@pytest.mark.asyncio
+async def test_rows_of_skips_unknown_ids(mirror_dir):
+    mirror = VectorMirror(directory=mirror_dir)
+    mirror.load()
+
+    assert list(mirror.rows_of([4, 100, 1])) == [3, 0]
+    assert mirror.row_of(100) is None
+    assert mirror.vector(100) is None
+
+
+def test_missing_mirror_is_not_fresh(tmp_path):
+    mirror = VectorMirror(directory=str(tmp_path))
+    assert not mirror.load()
+    assert not mirror.is_fresh()
+
+
+@pytest.mark.asyncio
+async def test_stale_mirror_is_not_fresh(mirror_dir):
+    mirror = VectorMirror(directory=mirror_dir, max_age=60)
+    mirror.load()
+    assert mirror.is_fresh()
+
+    with patch("clients.search.vector_mirror.time.time", return_value=time.time() + 3600):
+        assert not mirror.is_fresh()
+
+
+@pytest.mark.asyncio
+async def test_reload_picks_up_new_build(mirror_dir):
+    mirror = VectorMirror(directory=mirror_dir)
+    mirror.load()
+    old_build = mirror.build_name
+    assert mirror.reloaded() is None
+
+    with patch("clients.search.vector_mirror.time.time", return_value=time.time() + 10):
+        await build_vector_mirror(_collection(OBJECTS[:2]), directory=mirror_dir, quantize=False)
+    reloaded = mirror.reloaded()
+
+    assert reloaded.build_name != old_build
+    assert len(reloaded) == 2
+    # Старый объект не меняется — идущий по нему поиск дорабатывает по своей сборке
+    assert mirror.build_name == old_build
+    assert os.path.exists(os.path.join(mirror_dir, old_build))
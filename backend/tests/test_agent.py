@@ -1,6 +1,7 @@
 """Tests for agent functionality: tools, prompts, conversions, tool call parsing."""
 import os
 import json
+import asyncio
 import pytest
 from datetime import datetime
 from unittest.mock import AsyncMock, MagicMock, patch
@@ -701,3 +702,201 @@ class TestAgentMovieNameParsing:
         assert len(results) == 1
         assert results[0]["movie_name"] == "Интерстеллар"
         assert results[0]["query"] == ""
+
+
+# ── Pipelined rerank streaming ───────────────────────────────────────
+
+class TestPipelinedRerank:
+    @staticmethod
+    def _chunk(text: str):
+        chunk = MagicMock()
+        chunk.choices = [MagicMock()]
+        chunk.choices[0].delta.content = text
+        return chunk
+
+    def _agent(self, movies, stream, exclude=()):
+        recommender = MagicMock()
+        recommender.recommend = AsyncMock(return_value=movies)
+        openai_client = MagicMock()
+        openai_client.chat.completions.create = AsyncMock(return_value=stream)
+        agent = MovieAgent(openai_client=openai_client, kp_client=MagicMock(), recommender=recommender)
+        agent._get_user_excluded_kp_ids = AsyncMock(return_value=set(exclude))
+        return agent
+
+    @staticmethod
+    def _movies(count):
+        return [
+            {"kp_id": i, "name": f"Фильм {i}", "title": f"Movie {i}", "year": 2000,
+             "rating_kp": 7.0, "rating_imdb": 7.0, "page_content": ""}
+            for i in range(1, count + 1)
+        ]
+
+    @pytest.mark.asyncio
+    async def test_first_card_sent_before_rerank_stream_ends(self):
+        release = asyncio.Event()
+
+        async def stream():
+            yield self._chunk("3\n")
+            await release.wait()
+            yield self._chunk("1\n")
+
+        agent = self._agent(self._movies(3), stream())
+        with patch("clients.movie_agent.AsyncSessionFactory", MagicMock()):
+            cards = agent.run_movie_streaming(user_id=1, query="про космос")
+            first = await asyncio.wait_for(cards.__anext__(), timeout=1)
+            release.set()
+            rest = [card async for card in cards]
+
+        assert first["movie_id"] == 3
+        assert [card["movie_id"] for card in rest] == [1, 2]
+
+    @pytest.mark.asyncio
+    async def test_tail_dedup_and_exclusions_kept(self):
+        async def stream():
+            yield self._chunk("2\n2\n")
+            yield self._chunk("4")  # последняя строка без перевода строки
+
+        agent = self._agent(self._movies(4), stream(), exclude={3})
+        with patch("clients.movie_agent.AsyncSessionFactory", MagicMock()):
+            cards = [card async for card in agent.run_movie_streaming(user_id=1, query="про космос")]
+
+        assert [card["movie_id"] for card in cards] == [2, 4, 1]
+
+    @pytest.mark.asyncio
+    async def test_rerank_failure_continues_with_remaining_movies(self):
+        async def stream():
+            yield self._chunk("2\n")
+            raise RuntimeError("stream broken")
+
+        agent = self._agent(self._movies(3), stream())
+        with patch("clients.movie_agent.AsyncSessionFactory", MagicMock()):
+            cards = [card async for card in agent.run_movie_streaming(user_id=1, query="про космос")]
+
+        assert [card["movie_id"] for card in cards] == [2, 1, 3]
+
+    @pytest.mark.asyncio
+    async def test_fast_start_sends_provisional_cards_then_reranked_order(self):
+        release = asyncio.Event()
+
+        async def stream():
+            await release.wait()
+            yield self._chunk("1\n5\n4\n")
+
+        agent = self._agent(self._movies(5), stream())
+        with patch("clients.movie_agent.AsyncSessionFactory", MagicMock()), \
+                patch("clients.movie_agent.FAST_START_CARDS", 2):
+            cards = agent.run_movie_streaming(user_id=1, query="про космос", fast_start=True)
+            provisional = [await asyncio.wait_for(cards.__anext__(), timeout=1) for _ in range(2)]
+            release.set()
+            rest = [card async for card in cards]
+
+        assert [(card["movie_id"], card.get("provisional")) for card in provisional] == [(1, True), (2, True)]
+        # Уже показанный фильм 1 реранк не повторяет, непрошедшие через модель — в конце
+        assert [(card["movie_id"], card.get("provisional")) for card in rest] == [(5, None), (4, None), (3, None)]
+
+    @pytest.mark.asyncio
+    async def test_fast_start_falls_back_to_vector_order_after_budget(self):
+        async def stream():
+            await asyncio.sleep(10)
+            yield self._chunk("3\n")
+
+        agent = self._agent(self._movies(3), stream())
+        with patch("clients.movie_agent.AsyncSessionFactory", MagicMock()), \
+                patch("clients.movie_agent.FAST_START_CARDS", 1), \
+                patch("clients.movie_agent.FAST_START_RERANK_BUDGET", 0.01):
+            cards = [card async for card in agent.run_movie_streaming(user_id=1, query="q", fast_start=True)]
+
+        assert [card["movie_id"] for card in cards] == [1, 2, 3]
+
+    @pytest.mark.asyncio
+    async def test_repeated_rerank_served_from_cache(self):
+        from clients.rerank import RerankCache
+
+        async def stream():
+            yield self._chunk("3\n1\n")
+
+        agent = self._agent(self._movies(3), stream())
+        agent.rerank_cache = RerankCache()
+        with patch("clients.movie_agent.AsyncSessionFactory", MagicMock()):
+            first = [card async for card in agent.run_movie_streaming(user_id=1, query="про космос")]
+            second = [card async for card in agent.run_movie_streaming(user_id=1, query="Про  космос")]
+
+        assert agent.openai_client.chat.completions.create.await_count == 1
+        assert [card["movie_id"] for card in first] == [card["movie_id"] for card in second] == [3, 1, 2]
+
+    @staticmethod
+    def _local_reranker(order):
+        reranker = MagicMock()
+
+        async def rank(query, movies):
+            by_kp_id = {m["kp_id"]: m for m in movies}
+            return [by_kp_id[kp_id] for kp_id in order if kp_id in by_kp_id]
+
+        reranker.rank = AsyncMock(side_effect=rank)
+        return reranker
+
+    @pytest.mark.asyncio
+    async def test_local_order_used_for_tail_after_rerank_failure(self):
+        release = asyncio.Event()
+
+        async def stream():
+            await release.wait()
+            yield self._chunk("2\n")
+            raise RuntimeError("stream broken")
+
+        agent = self._agent(self._movies(4), stream())
+        agent.local_reranker = self._local_reranker([4, 3, 2, 1])
+        with patch("clients.movie_agent.AsyncSessionFactory", MagicMock()), \
+                patch("clients.movie_agent.FAST_START_CARDS", 1):
+            cards = agent.run_movie_streaming(user_id=1, query="про космос", fast_start=True)
+            first = await asyncio.wait_for(cards.__anext__(), timeout=1)
+            # Первая карточка не ждёт локальный реранк
+            agent.local_reranker.rank.assert_not_called()
+            release.set()
+            rest = [card async for card in cards]
+
+        assert (first["movie_id"], first.get("provisional")) == (1, True)
+        assert [card["movie_id"] for card in rest] == [2, 4, 3]
+
+    @pytest.mark.asyncio
+    async def test_local_reranker_not_called_when_llm_succeeds(self):
+        async def stream():
+            yield self._chunk("3\n")
+
+        agent = self._agent(self._movies(3), stream())
+        agent.local_reranker = self._local_reranker([2, 3, 1])
+        with patch("clients.movie_agent.AsyncSessionFactory", MagicMock()):
+            cards = [card async for card in agent.run_movie_streaming(user_id=1, query="про космос")]
+
+        agent.local_reranker.rank.assert_not_called()
+        assert [card["movie_id"] for card in cards] == [3, 1, 2]
+
+    @pytest.mark.asyncio
+    async def test_overloaded_llm_skipped_for_local_order(self):
+        from clients.rerank import RerankLoad
+
+        agent = self._agent(self._movies(3), None)
+        agent.local_reranker = self._local_reranker([2, 3, 1])
+        agent.rerank_load = RerankLoad(max_in_flight=0)
+        with patch("clients.movie_agent.AsyncSessionFactory", MagicMock()):
+            cards = [card async for card in agent.run_movie_streaming(user_id=1, query="про космос")]
+
+        agent.openai_client.chat.completions.create.assert_not_called()
+        assert [card["movie_id"] for card in cards] == [2, 3, 1]
+        assert agent.rerank_load.stats()["shed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_prefilter_limits_llm_candidates(self):
+        async def stream():
+            yield self._chunk("2\n")
+
+        agent = self._agent(self._movies(4), stream())
+        agent.local_reranker = self._local_reranker([4, 2, 1, 3])
+        with patch("clients.movie_agent.AsyncSessionFactory", MagicMock()), \
+                patch("clients.movie_agent.LOCAL_RERANK_PREFILTER_SIZE", 2):
+            cards = [card async for card in agent.run_movie_streaming(user_id=1, query="про космос")]
+
+        prompt = agent.openai_client.chat.completions.create.call_args.kwargs["messages"][1]["content"]
+        assert "Фильм 3" not in prompt
+        # "2" — номер в промпте из двух кандидатов [4, 2]
+        assert [card["movie_id"] for card in cards] == [2, 4, 1, 3]